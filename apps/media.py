@@ -0,0 +1,22 @@
+"""Media controls shared by several apps."""
+
+from utils.apps.key import Key
+from utils.apps.layers import Layer
+from utils.commands import ConsumerControlCode, Media
+from utils.constants import COLOR_MEDIA
+
+
+class MediaLayer(Layer):
+    """Track controls on the bottom row and volume on the encoder."""
+
+    name = "Media"
+
+    # Fourth row
+    key_9 = Key("<<", COLOR_MEDIA, Media(ConsumerControlCode.SCAN_PREVIOUS_TRACK))
+    key_10 = Key(">||", COLOR_MEDIA, Media(ConsumerControlCode.PLAY_PAUSE))
+    key_11 = Key(">>", COLOR_MEDIA, Media(ConsumerControlCode.SCAN_NEXT_TRACK))
+
+    encoder_button = Media(ConsumerControlCode.MUTE)
+
+    encoder_increase = Media(ConsumerControlCode.VOLUME_INCREMENT)
+    encoder_decrease = Media(ConsumerControlCode.VOLUME_DECREMENT)
@@ -1,15 +1,9 @@
 """Hotkeys for Spotify."""
 
-from utils.apps.key import Key, KeyApp, MacroKey
-from utils.commands import (
-    ConsumerControlCode,
-    Keycode,
-    MacroCommand,
-    Media,
-    Press,
-    PreviousAppCommand,
-    Sequence,
-)
+from apps.media import MediaLayer
+from utils.apps.key import Key, MacroKey
+from utils.apps.layers import LayeredKeyApp
+from utils.commands import Keycode, MacroCommand, Press, PreviousAppCommand, Sequence
 from utils.constants import (
     COLOR_2,
     COLOR_BACK,
@@ -20,9 +14,11 @@ from utils.constants import (
 )
 
 
-class SpotifyApp(KeyApp):
+class SpotifyApp(LayeredKeyApp):
     name = "Spotify"
 
+    base_layers = (MediaLayer,)
+
     key_0 = MacroKey(
         "Exit",
         COLOR_CLOSE,
@@ -81,12 +77,6 @@ class SpotifyApp(KeyApp):
         Press(Keycode.SHIFT, Keycode.RIGHT_ARROW),
     )
 
-    # Fourth row
-    key_9 = Key("<<", COLOR_MEDIA, Media(ConsumerControlCode.SCAN_PREVIOUS_TRACK))
-    key_10 = Key(">||", COLOR_MEDIA, Media(ConsumerControlCode.PLAY_PAUSE))
-    key_11 = Key(">>", COLOR_MEDIA, Media(ConsumerControlCode.SCAN_NEXT_TRACK))
-
-    encoder_button = Media(ConsumerControlCode.MUTE)
     encoder_increase = MacroCommand(
         Press(Keycode.CONTROL, Keycode.UP_ARROW),
         **{OS_MAC: Press(Keycode.COMMAND, Keycode.UP_ARROW)}
@@ -1,14 +1,9 @@
 """Hotkeys for switching between desktop apps."""
 
-try:
-    from typing import Optional
-except ImportError:
-    pass
-
 from apps.chrome import ChromeApp
 from apps.spotify import SpotifyApp
-from utils.app_pad import AppPad
-from utils.apps.key import Key, KeyApp, KeyAppSettings, MacroKey
+from utils.apps.base import LazyApp
+from utils.apps.key import Key, KeyApp, MacroKey
 from utils.commands import (
     ConsumerControlCode,
     Keycode,
@@ -35,6 +30,10 @@ from utils.constants import (
     OS_MAC,
 )
 
+# Shared by the default and OS-specific commands so each app is built once
+CHROME_APP = LazyApp(ChromeApp)
+SPOTIFY_APP = LazyApp(SpotifyApp)
+
 
 class AppSwitcherApp(KeyApp):
     """
@@ -69,6 +68,18 @@ class AppSwitcherApp(KeyApp):
         COLOR_SPOTIFY,
         Press(Keycode.WINDOWS, Keycode.SEVEN),
         mac_command=Press(Keycode.COMMAND, Keycode.OPTION, Keycode.CONTROL, Keycode.S),
+        double_tap_command=MacroCommand(
+            Sequence(
+                Press(Keycode.WINDOWS, Keycode.SEVEN),
+                SwitchAppCommand(SPOTIFY_APP),
+            ),
+            **{
+                OS_MAC: Sequence(
+                    Press(Keycode.COMMAND, Keycode.OPTION, Keycode.CONTROL, Keycode.S),
+                    SwitchAppCommand(SPOTIFY_APP),
+                ),
+            }
+        ),
     )
 
     key_6 = MacroKey(
@@ -99,6 +110,20 @@ class AppSwitcherApp(KeyApp):
             Release(Keycode.ONE, Keycode.WINDOWS),
         ),
         mac_command=Press(Keycode.COMMAND, Keycode.CONTROL, Keycode.OPTION, Keycode.C),
+        double_tap_command=MacroCommand(
+            Sequence(
+                Press(Keycode.WINDOWS, Keycode.ONE),
+                Wait(0.1),
+                Release(Keycode.ONE, Keycode.WINDOWS),
+                SwitchAppCommand(CHROME_APP),
+            ),
+            **{
+                OS_MAC: Sequence(
+                    Press(Keycode.COMMAND, Keycode.CONTROL, Keycode.OPTION, Keycode.C),
+                    SwitchAppCommand(CHROME_APP),
+                ),
+            }
+        ),
     )
     key_10 = MacroKey(
         "Notion",
@@ -117,66 +142,3 @@ class AppSwitcherApp(KeyApp):
 
     encoder_increase = Media(ConsumerControlCode.VOLUME_INCREMENT)
     encoder_decrease = Media(ConsumerControlCode.VOLUME_DECREMENT)
-
-    def __init__(self, app_pad: AppPad, settings: Optional[KeyAppSettings] = None):
-        self.initialize_settings_dependent_keys(app_pad, settings)
-        super().__init__(app_pad, settings=settings)
-
-    @classmethod
-    def initialize_settings_dependent_keys(
-        cls, app_pad: AppPad, settings: Optional[KeyAppSettings] = None
-    ):
-        chrome_app = ChromeApp(app_pad, settings)
-        spotify_app = SpotifyApp(app_pad, settings)
-
-        cls.key_5 = MacroKey(
-            "Spotify",
-            COLOR_SPOTIFY,
-            Press(Keycode.WINDOWS, Keycode.SEVEN),
-            mac_command=Press(
-                Keycode.COMMAND, Keycode.OPTION, Keycode.CONTROL, Keycode.S
-            ),
-            double_tap_command=MacroCommand(
-                Sequence(
-                    Press(Keycode.WINDOWS, Keycode.SEVEN),
-                    SwitchAppCommand(spotify_app),
-                ),
-                **{
-                    OS_MAC: Sequence(
-                        Press(
-                            Keycode.COMMAND, Keycode.OPTION, Keycode.CONTROL, Keycode.S
-                        ),
-                        SwitchAppCommand(spotify_app),
-                    ),
-                }
-            ),
-        )
-
-        cls.key_9 = MacroKey(
-            "Chrome",
-            COLOR_CHROME,
-            Sequence(
-                Press(Keycode.WINDOWS, Keycode.ONE),
-                Wait(0.1),
-                Release(Keycode.ONE, Keycode.WINDOWS),
-            ),
-            mac_command=Press(
-                Keycode.COMMAND, Keycode.CONTROL, Keycode.OPTION, Keycode.C
-            ),
-            double_tap_command=MacroCommand(
-                Sequence(
-                    Press(Keycode.WINDOWS, Keycode.ONE),
-                    Wait(0.1),
-                    Release(Keycode.ONE, Keycode.WINDOWS),
-                    SwitchAppCommand(chrome_app),
-                ),
-                **{
-                    OS_MAC: Sequence(
-                        Press(
-                            Keycode.COMMAND, Keycode.CONTROL, Keycode.OPTION, Keycode.C
-                        ),
-                        SwitchAppCommand(chrome_app),
-                    ),
-                }
-            ),
-        )
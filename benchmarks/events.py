@@ -0,0 +1,129 @@
+"""
+Benchmark dispatching events through a KeyApp.
+
+Run this from the REPL on the macropad with `import benchmarks.events`, or on
+a computer with the CircuitPython libraries available.
+
+COUNT events of each type are sent to the numpad app through process_event,
+then the key events are sent through the event pipeline, which detects
+double-taps for the numpad's tracked keys. The app runs against a macropad whose HID devices, pixels and display do
+nothing, so only the cost of dispatching the events and running the key
+commands is measured.
+"""
+
+import time
+
+from apps.numpad import NumpadApp
+from utils.app_pad import (
+    DOUBLE_TAP_EVENT,
+    ENCODER_BUTTON_EVENT,
+    ENCODER_EVENT,
+    KEY_EVENT,
+    DoubleTapEvent,
+    EncoderButtonEvent,
+    EncoderEvent,
+    KeyEvent,
+)
+from utils.apps.key import KeyAppSettings
+from utils.hid import HidState
+
+COUNT = 2000
+
+
+class _NullDevice:
+    def press(self, *args):
+        pass
+
+    def release(self, *args):
+        pass
+
+    def release_all(self):
+        pass
+
+    def move(self, *args):
+        pass
+
+    def write(self, *args):
+        pass
+
+    def send(self, *args):
+        pass
+
+
+class _NullPixels(list):
+    def show(self):
+        pass
+
+
+class _NullMacropad:
+    keyboard = _NullDevice()
+    keyboard_layout = _NullDevice()
+    consumer_control = _NullDevice()
+    mouse = _NullDevice()
+
+    def __init__(self):
+        self.pixels = _NullPixels([0] * 12)
+
+
+class _NullHistory:
+    def pop(self):
+        return None
+
+
+class _NullAppPad:
+    idle_time = 0.0
+
+    def __init__(self):
+        self.macropad = _NullMacropad()
+        self.pixels = self.macropad.pixels
+        self.history = _NullHistory()
+        self.keys_down = 0
+        self.hid = HidState(self)
+
+    def add_timer(self, *args, **kwargs):
+        pass
+
+    def delete_timer(self, *args):
+        pass
+
+
+def measure(label: str, process_event, events):
+    start = time.monotonic_ns()
+    for event in events:
+        process_event(event)
+    elapsed = time.monotonic_ns() - start
+    print(
+        "{0:<20} {1:>10.0f} events/s {2:>8.2f} us/event".format(
+            label, len(events) * 1e9 / elapsed, elapsed / 1000 / len(events)
+        )
+    )
+
+
+def run():
+    app = NumpadApp(_NullAppPad(), KeyAppSettings())
+    app.compile_event_handlers()
+
+    keys = [
+        KeyEvent(KEY_EVENT, n % 12, pressed)
+        for n in range(COUNT // 2)
+        for pressed in (True, False)
+    ]
+    double_taps = [
+        DoubleTapEvent(DOUBLE_TAP_EVENT, n % 12, pressed)
+        for n in range(COUNT // 2)
+        for pressed in (True, False)
+    ]
+    encoder = [EncoderEvent(ENCODER_EVENT, n + 1, n) for n in range(COUNT)]
+    encoder_button = [
+        EncoderButtonEvent(ENCODER_BUTTON_EVENT, n % 2 == 0) for n in range(COUNT)
+    ]
+
+    measure("key", app.process_event, keys)
+    measure("double tap", app.process_event, double_taps)
+    measure("encoder", app.process_event, encoder)
+    measure("encoder button", app.process_event, encoder_button)
+    measure("mixed", app.process_event, keys + double_taps + encoder + encoder_button)
+    measure("key (pipeline)", app.compile_pipeline(), keys)
+
+
+run()
@@ -0,0 +1,101 @@
+"""
+Report how many duplicate keys and commands interning folds, and the memory
+it saves.
+
+Run this from the REPL on the macropad with `import benchmarks.interning`, or
+on a computer with the CircuitPython libraries available, where tracemalloc
+gives exact figures.
+
+Every app module is imported, then the average size of an instance of each
+interned class is measured by creating its instances again with interning
+disabled. Each folded duplicate saves one instance for as long as the apps
+are loaded. The interning cache costs the memory it frees when cleared, but
+only while the apps are imported, since code.py clears it afterwards.
+"""
+
+import gc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from utils import interning
+
+MODULES = (
+    "apps.func",
+    "apps.nav",
+    "apps.numpad",
+    "apps.window",
+    "apps.chrome",
+    "apps.media",
+    "apps.spotify",
+    "apps.switcher",
+    "apps.home",
+)
+
+
+def allocated() -> int:
+    gc.collect()
+    if tracemalloc is not None:
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        return -gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+def instance_size(cls: type) -> int:
+    calls = list(interning.interned_calls(cls))
+    if not calls:
+        return 0
+    instances = [None] * len(calls)
+    interning.enabled = False
+    start = allocated()
+    for index, (args, kwargs) in enumerate(calls):
+        instances[index] = cls(*args, **kwargs)
+    size = allocated() - start
+    interning.enabled = True
+    return size // len(calls)
+
+
+def run():
+    if tracemalloc is not None:
+        tracemalloc.start()
+    for name in MODULES:
+        __import__(name)
+
+    print(
+        "{0:<24} {1:>8} {2:>8} {3:>8} {4:>8}".format(
+            "Class", "Unique", "Folded", "Size", "Saved"
+        )
+    )
+    total_unique = total_folded = total_saved = 0
+    for cls, (unique, folded) in sorted(
+        interning.stats().items(), key=lambda item: item[0].__name__
+    ):
+        size = instance_size(cls)
+        print(
+            "{0:<24} {1:>8} {2:>8} {3:>8} {4:>8}".format(
+                cls.__name__, unique, folded, size, size * folded
+            )
+        )
+        total_unique += unique
+        total_folded += folded
+        total_saved += size * folded
+
+    start = allocated()
+    interning.clear()
+    cache = start - allocated()
+
+    print(
+        "{0:<24} {1:>8} {2:>8} {3:>17}".format(
+            "Total", total_unique, total_folded, total_saved
+        )
+    )
+    print("{0:<24} {1:>35}".format("Interning cache", -cache))
+    print("{0:<24} {1:>35}".format("Net while importing", total_saved - cache))
+    print("{0:<24} {1:>35}".format("Net after clear", total_saved))
+
+
+run()
@@ -0,0 +1,68 @@
+"""
+Benchmark loading layout files against importing an equivalent app module.
+
+Run this from the REPL on the macropad with `import benchmarks.layouts`.
+
+Set DIRECTORY to a directory of layout files. Each layout is loaded through
+the cache, then its app class is built and constructed. For comparison,
+MODULE is imported and its app constructed, which is what a hand-written
+layout costs.
+"""
+
+import gc
+import sys
+import time
+
+from utils.app_pad import AppPad
+from utils.apps.key import KeyAppSettings
+from utils.apps.layout_file import LayoutLibrary
+
+DIRECTORY = "layouts"
+MODULE = "apps.chrome"
+CLASS_NAME = "ChromeApp"
+
+
+def mem_free() -> int:
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+def measure(label: str, func):
+    gc.collect()
+    start_free = mem_free()
+    start = time.monotonic()
+    result = func()
+    elapsed = time.monotonic() - start
+    gc.collect()
+    print(
+        "{0:<28} {1:>8.1f} ms {2:>8} bytes".format(
+            label, elapsed * 1000, start_free - mem_free()
+        )
+    )
+    return result
+
+
+def run():
+    app_pad = AppPad()
+    settings = KeyAppSettings()
+    print("{0:<28} {1:>11} {2:>14}".format("Phase", "Time", "Allocated"))
+
+    entries = measure("load layouts", LayoutLibrary(DIRECTORY).load)
+    measure(
+        "build layout apps",
+        lambda: [entry(app_pad, settings) for entry in entries],
+    )
+
+    def import_module():
+        sys.modules.pop(MODULE, None)
+        module = __import__(MODULE, None, None, [CLASS_NAME])
+        return getattr(module, CLASS_NAME)
+
+    app_class = measure("import " + MODULE, import_module)
+    measure("construct " + CLASS_NAME, lambda: app_class(app_pad, settings))
+    print("Layouts loaded: %s" % len(entries))
+
+
+run()
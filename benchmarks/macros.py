@@ -0,0 +1,133 @@
+"""
+Benchmark compiled macros against the Command object trees they replace.
+
+Run this from the REPL on the macropad with `import benchmarks.macros`.
+
+COUNT copies of a typical Sequence macro are built as Command objects,
+compiled to MacroPrograms and saved to a macro bank on flash. For each form,
+the memory held and the time to run every macro are reported. The macros run
+against a macropad whose HID devices do nothing, so only the overhead of
+running the macro is measured.
+"""
+
+import gc
+import time
+
+from utils.commands import Keycode, Media, Press, Release, Sequence, Text, Wait
+from utils.hid import HidState
+from utils.macro_vm import MacroBank, compile_command, save_bank
+
+COUNT = 100
+BANK_PATH = "/macro_benchmark.bin"
+
+
+class _NullDevice:
+    def press(self, *args):
+        pass
+
+    def release(self, *args):
+        pass
+
+    def release_all(self):
+        pass
+
+    def move(self, *args):
+        pass
+
+    def write(self, *args):
+        pass
+
+
+class _NullMacropad:
+    keyboard = _NullDevice()
+    keyboard_layout = _NullDevice()
+    consumer_control = _NullDevice()
+    mouse = _NullDevice()
+
+
+class _NullAppPad:
+    def __init__(self):
+        self.macropad = _NullMacropad()
+        self.keys_down = 0
+        self.hid = HidState(self)
+
+    def add_timer(self, *args, **kwargs):
+        pass
+
+    def delete_timer(self, *args):
+        pass
+
+
+class _NullApp:
+    app_pad = _NullAppPad()
+    macropad = app_pad.macropad
+
+
+def mem_free() -> int:
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+def measure(label: str, func):
+    gc.collect()
+    start_free = mem_free()
+    start = time.monotonic()
+    result = func()
+    elapsed = time.monotonic() - start
+    gc.collect()
+    print(
+        "{0:<28} {1:>8.1f} ms {2:>8} bytes".format(
+            label, elapsed * 1000, start_free - mem_free()
+        )
+    )
+    return result
+
+
+def build_macro(number: int):
+    return Sequence(
+        Press(Keycode.CONTROL, Keycode.SHIFT, Keycode.P),
+        Release(Keycode.CONTROL, Keycode.SHIFT, Keycode.P),
+        Wait(0),
+        Text("command %s" % number),
+        Press(Keycode.ENTER),
+        Release(Keycode.ENTER),
+        Media(0xE9),
+    )
+
+
+def run_all(commands):
+    app = _NullApp()
+    for command in commands:
+        command.execute(app)
+        command.undo(app)
+
+
+def run():
+    print("{0:<28} {1:>11} {2:>14}".format("Phase", "Time", "Allocated"))
+    trees = measure(
+        "build object trees", lambda: [build_macro(n) for n in range(COUNT)]
+    )
+    measure("run object trees", lambda: run_all(trees))
+
+    programs = measure("compile programs", lambda: [compile_command(t) for t in trees])
+    del trees
+    measure("run programs", lambda: run_all(programs))
+
+    try:
+        save_bank(BANK_PATH, {str(n): p for n, p in enumerate(programs)})
+    except OSError as err:
+        # The filesystem is read-only unless boot.py remounts it
+        print("Unable to write %s: %s" % (BANK_PATH, err))
+        return
+    del programs
+
+    bank = measure("load macro bank", lambda: MacroBank(BANK_PATH))
+    macros = measure(
+        "flash macro commands", lambda: [bank.command(str(n)) for n in range(COUNT)]
+    )
+    measure("run flash macros", lambda: run_all(macros))
+
+
+run()
@@ -0,0 +1,92 @@
+"""
+Report the memory held by each app's keys, commands and bound keys.
+
+Run this from the REPL on the macropad with `import benchmarks.memory`, or on
+a computer with the CircuitPython libraries available, where tracemalloc
+gives exact figures.
+
+Each app module is imported, which builds its Key and Command objects, then
+the app is constructed, which binds its keys. The bytes held after each step
+are reported per app. The modules shared by every app are imported first, so
+they aren't counted against any app. An app module that imports another app
+module is counted for both, so apps are listed with the fewest imports first.
+"""
+
+import gc
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from utils.apps.key import KeyAppSettings
+
+APPS = (
+    ("apps.func", "FuncKeysApp"),
+    ("apps.nav", "NavApp"),
+    ("apps.numpad", "NumpadApp"),
+    ("apps.window", "WindowManagementApp"),
+    ("apps.chrome", "ChromeApp"),
+    ("apps.spotify", "SpotifyApp"),
+    ("apps.switcher", "AppSwitcherApp"),
+    ("apps.home", "HomeApp"),
+)
+
+
+class _NullAppPad:
+    macropad = None
+
+
+def allocated() -> int:
+    gc.collect()
+    if tracemalloc is not None:
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        return -gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+def measure_app(module_name: str, class_name: str, settings):
+    start = allocated()
+    module = __import__(module_name, None, None, [class_name])
+    app_class = getattr(module, class_name)
+    app_class.compile_layout()
+    imported = allocated()
+
+    app = app_class(_NullAppPad(), settings)
+    constructed = allocated()
+
+    print(
+        "{0:<24} {1:>10} {2:>10} {3:>10}".format(
+            class_name,
+            imported - start,
+            constructed - imported,
+            constructed - start,
+        )
+    )
+    return app, constructed - start
+
+
+def run():
+    if tracemalloc is not None:
+        tracemalloc.start()
+    settings = KeyAppSettings()
+
+    print("{0:<24} {1:>10} {2:>10} {3:>10}".format("App", "Keys", "Bound", "Total"))
+    apps = []
+    total = 0
+    for module_name, class_name in APPS:
+        if module_name in sys.modules:
+            print("%s was already imported, skipping" % module_name)
+            continue
+        app, size = measure_app(module_name, class_name, settings)
+        apps.append(app)
+        total += size
+
+    if apps:
+        print("{0:<24} {1:>32}".format("Average per app", total // len(apps)))
+
+
+run()
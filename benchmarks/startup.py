@@ -0,0 +1,77 @@
+"""
+Benchmark the time and memory used to boot the default app.
+
+Run this from the REPL on the macropad with `import benchmarks.startup`.
+
+It measures importing the default settings (which imports the full apps
+tree), constructing the default app, and then forcing every lazily
+referenced app to be constructed, which is the cost that used to be paid at
+boot.
+"""
+
+import gc
+import time
+
+from utils.app_pad import AppPad
+
+
+def mem_free() -> int:
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+def measure(label: str, func):
+    gc.collect()
+    start_free = mem_free()
+    start = time.monotonic()
+    result = func()
+    elapsed = time.monotonic() - start
+    gc.collect()
+    print(
+        "{0:<28} {1:>8.1f} ms {2:>8} bytes".format(
+            label, elapsed * 1000, start_free - mem_free()
+        )
+    )
+    return result
+
+
+def build_all(app_pad, app):
+    """Construct every app reachable from app and return how many were built."""
+    seen = set()
+    pending = [app]
+    count = 0
+    while pending:
+        current = pending.pop()
+        for lazy_app in current.switch_targets():
+            if lazy_app not in seen:
+                seen.add(lazy_app)
+                pending.append(lazy_app.get(app_pad, current.settings))
+                count += 1
+    return count
+
+
+def run():
+    print("{0:<28} {1:>11} {2:>14}".format("Phase", "Time", "Allocated"))
+    app_pad = measure("AppPad()", AppPad)
+
+    def import_default_app():
+        try:
+            from user import DEFAULT_APP
+        except ImportError:
+            from default_settings import DEFAULT_APP
+        return DEFAULT_APP
+
+    default_app = measure("import DEFAULT_APP", import_default_app)
+    app = measure("construct DEFAULT_APP", lambda: default_app(app_pad))
+
+    # Keep every app constructed so the full cost of the tree is measured
+    app_pad.app_cache.max_size = 1000
+    app_pad.app_cache.min_free_memory = 0
+    count = measure("construct lazy apps", lambda: build_all(app_pad, app))
+    print("Lazy apps constructed on demand: %s" % count)
+    print("Free memory after boot: %s bytes" % mem_free())
+
+
+run()
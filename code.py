@@ -5,16 +5,32 @@ It enables you to more easily create complex layouts and has other advanced
 features, including double-tap support.
 """
 
+from utils.profiler import boot_profiler
+
+boot_profiler.start()
+
+from utils import interning
 from utils.app_pad import AppPad
 from utils.commands import AppSwitchException
+from utils.persistence import SettingsStore
 
 try:
     from user import DEFAULT_APP
 except ImportError:
     from default_settings import DEFAULT_APP
 
-app_pad = AppPad()
-current_app = DEFAULT_APP(app_pad)
+# The apps are imported, so identical commands are already shared. Apps
+# imported later create their own.
+interning.clear()
+
+with boot_profiler.section("construct AppPad"):
+    app_pad = AppPad()
+
+with boot_profiler.section("construct DEFAULT_APP"):
+    current_app = DEFAULT_APP(app_pad)
+
+with boot_profiler.section("restore settings"):
+    SettingsStore().persist(app_pad, current_app.settings)
 
 try:
     while True:
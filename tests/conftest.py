@@ -0,0 +1,41 @@
+"""
+Provides stand-ins for the CircuitPython libraries which only run on the
+macropad, so the modules under test can be imported on a computer.
+
+Only the names imported at module level are provided. Tests never construct
+the hardware, and use tests.fakes instead.
+"""
+
+import os
+import sys
+import types
+
+# The code.py run by the macropad shadows the standard library's code module,
+# which pdb imports. Import the standard one first, with the repo hidden.
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_path = sys.path[:]
+sys.path[:] = [path for path in _path if os.path.abspath(path or os.curdir) != _root]
+import code  # noqa: E402,F401
+
+sys.path[:] = _path
+
+
+def _stand_in(name: str, **attributes):
+    try:
+        __import__(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class _MacroPad:
+    def __init__(self):
+        raise RuntimeError("Tests must not construct the macropad hardware")
+
+
+_stand_in("adafruit_macropad", MacroPad=_MacroPad)
+_stand_in("adafruit_hid")
+_stand_in("adafruit_hid.consumer_control_code", ConsumerControlCode=object)
+_stand_in("adafruit_hid.keycode", Keycode=object)
+_stand_in("adafruit_hid.mouse", Mouse=object)
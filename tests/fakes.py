@@ -0,0 +1,145 @@
+"""
+Defines stand-ins for the AppPad and the clock, so code driven by AppPad
+timers can be tested on a computer without waiting in real time.
+"""
+
+from utils.app_pad import KEY_EVENT, KeyEvent
+
+
+class FakeClock:
+    """A time.monotonic replacement which only moves when told to."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeAppPad:
+    """The timer interface of an AppPad, run from a FakeClock.
+
+    Like the AppPad, a timer is removed before its callback runs, and the
+    events returned by callbacks are collected and returned. The IDs of the
+    timers added as quiet are kept in quiet.
+
+    """
+
+    def __init__(self, clock: FakeClock, macropad=None):
+        self.clock = clock
+        self.macropad = macropad
+        self.keys_down = 0
+        self.timers = {}
+        self.added = 0
+        self.quiet = set()
+
+    def add_timer(self, id_, delay, callback, quiet=False):
+        self.timers[id_] = (self.clock.now + delay, callback)
+        self.added += 1
+        if quiet:
+            self.quiet.add(id_)
+        else:
+            self.quiet.discard(id_)
+
+    def delete_timer(self, id_):
+        self.timers.pop(id_, None)
+
+    def advance(self, seconds: float) -> list:
+        """Move the clock forward, running each timer as it becomes due.
+
+        Returns:
+            list: The events returned by the timer callbacks, in order
+        """
+        end = self.clock.now + seconds
+        events = []
+        while True:
+            due = [(when, id_) for id_, (when, _) in self.timers.items() if when <= end]
+            if not due:
+                break
+            when, id_ = min(due)
+            self.clock.now = max(self.clock.now, when)
+            callback = self.timers.pop(id_)[1]
+            result = callback()
+            if result:
+                events.extend(result)
+        self.clock.now = end
+        return events
+
+
+class FakeApp:
+    """The parts of a KeyApp which the pipeline stages read.
+
+    Every key starts with no hold time, chord or repeat rate. Set the tables
+    before binding a stage.
+
+    """
+
+    def __init__(self, app_pad: FakeAppPad):
+        self.app_pad = app_pad
+        self.hold_times = [None] * 12
+
+
+class Harness:
+    """A pipeline stage bound to a FakeApp, recording the events it passes on.
+
+    The tables the stage reads, such as hold_times, are set on the app before
+    the stage is bound. The time each event was passed on is kept in times.
+
+    """
+
+    def __init__(self, stage, app: FakeApp = None, **tables):
+        """Initialize the Harness.
+
+        Args:
+            stage (Stage): The stage to test
+            app (FakeApp, optional): The app to bind the stage to. Defaults to
+                a new FakeApp with its own FakeAppPad and FakeClock.
+            tables: Attributes to set on the app before binding
+        """
+        if app is None:
+            app = FakeApp(FakeAppPad(FakeClock()))
+        for name, value in tables.items():
+            setattr(app, name, value)
+        self.app = app
+        self.app_pad = app.app_pad
+        self.clock = app.app_pad.clock
+        self.stage = stage
+        self.events = []
+        self.times = []
+        self.bind()
+
+    def bind(self):
+        """Bind the stage again, as when the app is focused again."""
+        self.send = self.stage.bind(self.app, self._record)
+
+    def _record(self, event):
+        self.events.append(event)
+        self.times.append(self.clock.now)
+
+    def press(self, *numbers: int):
+        for number in numbers:
+            self.send(key(number, True))
+
+    def release(self, *numbers: int):
+        for number in numbers:
+            self.send(key(number, False))
+
+    def tap(self, *numbers: int):
+        for number in numbers:
+            self.press(number)
+            self.release(number)
+
+    def wait(self, seconds: float):
+        self.app_pad.advance(seconds)
+
+    def take(self) -> list:
+        """Return the events passed on since the last take, and forget them."""
+        events = self.events[:]
+        self.events.clear()
+        self.times.clear()
+        return events
+
+
+def key(number: int, pressed: bool) -> KeyEvent:
+    """Return a KeyEvent for a key number."""
+    return KeyEvent(KEY_EVENT, number, pressed)
@@ -0,0 +1,229 @@
+"""Tests for detecting chords with ChordStage.
+
+Each chord is checked with its keys pressed and released in every order.
+"""
+
+from itertools import permutations
+
+import pytest
+
+from tests.fakes import Harness, key
+from utils.app_pad import CHORD_EVENT, ENCODER_EVENT, ChordEvent, EncoderEvent
+from utils.pipeline import ChordStage, ChordTable, chord_mask
+
+TIMEOUT = 0.05
+
+
+def chord(keys, pressed):
+    return ChordEvent(CHORD_EVENT, chord_mask(keys), pressed)
+
+
+def chord_harness(*chords):
+    """Return a Harness for a ChordStage detecting chords of key numbers."""
+    table = ChordTable(chord_mask(keys) for keys in chords)
+    return Harness(ChordStage(TIMEOUT), chord_table=table)
+
+
+def test_chord_table_marks_complete_and_partial_sets():
+    table = ChordTable((chord_mask((0, 1)), chord_mask((0, 1, 2))))
+    assert table.keys == 0b111
+    assert table.states[0b011] == ChordTable.COMPLETE | ChordTable.PARTIAL
+    assert table.states[0b111] == ChordTable.COMPLETE
+    assert table.states[0b101] == ChordTable.PARTIAL
+    assert table.states[0b001] == ChordTable.PARTIAL
+    assert 0b1000 not in table.states
+
+
+@pytest.mark.parametrize("keys", [(1, 1), (3,), (0, 12), (-1, 0)])
+def test_invalid_chords_are_rejected(keys):
+    with pytest.raises(ValueError):
+        chord_mask(keys)
+
+
+@pytest.mark.parametrize("press_order", list(permutations((0, 1))))
+@pytest.mark.parametrize("release_order", list(permutations((0, 1))))
+def test_two_key_chord_in_every_order(press_order, release_order):
+    harness = chord_harness((0, 1))
+    harness.press(*press_order)
+    # The chord is complete, and not part of a larger one, so it is immediate
+    assert harness.take() == [chord((0, 1), True)]
+
+    harness.release(release_order[0])
+    assert harness.take() == []
+    harness.release(release_order[1])
+    assert harness.take() == [chord((0, 1), False)]
+    assert harness.app.app_pad.timers == {}
+
+
+@pytest.mark.parametrize("press_order", list(permutations((0, 1, 2))))
+@pytest.mark.parametrize("release_order", list(permutations((0, 1, 2))))
+def test_nested_chord_waits_for_the_larger_chord(press_order, release_order):
+    harness = chord_harness((0, 1), (0, 1, 2))
+    harness.press(*press_order[:2])
+    assert harness.take() == []
+    harness.press(press_order[2])
+    assert harness.take() == [chord((0, 1, 2), True)]
+
+    harness.release(*release_order[:2])
+    assert harness.take() == []
+    harness.release(release_order[2])
+    assert harness.take() == [chord((0, 1, 2), False)]
+
+
+@pytest.mark.parametrize("press_order", list(permutations((0, 1))))
+@pytest.mark.parametrize("release_order", list(permutations((0, 1))))
+def test_nested_chord_resolves_to_smaller_chord_on_timeout(press_order, release_order):
+    harness = chord_harness((0, 1), (0, 1, 2))
+    harness.press(*press_order)
+    assert harness.take() == []
+    harness.wait(TIMEOUT)
+    assert harness.take() == [chord((0, 1), True)]
+
+    harness.release(*release_order)
+    assert harness.take() == [chord((0, 1), False)]
+
+
+@pytest.mark.parametrize("press_order", list(permutations((0, 1))))
+def test_nested_chord_resolves_to_smaller_chord_on_release(press_order):
+    harness = chord_harness((0, 1), (0, 1, 2))
+    harness.press(*press_order)
+    harness.release(press_order[0])
+    assert harness.take() == [chord((0, 1), True)]
+    harness.release(press_order[1])
+    assert harness.take() == [chord((0, 1), False)]
+
+
+def overlapping_expectation(press_order):
+    """Return the chord and the loose key for three presses of 0, 1 and 2.
+
+    The chords are (0, 1) and (1, 2), which share key 1. The first two keys
+    make a chord if they can. Otherwise the first key is passed on alone and
+    the second and third make a chord.
+    """
+    first, second, third = press_order
+    if {first, second} in ({0, 1}, {1, 2}):
+        return {first, second}, third, False
+    return {second, third}, first, True
+
+
+@pytest.mark.parametrize("press_order", list(permutations((0, 1, 2))))
+@pytest.mark.parametrize("release_order", list(permutations((0, 1, 2))))
+def test_overlapping_chords_in_every_order(press_order, release_order):
+    harness = chord_harness((0, 1), (1, 2))
+    keys, loose, loose_first = overlapping_expectation(press_order)
+
+    harness.press(*press_order)
+    harness.wait(TIMEOUT)
+    if loose_first:
+        assert harness.take() == [key(loose, True), chord(keys, True)]
+    else:
+        assert harness.take() == [chord(keys, True), key(loose, True)]
+
+    expected = []
+    down = set(keys)
+    for number in release_order:
+        if number == loose:
+            expected.append(key(loose, False))
+        else:
+            down.discard(number)
+            if not down:
+                expected.append(chord(keys, False))
+    harness.release(*release_order)
+    assert harness.take() == expected
+
+
+def test_sequential_chords():
+    harness = chord_harness((0, 1), (1, 2))
+    harness.press(0, 1)
+    harness.release(0, 1)
+    harness.press(2, 1)
+    harness.release(1, 2)
+    assert harness.take() == [
+        chord((0, 1), True),
+        chord((0, 1), False),
+        chord((1, 2), True),
+        chord((1, 2), False),
+    ]
+
+
+def test_lone_chord_key_passes_after_timeout():
+    harness = chord_harness((0, 1))
+    harness.press(0)
+    harness.wait(TIMEOUT / 2)
+    assert harness.take() == []
+    harness.wait(TIMEOUT / 2)
+    assert harness.take() == [key(0, True)]
+    harness.release(0)
+    assert harness.take() == [key(0, False)]
+
+
+def test_lone_chord_key_tap_passes_on_release():
+    harness = chord_harness((0, 1))
+    harness.press(0)
+    harness.release(0)
+    assert harness.take() == [key(0, True), key(0, False)]
+    assert harness.app.app_pad.timers == {}
+
+
+def test_keys_pressed_further_apart_than_timeout_are_not_a_chord():
+    harness = chord_harness((0, 1))
+    harness.press(0)
+    harness.wait(TIMEOUT)
+    harness.press(1)
+    harness.wait(TIMEOUT)
+    harness.release(0, 1)
+    assert harness.take() == [key(0, True), key(1, True), key(0, False), key(1, False)]
+
+
+def test_key_in_no_chord_is_never_delayed():
+    harness = chord_harness((0, 1))
+    harness.press(5)
+    assert harness.take() == [key(5, True)]
+    harness.release(5)
+    assert harness.take() == [key(5, False)]
+
+
+def test_key_in_no_chord_passes_pending_presses_first():
+    harness = chord_harness((0, 1))
+    harness.press(0, 5)
+    assert harness.take() == [key(0, True), key(5, True)]
+    harness.press(1)
+    harness.wait(TIMEOUT)
+    assert harness.take() == [key(1, True)]
+
+
+def test_key_in_no_chord_during_chord_passes_through():
+    harness = chord_harness((0, 1))
+    harness.press(0, 1, 5)
+    harness.release(5, 0, 1)
+    assert harness.take() == [
+        chord((0, 1), True),
+        key(5, True),
+        key(5, False),
+        chord((0, 1), False),
+    ]
+
+
+def test_key_that_breaks_a_chord_passes_the_first_press():
+    harness = chord_harness((0, 1), (2, 3))
+    harness.press(0, 2)
+    assert harness.take() == [key(0, True)]
+    harness.press(3)
+    assert harness.take() == [chord((2, 3), True)]
+
+
+def test_other_events_pass_at_once():
+    harness = chord_harness((0, 1))
+    harness.press(0)
+    event = EncoderEvent(ENCODER_EVENT, 1, 0)
+    harness.send(event)
+    assert harness.take() == [event]
+
+
+def test_unbind_drops_held_presses():
+    harness = chord_harness((0, 1))
+    harness.press(0)
+    harness.stage.unbind()
+    harness.wait(TIMEOUT)
+    assert harness.take() == []
+    assert harness.app.app_pad.timers == {}
@@ -0,0 +1,88 @@
+"""Tests for running the command chosen by a setting."""
+
+import pytest
+
+from utils.apps.key import Key
+from utils.commands import Command, SettingsDependentCommand
+
+
+class Record(Command):
+    """A command which records when it is executed and undone."""
+
+    __slots__ = ("name", "calls")
+
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def execute(self, app):
+        self.calls.append(("execute", self.name))
+
+    def undo(self, app):
+        self.calls.append(("undo", self.name))
+
+
+class App:
+    """An app with nothing but settings."""
+
+    def __init__(self, **settings):
+        self.settings = settings
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def command(calls):
+    return SettingsDependentCommand(
+        "host_os", Record("default", calls), MAC=Record("mac", calls)
+    )
+
+
+def test_resolve_returns_the_command_for_the_setting(command):
+    assert command.resolve(App(host_os="MAC")).name == "mac"
+    assert command.resolve(App(host_os="LIN")).name == "default"
+    assert command.resolve(App()).name == "default"
+
+
+def test_resolve_resolves_nested_commands(calls, command):
+    outer = SettingsDependentCommand("layer", Record("other", calls), ON=command)
+    assert outer.resolve(App(layer="ON", host_os="MAC")).name == "mac"
+
+
+def test_resolve_with_no_command_returns_none():
+    assert SettingsDependentCommand("host_os", None).resolve(App()) is None
+
+
+def test_command_keeps_no_state_between_execute_and_undo(calls, command):
+    app = App(host_os="MAC")
+    command.execute(app)
+    app.settings["host_os"] = "LIN"
+    command.undo(app)
+    assert calls == [("execute", "mac"), ("undo", "default")]
+
+
+def test_key_release_undoes_the_command_pressed(calls, command):
+    app = App(host_os="MAC")
+    key = Key(command=command)
+    pressed = key.press(app)
+    app.settings["host_os"] = "LIN"
+    key.release(app, pressed)
+    assert calls == [("execute", "mac"), ("undo", "mac")]
+
+
+def test_keys_sharing_a_command_release_their_own(calls, command):
+    mac, linux = App(host_os="MAC"), App(host_os="LIN")
+    first, second = Key(command=command), Key(command=command)
+    first_pressed = first.press(mac)
+    second_pressed = second.press(linux)
+    first.release(mac, first_pressed)
+    second.release(linux, second_pressed)
+    assert calls == [
+        ("execute", "mac"),
+        ("execute", "default"),
+        ("undo", "mac"),
+        ("undo", "default"),
+    ]
@@ -0,0 +1,227 @@
+"""Tests for sending HID reports and releasing stuck keys with HidState."""
+
+import pytest
+
+from tests.fakes import FakeAppPad, FakeClock
+from utils.app_pad import ENCODER_SWITCH_BIT
+from utils.constants import TIMER_HID_WATCHDOG
+from utils.hid import HidState
+
+TIMEOUT = HidState.STUCK_TIMEOUT
+SHIFT = 0xE1
+A = 0x04
+B = 0x05
+VOLUME_UP = 0xE9
+
+
+class Device:
+    """A HID device which records the calls made to it."""
+
+    def __init__(self, name, calls):
+        self._name = name
+        self._calls = calls
+
+    def __getattr__(self, method):
+        return lambda *args: self._calls.append((self._name, method) + args)
+
+
+class MacroPad:
+    """The HID devices of a macropad, recording every call in calls."""
+
+    def __init__(self):
+        self.calls = []
+        self.keyboard = Device("keyboard", self.calls)
+        self.keyboard_layout = Device("keyboard_layout", self.calls)
+        self.consumer_control = Device("consumer_control", self.calls)
+        self.mouse = Device("mouse", self.calls)
+
+    def start_tone(self, tone):
+        self.calls.append(("tone", "start", tone))
+
+    def stop_tone(self):
+        self.calls.append(("tone", "stop"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("utils.hid.time.monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def app_pad(clock):
+    return FakeAppPad(clock, MacroPad())
+
+
+@pytest.fixture
+def calls(app_pad):
+    return app_pad.macropad.calls
+
+
+@pytest.fixture
+def hid(app_pad):
+    return HidState(app_pad)
+
+
+def test_press_sends_one_report_for_all_keycodes(hid, calls):
+    hid.press(SHIFT, A)
+    assert calls == [("keyboard", "press", SHIFT, A)]
+    assert set(hid.keys) == {SHIFT, A}
+    assert hid.reports == 1
+
+
+def test_press_with_no_keycodes_sends_nothing(hid, calls):
+    hid.press()
+    assert calls == []
+    assert not hid.pressed
+
+
+def test_release_only_sends_held_keycodes(hid, calls):
+    hid.press(SHIFT, A)
+    hid.release(A, B)
+    assert calls[1:] == [("keyboard", "release", A)]
+    assert set(hid.keys) == {SHIFT}
+
+    hid.release(B)
+    assert calls[2:] == []
+    assert hid.skipped == 1
+
+
+def test_release_all_when_idle_sends_nothing(hid, calls, app_pad):
+    assert not hid.release_all()
+    assert calls == []
+    assert hid.skipped == 1
+
+
+def test_release_all_only_releases_devices_with_something_held(hid, calls):
+    hid.press(A)
+    hid.mouse_press(1)
+    hid.start_tone(440)
+    del calls[:]
+
+    assert hid.release_all()
+    assert calls == [
+        ("keyboard", "release_all"),
+        ("mouse", "release_all"),
+        ("tone", "stop"),
+    ]
+    assert not hid.pressed
+    assert not hid.tone
+
+
+def test_release_all_cancels_the_watchdog(hid, app_pad):
+    hid.press(A)
+    assert TIMER_HID_WATCHDOG in app_pad.timers
+    hid.release_all()
+    assert app_pad.timers == {}
+
+
+def test_consumer_press_releases_the_code_held_before(hid, calls):
+    hid.consumer_press(VOLUME_UP)
+    hid.consumer_press(VOLUME_UP + 1)
+    assert calls == [
+        ("consumer_control", "press", VOLUME_UP),
+        ("consumer_control", "release"),
+        ("consumer_control", "press", VOLUME_UP + 1),
+    ]
+    assert hid.consumer == VOLUME_UP + 1
+
+    hid.consumer_release()
+    hid.consumer_release()
+    assert calls[3:] == [("consumer_control", "release")]
+    assert hid.skipped == 2
+
+
+def test_mouse_release_only_sends_held_buttons(hid, calls):
+    hid.mouse_press(1)
+    hid.mouse_press(2)
+    hid.mouse_release(2 | 4)
+    assert calls[2:] == [("mouse", "release", 2)]
+    assert hid.mouse_buttons == 1
+
+    hid.mouse_release(4)
+    assert calls[3:] == []
+
+
+def test_watchdog_releases_keys_held_past_the_timeout(hid, calls, app_pad, capsys):
+    hid.press(A)
+    app_pad.advance(TIMEOUT - 1)
+    assert hid.keys
+
+    app_pad.advance(1)
+    assert calls[1:] == [("keyboard", "release", A)]
+    assert not hid.pressed
+    assert hid.recovered == 1
+    assert "releasing stuck keys" in capsys.readouterr().out
+    assert app_pad.timers == {}
+
+
+def test_watchdog_waits_for_the_next_oldest_press(hid, calls, app_pad):
+    hid.press(A)
+    app_pad.advance(10)
+    hid.press(B)
+    app_pad.advance(TIMEOUT - 10)
+    assert set(hid.keys) == {B}
+
+    app_pad.advance(10)
+    assert not hid.keys
+    assert hid.recovered == 2
+
+
+def test_watchdog_keeps_keys_whose_macropad_key_is_held(hid, calls, app_pad):
+    # A key bound to Press(SHIFT) is held for longer than the timeout
+    app_pad.keys_down = 1 << 3
+    hid.press(SHIFT)
+    app_pad.advance(TIMEOUT + 1)
+    assert set(hid.keys) == {SHIFT}
+    assert hid.recovered == 0
+
+    # A key left stuck by a command from another macropad key is released
+    app_pad.keys_down = 1 << 5
+    hid.press(B)
+    app_pad.keys_down = 1 << 3
+    app_pad.advance(TIMEOUT)
+    assert set(hid.keys) == {SHIFT}
+    assert hid.recovered == 1
+
+    # Once the macropad key is released, SHIFT is stuck after the timeout
+    app_pad.keys_down = 0
+    app_pad.advance(1)
+    assert set(hid.keys) == {SHIFT}
+    app_pad.advance(TIMEOUT)
+    assert not hid.keys
+    assert hid.recovered == 2
+
+
+def test_watchdog_keeps_media_and_mouse_held_by_encoder_switch(hid, app_pad):
+    app_pad.keys_down = ENCODER_SWITCH_BIT
+    hid.consumer_press(VOLUME_UP)
+    hid.mouse_press(1)
+    app_pad.advance(TIMEOUT * 3)
+    assert hid.consumer == VOLUME_UP
+    assert hid.mouse_buttons == 1
+
+    app_pad.keys_down = 0
+    app_pad.advance(TIMEOUT * 2)
+    assert not hid.pressed
+    assert hid.recovered == 2
+
+
+def test_watchdog_timer_is_quiet(hid, app_pad):
+    hid.press(A)
+    assert TIMER_HID_WATCHDOG in app_pad.quiet
+
+
+def test_no_watchdog_without_a_timeout(app_pad):
+    hid = HidState(app_pad, 0)
+    hid.press(A)
+    assert app_pad.timers == {}
+
+
+def test_report_prints_the_counters(hid, capsys):
+    hid.press(A)
+    hid.release(A)
+    hid.release(A)
+    hid.report()
+    assert capsys.readouterr().out == "HID: 2 reports, 1 skipped, 0 stuck releases\n"
@@ -0,0 +1,111 @@
+"""Tests for detecting held keys with HoldStage."""
+
+import pytest
+
+from tests.fakes import Harness, key
+from utils.app_pad import ENCODER_EVENT, HOLD_EVENT, EncoderEvent, HoldEvent
+from utils.pipeline import HoldStage
+
+HOLD_TIME = 0.3
+
+
+def hold(number, pressed):
+    return HoldEvent(HOLD_EVENT, number, pressed)
+
+
+@pytest.fixture
+def harness():
+    hold_times = [None] * 12
+    hold_times[0] = HOLD_TIME
+    hold_times[1] = 1.0
+    return Harness(HoldStage(), hold_times=hold_times)
+
+
+def test_untracked_key_passes_at_once(harness):
+    harness.press(5)
+    assert harness.take() == [key(5, True)]
+    harness.release(5)
+    assert harness.take() == [key(5, False)]
+
+
+def test_other_events_pass_at_once(harness):
+    event = EncoderEvent(ENCODER_EVENT, 1, 0)
+    harness.send(event)
+    assert harness.take() == [event]
+
+
+def test_tap_passes_press_and_release_on_release(harness):
+    harness.press(0)
+    assert harness.take() == []
+    harness.wait(HOLD_TIME / 2)
+    harness.release(0)
+    assert harness.take() == [key(0, True), key(0, False)]
+
+    # The hold timer was cancelled
+    harness.wait(HOLD_TIME)
+    assert harness.take() == []
+
+
+def test_held_key_becomes_hold_events(harness):
+    harness.press(0)
+    harness.wait(HOLD_TIME)
+    assert harness.take() == [hold(0, True)]
+    harness.release(0)
+    assert harness.take() == [hold(0, False)]
+
+
+def test_each_key_uses_its_own_hold_time(harness):
+    harness.press(1)
+    harness.wait(HOLD_TIME)
+    assert harness.take() == []
+    harness.wait(1.0 - HOLD_TIME)
+    assert harness.take() == [hold(1, True)]
+
+
+def test_other_key_passes_pending_press_first(harness):
+    harness.press(0, 5)
+    assert harness.take() == [key(0, True), key(5, True)]
+
+    # The press was passed on, so it can no longer become a hold
+    harness.wait(HOLD_TIME)
+    harness.release(0, 5)
+    assert harness.take() == [key(0, False), key(5, False)]
+
+
+def test_second_tracked_key_ends_first_hold(harness):
+    harness.press(0, 1)
+    assert harness.take() == [key(0, True)]
+    harness.wait(1.0)
+    assert harness.take() == [hold(1, True)]
+
+    harness.release(0, 1)
+    assert harness.take() == [key(0, False), hold(1, False)]
+
+
+def test_key_pressed_during_hold_is_not_delayed(harness):
+    harness.press(0)
+    harness.wait(HOLD_TIME)
+    harness.tap(5)
+    harness.release(0)
+    assert harness.take() == [
+        hold(0, True),
+        key(5, True),
+        key(5, False),
+        hold(0, False),
+    ]
+
+
+def test_rebinding_keeps_a_hold_in_progress(harness):
+    harness.press(0)
+    harness.wait(HOLD_TIME)
+    harness.bind()
+    harness.release(0)
+    assert harness.take() == [hold(0, True), hold(0, False)]
+
+
+def test_unbind_drops_pending_press(harness):
+    harness.press(0)
+    harness.stage.unbind()
+    harness.wait(HOLD_TIME)
+    assert harness.take() == []
+    assert harness.app_pad.timers == {}
@@ -0,0 +1,178 @@
+"""Tests for matching leader sequences with LeaderStage."""
+
+import pytest
+
+from tests.fakes import FakeApp, FakeAppPad, FakeClock, Harness, key
+from utils.app_pad import ENCODER_EVENT, SEQUENCE_EVENT, EncoderEvent, SequenceEvent
+from utils.pipeline import LeaderStage, compile_sequence_trie
+
+TIMEOUT = 2.0
+
+
+def sequence(value, pressed):
+    return SequenceEvent(SEQUENCE_EVENT, value, pressed)
+
+
+class LeaderApp(FakeApp):
+    """A FakeApp with leader sequences, which records the hints shown."""
+
+    def __init__(self, app_pad: FakeAppPad):
+        super().__init__(app_pad)
+        self.sequence_trie = compile_sequence_trie(
+            {(3, 1, 4): "pi", (3, 1, 5): "pie", (2,): "two"}
+        )
+        self.hints = []
+
+    def show_sequence_hints(self, node, sequence):
+        self.hints.append((sorted(node), tuple(sequence)))
+
+    def hide_sequence_hints(self):
+        self.hints.append(None)
+
+
+@pytest.fixture
+def harness():
+    return Harness(LeaderStage(TIMEOUT), LeaderApp(FakeAppPad(FakeClock())))
+
+
+def test_compile_sequence_trie():
+    trie = compile_sequence_trie({(3, 1, 4): "pi", (3, 1, 5): "pie", (2,): "two"})
+    assert trie == {3: {1: {4: "pi", 5: "pie"}}, 2: "two"}
+
+
+@pytest.mark.parametrize(
+    "sequences",
+    [{(): "empty"}, {(12,): "twelve"}, {(1,): "one", (1, 2): "twelve"}],
+)
+def test_invalid_sequences_are_rejected(sequences):
+    with pytest.raises(ValueError):
+        compile_sequence_trie(sequences)
+
+
+def test_keys_pass_until_started(harness):
+    assert not harness.stage.active
+    harness.tap(3)
+    assert harness.take() == [key(3, True), key(3, False)]
+
+
+def test_start_shows_first_keys(harness):
+    harness.stage.start()
+    assert harness.stage.active
+    assert harness.app.hints == [([2, 3], ())]
+    assert LeaderStage.TIMER_ID in harness.app_pad.timers
+
+
+def test_continuing_a_sequence_is_consumed_and_shows_hints(harness):
+    harness.stage.start()
+    harness.tap(3, 1)
+    assert harness.take() == []
+    assert harness.stage.active
+    assert harness.app.hints == [([2, 3], ()), ([1], (3,)), ([4, 5], (3, 1))]
+
+
+def test_completing_a_sequence_passes_sequence_events(harness):
+    harness.stage.start()
+    harness.tap(3, 1)
+    harness.press(5)
+    assert harness.take() == [sequence("pie", True)]
+    assert not harness.stage.active
+    assert harness.app.hints[-1] is None
+    assert harness.app_pad.timers == {}
+
+    harness.release(5)
+    assert harness.take() == [sequence("pie", False)]
+
+
+def test_one_key_sequence(harness):
+    harness.stage.start()
+    harness.tap(2)
+    assert harness.take() == [sequence("two", True), sequence("two", False)]
+
+
+def test_wrong_key_cancels_and_is_consumed(harness):
+    harness.stage.start()
+    harness.tap(3, 7)
+    assert harness.take() == []
+    assert not harness.stage.active
+    assert harness.app.hints[-1] is None
+    assert harness.app_pad.timers == {}
+
+    # Keys pass again once the sequence is cancelled
+    harness.tap(7)
+    assert harness.take() == [key(7, True), key(7, False)]
+
+
+def test_timeout_cancels(harness):
+    harness.stage.start()
+    harness.wait(TIMEOUT / 2)
+    harness.tap(3)
+
+    # Each key of the sequence restarts the timeout
+    harness.wait(TIMEOUT / 2)
+    assert harness.stage.active
+    harness.wait(TIMEOUT / 2)
+    assert not harness.stage.active
+    assert harness.app.hints[-1] is None
+
+    harness.tap(1)
+    assert harness.take() == [key(1, True), key(1, False)]
+
+
+def test_release_of_key_pressed_before_start_passes(harness):
+    # Like the leader key itself, which starts the sequence when pressed
+    harness.press(0)
+    harness.stage.start()
+    harness.release(0)
+    assert harness.take() == [key(0, True), key(0, False)]
+    assert harness.stage.active
+
+
+def test_release_after_timeout_is_still_consumed(harness):
+    harness.stage.start()
+    harness.press(3)
+    harness.wait(TIMEOUT)
+    harness.release(3)
+    assert harness.take() == []
+
+
+def test_held_sequence_key_released_after_next_sequence(harness):
+    harness.stage.start()
+    harness.press(2)
+    harness.stage.start()
+    harness.tap(3, 1)
+    harness.press(4)
+    # Completing another sequence releases the first one
+    assert harness.take() == [
+        sequence("two", True),
+        sequence("two", False),
+        sequence("pi", True),
+    ]
+
+    harness.release(2, 4)
+    assert harness.take() == [key(2, False), sequence("pi", False)]
+
+
+def test_other_events_pass_while_active(harness):
+    harness.stage.start()
+    event = EncoderEvent(ENCODER_EVENT, 1, 0)
+    harness.send(event)
+    assert harness.take() == [event]
+    assert harness.stage.active
+
+
+def test_cancel_when_not_active_does_nothing(harness):
+    harness.stage.cancel()
+    assert harness.app.hints == []
+
+
+def test_unbind_stops_the_sequence(harness):
+    harness.stage.start()
+    harness.press(3)
+    harness.stage.unbind()
+    assert not harness.stage.active
+    assert harness.app_pad.timers == {}
+
+    # The release of a key consumed before unbinding is no longer consumed
+    harness.bind()
+    harness.release(3)
+    assert harness.take() == [key(3, False)]
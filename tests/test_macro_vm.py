@@ -0,0 +1,53 @@
+"""Tests for compiling commands to macro bytecode."""
+
+import pytest
+
+from utils.commands import Media, MouseMove, Scroll, Sequence, Wait
+from utils.macro_vm import (
+    DELAY,
+    END,
+    MEDIA,
+    MOUSE_MOVE,
+    SCROLL,
+    Assembler,
+    MacroCompileError,
+    compile_command,
+)
+
+
+def test_mouse_move_and_scroll_are_signed():
+    code = Assembler().mouse_move(-32768, 32767).scroll(-1).build()
+    assert code == bytes((MOUSE_MOVE, 0x00, 0x80, 0xFF, 0x7F, SCROLL, 0xFF, 0xFF, END))
+
+
+def test_media_and_delay_are_unsigned():
+    code = Assembler().media(0xFFFF).delay(65.535).build()
+    assert code == bytes((MEDIA, 0xFF, 0xFF, DELAY, 0xFF, 0xFF, END))
+
+
+def test_long_delay_is_split():
+    code = Assembler().delay(70).build()
+    assert code == bytes((DELAY, 0xFF, 0xFF, DELAY, 0x71, 0x11, END))
+
+
+@pytest.mark.parametrize(
+    "assemble",
+    [
+        lambda asm: asm.mouse_move(32768, 0),
+        lambda asm: asm.mouse_move(0, -32769),
+        lambda asm: asm.scroll(40000),
+        lambda asm: asm.media(-1),
+        lambda asm: asm.media(0x10000),
+    ],
+)
+def test_operands_out_of_range_are_rejected(assemble):
+    with pytest.raises(MacroCompileError):
+        assemble(Assembler())
+
+
+@pytest.mark.parametrize(
+    "command", [MouseMove(40000, 0), Scroll(-40000), Media(0x10000)]
+)
+def test_compiling_commands_out_of_range_fails(command):
+    with pytest.raises(MacroCompileError):
+        compile_command(Sequence(Wait(0.1), command))
@@ -0,0 +1,92 @@
+"""Tests for listing the apps in a directory without importing them."""
+
+import os
+
+import pytest
+
+from utils.apps.base import BaseApp
+from utils.manifest import MANIFEST_FILE, scan_source
+
+SOURCE = '''
+from utils.apps.base import BaseApp
+from utils.apps.key import KeyApp
+
+
+@BaseApp.register_app
+class FirstApp(KeyApp):
+    name = "First"
+    color = 0x00FF00
+
+
+@other_decorator
+@BaseApp.register_app
+class SecondApp(KeyApp):
+    """Has a name, and a color from utils.constants."""
+
+    name: str = 'Second'  # A comment
+    color = COLOR_1
+
+    class Nested:
+        name = "Not the app name"
+
+
+class UnregisteredApp(KeyApp):
+    name = "Unregistered"
+
+
+@BaseApp.register_app
+class InheritedApp(FirstApp):
+    pass
+
+
+class CalledApp(KeyApp):
+    name = "Called"
+
+
+BaseApp.register_app(CalledApp)
+
+if True:
+
+    @BaseApp.register_app
+    class IndentedApp(KeyApp):
+        name = "Indented"
+'''
+
+
+@pytest.fixture
+def directory(tmp_path):
+    path = tmp_path / "myapps"
+    path.mkdir()
+    (path / "first.py").write_text(SOURCE)
+    return path
+
+
+def test_scan_source_finds_decorated_top_level_classes(directory):
+    from utils.constants import COLOR_1
+
+    assert scan_source(str(directory / "first.py")) == [
+        ("FirstApp", "First", 0x00FF00),
+        ("SecondApp", "Second", COLOR_1),
+        ("InheritedApp", "InheritedApp", 0),
+    ]
+
+
+def test_load_manifest_caches_the_scan(directory, capsys):
+    entries = BaseApp.load_manifest(str(directory))
+    assert [entry.name for entry in entries] == ["First", "InheritedApp", "Second"]
+    assert entries[0].module.endswith("myapps.first")
+    assert os.path.exists(directory / MANIFEST_FILE)
+    assert "Indexing" in capsys.readouterr().out
+
+    # The cache is used while the file is unchanged
+    assert BaseApp.load_manifest(str(directory)) == entries
+    assert "Indexing" not in capsys.readouterr().out
+
+
+def test_scan_source_reads_every_stock_app():
+    # None of the stock apps are registered, but every module can be read
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    apps = os.path.join(root, "apps")
+    for filename in sorted(os.listdir(apps)):
+        if filename.endswith(".py"):
+            assert scan_source(os.path.join(apps, filename)) == []
@@ -0,0 +1,103 @@
+"""Tests for tracking memory use across app switches with MemoryMonitor."""
+
+import pytest
+
+from tests.fakes import FakeAppPad, FakeClock
+from utils.constants import TIMER_MEMORY_SNAPSHOT
+from utils.memory import MemoryMonitor
+
+INTERVAL = 60.0
+
+
+class ReportingAppPad(FakeAppPad):
+    """A FakeAppPad which counts the reports printed."""
+
+    def __init__(self):
+        super().__init__(FakeClock())
+        self.app_cache = []
+        self.reports = 0
+
+    @property
+    def timer_count(self):
+        return len(self.timers)
+
+    def report(self):
+        self.reports += 1
+
+
+class App:
+    def __init__(self, name):
+        self.name = name
+
+
+class Memory:
+    """A stand-in for read_memory, counting the collections it would make."""
+
+    def __init__(self):
+        self.allocated = 1000
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        return 100000 - self.allocated, self.allocated
+
+
+@pytest.fixture
+def app_pad():
+    return ReportingAppPad()
+
+
+@pytest.fixture
+def memory():
+    return Memory()
+
+
+def test_focus_does_not_collect_by_default(app_pad, memory):
+    monitor = MemoryMonitor(app_pad, INTERVAL, memory)
+    for _ in range(3):
+        monitor.focus(App("A"))
+        monitor.focus(App("B"))
+    assert memory.reads == 0
+    assert monitor.app_stats("A").visits == 3
+    assert app_pad.added == 1
+
+
+def test_periodic_snapshot_attributes_growth_and_reports(app_pad, memory):
+    monitor = MemoryMonitor(app_pad, INTERVAL, memory)
+    monitor.focus(App("A"))
+    app_pad.advance(INTERVAL)
+    assert memory.reads == 1
+    assert app_pad.reports == 1
+
+    memory.allocated += 300
+    app_pad.advance(INTERVAL)
+    assert monitor.app_stats("A").allocated == 300
+    assert app_pad.reports == 2
+    assert TIMER_MEMORY_SNAPSHOT in app_pad.timers
+
+
+def test_switching_apps_does_not_delay_the_periodic_snapshot(app_pad, memory):
+    monitor = MemoryMonitor(app_pad, INTERVAL, memory)
+    for _ in range(10):
+        monitor.focus(App("A"))
+        app_pad.advance(INTERVAL / 10)
+    assert app_pad.reports == 1
+
+
+def test_no_periodic_snapshot_without_interval(app_pad, memory):
+    monitor = MemoryMonitor(app_pad, 0, memory)
+    monitor.focus(App("A"))
+    assert app_pad.timers == {}
+
+
+def test_focus_snapshots_find_a_growing_baseline(app_pad, memory, capsys):
+    monitor = MemoryMonitor(app_pad, INTERVAL, memory, focus_snapshots=True)
+    a, b = App("A"), App("B")
+    for _ in range(MemoryMonitor.LEAK_CYCLES + 1):
+        monitor.focus(a)
+        memory.allocated += 200
+        monitor.focus(b)
+    assert memory.reads == 2 * (MemoryMonitor.LEAK_CYCLES + 1)
+    assert monitor.app_stats("A").allocated == 200 * (MemoryMonitor.LEAK_CYCLES + 1)
+    assert monitor.app_stats("A").leak_suspected
+    assert "possible leak" in capsys.readouterr().out
@@ -0,0 +1,157 @@
+"""Tests for saving settings to NVM with SettingsStore."""
+
+import struct
+
+import pytest
+
+from tests.fakes import FakeAppPad, FakeClock
+from utils.persistence import (
+    HEADER_FORMAT,
+    HEADER_SIZE,
+    MAGIC,
+    FileNVM,
+    SettingsStore,
+    checksum,
+)
+from utils.settings import BaseSettings, Setting
+
+
+class Settings(BaseSettings):
+    host_os = Setting("WIN", choices=("LIN", "MAC", "WIN"))
+    brightness = Setting(5, type_=int)
+    label = ""
+    persistent_settings = ("host_os", "brightness", "label")
+
+
+class CountingNVM(FileNVM):
+    """A FileNVM which counts the writes made to it."""
+
+    def __init__(self, path, size=4096):
+        super().__init__(path, size)
+        self.writes = 0
+
+    def __setitem__(self, index, value):
+        self.writes += 1
+        super().__setitem__(index, value)
+
+
+@pytest.fixture
+def nvm(tmp_path):
+    return CountingNVM(str(tmp_path / "nvm.bin"), 1024)
+
+
+@pytest.fixture
+def app_pad():
+    return FakeAppPad(FakeClock())
+
+
+def make_store(nvm):
+    return SettingsStore(nvm, offset=0, size=256, slot_size=64)
+
+
+def test_round_trip_through_persist(nvm, app_pad):
+    settings = Settings()
+    make_store(nvm).persist(app_pad, settings)
+    settings["host_os"] = "MAC"
+    settings["brightness"] = 9
+    settings["label"] = "héllo"
+    app_pad.advance(SettingsStore.WRITE_DELAY)
+
+    restored = Settings()
+    make_store(FileNVM(nvm.path, 1024)).persist(FakeAppPad(FakeClock()), restored)
+    assert restored.host_os == "MAC"
+    assert restored.brightness == 9
+    assert restored.label == "héllo"
+
+
+def test_invalid_saved_value_keeps_the_default(nvm, capsys):
+    # A choice removed since the settings were saved, and a value of the
+    # wrong type
+    make_store(nvm).write({"host_os": "BEOS", "brightness": "9", "label": "x"})
+
+    settings = Settings()
+    make_store(nvm).persist(FakeAppPad(FakeClock()), settings)
+    assert settings.host_os == "WIN"
+    assert settings.brightness == 5
+    assert settings.label == "x"
+    assert "Ignoring saved setting host_os" in capsys.readouterr().out
+
+
+def test_burst_of_changes_is_written_once(nvm, app_pad):
+    settings = Settings()
+    make_store(nvm).persist(app_pad, settings)
+    for brightness in range(10):
+        settings["brightness"] = brightness
+        app_pad.advance(SettingsStore.WRITE_DELAY / 2)
+    assert nvm.writes == 0
+
+    app_pad.advance(SettingsStore.WRITE_DELAY)
+    assert nvm.writes == 1
+    assert make_store(nvm).read()["brightness"] == 9
+
+
+def test_unchanged_settings_are_not_written_again(nvm):
+    store = make_store(nvm)
+    assert store.write({"brightness": 1})
+    assert not store.write({"brightness": 1})
+    assert nvm.writes == 1
+
+
+def test_slots_rotate_and_wrap_around(nvm):
+    store = make_store(nvm)
+    assert store.slots == 4
+
+    used = []
+    for brightness in range(6):
+        store.write({"brightness": brightness})
+        used.append(store._slot)
+    assert used == [0, 1, 2, 3, 0, 1]
+
+    reader = make_store(nvm)
+    assert reader.read() == {"brightness": 5}
+    assert reader._slot == 1
+
+    # Writing continues after the newest record, not from the first slot
+    reader.write({"brightness": 6})
+    assert reader._slot == 2
+    assert make_store(nvm).read() == {"brightness": 6}
+
+
+def test_torn_write_falls_back_to_previous_record(nvm):
+    store = make_store(nvm)
+    store.write({"brightness": 1})
+    store.write({"brightness": 2})
+
+    # Only the header of the next record reached the NVM
+    payload = b"\x01\x0abrightness\x03\x03\x00\x00\x00"
+    header = struct.pack(HEADER_FORMAT, MAGIC, 3, len(payload), checksum(payload))
+    nvm[128 : 128 + HEADER_SIZE] = header
+
+    assert make_store(nvm).read() == {"brightness": 2}
+
+
+def test_checksum_failure_falls_back_to_previous_record(nvm):
+    store = make_store(nvm)
+    store.write({"brightness": 1})
+    store.write({"brightness": 2})
+
+    # Flip the value byte of the newest record
+    start = 64 + HEADER_SIZE + 1 + 1 + len("brightness") + 1
+    nvm[start] = nvm[start] ^ 0xFF
+
+    assert make_store(nvm).read() == {"brightness": 1}
+
+
+def test_empty_nvm_has_nothing_saved(nvm):
+    assert make_store(nvm).read() is None
+
+
+def test_record_too_large_for_slot_is_rejected(nvm):
+    store = make_store(nvm)
+    store.write({"label": "short"})
+
+    with pytest.raises(ValueError):
+        store.write({"label": "x" * 64})
+
+    assert nvm.writes == 1
+    assert make_store(nvm).read() == {"label": "short"}
@@ -0,0 +1,122 @@
+"""Tests for repeating held keys with RepeatStage."""
+
+import pytest
+
+from tests.fakes import FakeApp, FakeAppPad, FakeClock, Harness, key
+from utils.app_pad import ENCODER_EVENT, REPEAT_EVENT, EncoderEvent, RepeatEvent
+from utils.pipeline import RepeatRate, RepeatStage
+
+RATE = RepeatRate(0.5, 0.1, 0.5, 0.02)
+START = 1000.0
+
+
+def repeat(number):
+    return RepeatEvent(REPEAT_EVENT, number)
+
+
+def times(harness):
+    """Return the time after START that each event was passed on."""
+    return [when - START for when in harness.times]
+
+
+@pytest.fixture
+def harness(monkeypatch):
+    clock = FakeClock(START)
+    monkeypatch.setattr("utils.pipeline.time.monotonic", clock)
+    repeat_rates = [None] * 12
+    repeat_rates[0] = RATE
+    repeat_rates[1] = RATE
+    app = FakeApp(FakeAppPad(clock))
+    return Harness(RepeatStage(), app, repeat_rates=repeat_rates)
+
+
+def test_key_without_rate_does_not_repeat(harness):
+    harness.press(5)
+    harness.wait(10.0)
+    assert harness.take() == [key(5, True)]
+    assert harness.app_pad.timers == {}
+
+
+def test_other_events_pass_at_once(harness):
+    event = EncoderEvent(ENCODER_EVENT, 1, 0)
+    harness.send(event)
+    assert harness.take() == [event]
+
+
+def test_first_repeat_waits_for_delay(harness):
+    harness.press(0)
+    assert harness.take() == [key(0, True)]
+    harness.wait(RATE.delay / 2)
+    assert harness.take() == []
+    harness.wait(RATE.delay / 2)
+    assert harness.take() == [repeat(0)]
+
+
+def test_repeats_accelerate_down_to_min_interval(harness):
+    harness.press(0)
+    harness.wait(0.75)
+    assert times(harness) == pytest.approx(
+        [0.0, 0.5, 0.6, 0.65, 0.675, 0.695, 0.715, 0.735]
+    )
+    assert harness.take() == [key(0, True)] + [repeat(0)] * 7
+
+
+def test_release_stops_repeating(harness):
+    harness.press(0)
+    harness.wait(0.6)
+    harness.release(0)
+    harness.wait(10.0)
+    assert harness.take() == [key(0, True), repeat(0), repeat(0), key(0, False)]
+    assert harness.app_pad.timers == {}
+
+
+def test_only_last_key_pressed_repeats(harness):
+    harness.press(0)
+    harness.wait(0.3)
+    harness.press(1)
+    harness.wait(0.5)
+    assert harness.take() == [key(0, True), key(1, True), repeat(1)]
+
+    # Releasing the first key doesn't stop the second
+    harness.release(0)
+    harness.wait(0.1)
+    assert harness.take() == [key(0, False), repeat(1)]
+
+
+def test_key_without_rate_stops_repeating(harness):
+    harness.press(0)
+    harness.wait(0.5)
+    harness.press(5)
+    harness.wait(10.0)
+    assert harness.take() == [key(0, True), repeat(0), key(5, True)]
+
+
+def test_falling_behind_skips_missed_repeats(harness):
+    harness.press(0)
+    harness.wait(0.5)
+
+    # The next repeat was due at 0.6, but events aren't checked until 2.0
+    harness.clock.now = START + 2.0
+    harness.wait(0)
+    assert harness.events == [key(0, True), repeat(0), repeat(0)]
+
+    # The repeat after that is an interval after the late one, not at once
+    harness.wait(0.02)
+    assert len(harness.events) == 3
+    harness.wait(0.005)
+    assert times(harness) == pytest.approx([0.0, 0.5, 2.0, 2.025])
+
+
+def test_repeat_timer_is_quiet(harness):
+    harness.press(0)
+    assert harness.app_pad.quiet == {RepeatStage.TIMER_ID}
+    harness.wait(1.0)
+    assert harness.app_pad.quiet == {RepeatStage.TIMER_ID}
+
+
+def test_unbind_stops_repeating(harness):
+    harness.press(0)
+    harness.stage.unbind()
+    harness.wait(10.0)
+    assert harness.take() == [key(0, True)]
+    assert harness.app_pad.timers == {}
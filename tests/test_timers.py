@@ -0,0 +1,45 @@
+"""Tests for the AppPad timers."""
+
+import pytest
+
+from utils.app_pad import AppPad
+
+
+@pytest.fixture
+def app_pad():
+    # Only the timers are used, so the macropad hardware is never set up
+    app_pad = AppPad.__new__(AppPad)
+    app_pad._timers = {}
+    return app_pad
+
+
+def test_timers_run_once_when_due(app_pad):
+    runs = []
+    app_pad.add_timer("now", 0, lambda: runs.append("now"))
+    app_pad.add_timer("later", 60, lambda: runs.append("later"))
+    assert list(app_pad.execute_ready_timers()) == []
+    assert runs == ["now"]
+    assert app_pad.timer_count == 1
+    assert 0 < app_pad.time_to_next_timer() <= 60
+
+
+def test_events_returned_by_timers_are_merged(app_pad):
+    app_pad.add_timer("one", 0, lambda: ["a"])
+    app_pad.add_timer("two", 0, lambda: ["b", "c"])
+    assert sorted(app_pad.execute_ready_timers()) == ["a", "b", "c"]
+
+
+def test_timers_print_when_added_and_run(app_pad, capsys):
+    app_pad.add_timer("loud", 0, lambda: None)
+    app_pad.execute_ready_timers()
+    out = capsys.readouterr().out
+    assert "Added timer loud" in out
+    assert "Executing timer loud" in out
+
+
+def test_quiet_timers_do_not_print(app_pad, capsys):
+    runs = []
+    app_pad.add_timer("quiet", 0, lambda: runs.append("quiet"), quiet=True)
+    app_pad.execute_ready_timers()
+    assert runs == ["quiet"]
+    assert capsys.readouterr().out == ""
@@ -15,161 +15,115 @@ except ImportError:
 
 from adafruit_macropad import MacroPad
 
-# Event indicating the Encoder Button was pressed or released.
-EncoderButtonEvent = namedtuple("EncoderButtonEvent", ("pressed",))
-
+from utils.hid import HidState
+from utils.memory import IdleCollector, MemoryMonitor
+from utils.navigation import AppCache, NavigationHistory, Prefetcher
 
-# Event indicating the Encoder was rotated.
-EncoderEvent = namedtuple("EncoderEvent", ("position", "previous_position"))
+# Type tags for each kind of event. The tag is the first field of every
+# event, so apps can dispatch through a table indexed by it.
+ENCODER_EVENT = 0
+ENCODER_BUTTON_EVENT = 1
+KEY_EVENT = 2
+DOUBLE_TAP_EVENT = 3
+HOLD_EVENT = 4
+CHORD_EVENT = 5
+SEQUENCE_EVENT = 6
+REPEAT_EVENT = 7
 
+# The number of event types
+EVENT_TYPES = 8
 
-# Event indicating a key was pressed or released.
-KeyEvent = namedtuple("KeyEvent", ("number", "pressed"))
-
+# The bit for the encoder switch in AppPad.keys_down, after the 12 keys
+ENCODER_SWITCH_BIT = 1 << 12
 
-# Event indicating a key was tapped twice quickly.
-DoubleTapEvent = namedtuple("DoubleTapEvent", ("number", "pressed"))
 
+# Event indicating the Encoder Button was pressed or released.
+EncoderButtonEvent = namedtuple("EncoderButtonEvent", ("type", "pressed"))
 
-class DoubleTapBuffer:
-    """
-    A class to manage an event buffer for tracking double-tap events.
 
-    When creating the class, you pass it a list of key numbers it should track
-    for double-taps. This avoids detecting double-taps for keys with no
-    double-tap command.
+# Event indicating the Encoder was rotated.
+EncoderEvent = namedtuple("EncoderEvent", ("type", "position", "previous_position"))
 
-    The class defines a buffer_event method to add events to the buffer. It
-    also defines a drain_buffer event to pull items from the buffer.
 
-    When buffering an event, if the event does not match the pattern of a
-    double-tap, or if a double-tap was detected, an exception is raised
-    containing the events from the buffer that should be passed on to the app.
+# Event indicating a key was pressed or released.
+KeyEvent = namedtuple("KeyEvent", ("type", "number", "pressed"))
 
-    """
 
-    class DrainBufferException(Exception):
-        """
-        A base exception class that includes a list of buffered events to pass
-        back to the app.
-        """
+# Event indicating a key was tapped twice quickly.
+DoubleTapEvent = namedtuple("DoubleTapEvent", ("type", "number", "pressed"))
 
-        def __init__(self, buffered_events: Iterable[KeyEvent]) -> None:
-            super().__init__()
-            self.buffered_events = list(buffered_events)
 
-    class UntrackedIndex(DrainBufferException):
-        """
-        Exception raised when attempting to buffer an event for an untracked
-        key.
-        """
+# Event indicating a key was held down past its hold time (pressed is True),
+# or released after being held (pressed is False).
+HoldEvent = namedtuple("HoldEvent", ("type", "number", "pressed"))
 
-    class DifferentIndexInBuffer(DrainBufferException):
-        """
-        Exception raised when attempting to buffer an event for a tracked key
-        when there are already events in the buffer for another tracked key.
-        """
 
-    class UnexpectedState(DrainBufferException):
-        """
-        Exception raised when attempting to buffer an event for a tracked key
-        when the pressed state of the key does not match the expected state.
-        """
+# Event indicating a chord of keys was pressed together, or released. keys is
+# a bitmask with bit n set for key number n.
+ChordEvent = namedtuple("ChordEvent", ("type", "keys", "pressed"))
 
-    class DoubleTapDetected(Exception):
-        """
-        Exception raised when attempting to buffer an event and that event
-        completes a double tap.
-        """
 
-    def __init__(self, tracked_indices: Iterable[int]) -> None:
-        self._tracked_indices = set(tracked_indices)
-        self._buffered_events: List[KeyEvent] = []
+# Event indicating the last key of a leader sequence was pressed or released.
+# key is the Key bound to the sequence.
+SequenceEvent = namedtuple("SequenceEvent", ("type", "key", "pressed"))
 
-    def buffer_event(self, event: KeyEvent):
-        """Add an event to the buffer.
 
-        Args:
-            event (KeyEvent): The event to add to the buffer
-
-        Raises:
-            self.UntrackedIndex: Raised when the event you buffer is not
-                tracked by this Buffer instance. Includes any items in the
-                buffer that should be passed to the app.
-            self.DifferentIndexInBuffer: Raised when there are items in the
-                buffer with a different key number. The buffer is first
-                drained. Then the new event is added to the buffer, and the
-                previous events are returned in this exception.
-            self.DoubleTapDetected: Raised when the events in the buffer match
-                a double-tap state. No event is included in this exception.
-            self.UnexpectedState: Raised when the events in the buffer don't
-                follow the expected Press, Release, Press, Release pattern.
-                The events in the buffer are returned.
-        """
-        if event.number not in self._tracked_indices:
-            raise self.UntrackedIndex(self.drain_buffer())
+# Event indicating a key held down should repeat its command.
+RepeatEvent = namedtuple("RepeatEvent", ("type", "number"))
 
-        if not self._buffered_events:
-            self._buffered_events.append(event)
-            return
 
-        if any(
-            buffered_event.number != event.number
-            for buffered_event in self._buffered_events
-        ):
-            buffered_events = self.drain_buffer()
-            self._buffered_events.append(event)
-            raise self.DifferentIndexInBuffer(buffered_events)
+class AppPad:
+    """
+    An abstraction layer on top of the macropad hardware.
 
-        buffered_states = tuple(
-            buffered_event.pressed for buffered_event in self._buffered_events
-        )
-        if buffered_states == (True, False, True) and not event.pressed:
-            raise self.DoubleTapDetected()
-        elif buffered_states == (True, False) and event.pressed:
-            self._buffered_events.append(event)
-        elif buffered_states == (True,) and not event.pressed:
-            self._buffered_events.append(event)
-        else:
-            raise self.UnexpectedState(self.drain_buffer())
+    Instantiating this class initializes the hardware.
 
-    def drain_buffer(self) -> Iterable[KeyEvent]:
-        """Empty the buffer of events.
+    It also provides the following features on top of that hardware:
+    - Adding timers to trigger callbacks after a set delay.
+    - Idle tasks which run when there has been no input for a short time.
+    - A bounded navigation history for switching back to previous apps, and
+      an LRU cache limiting how many constructed apps are kept in memory.
+    - Prefetching the apps the focused app is likely to switch to while the
+      macropad is idle.
+    - A memory monitor which accounts memory use to each app and reports
+      suspected leaks.
+    - Garbage collection in idle windows, so collections are less likely to
+      pause a macro.
+    - A mirror of the held HID keys and buttons, so only those are released
+      when switching apps, and keys left stuck down are released.
 
-        Since we are detecting double-taps, when we drain the buffer we only
-        want to return at most a press and release event. So if there are more
-        than two events in the buffer, we truncate the list.
+    """
 
-        Returns:
-            Iterable[KeyEvent]: The events which should be passed on to the app.
-        """
-        result = self._buffered_events
-        if len(result) > 2:
-            result = result[:2]
+    HISTORY_DEPTH = 10
+    # The maximum number of apps remembered by the navigation history
 
-        self._buffered_events = []
+    APP_CACHE_SIZE = 6
+    # The maximum number of constructed apps to keep in memory
 
-        return result
+    APP_CACHE_MIN_FREE_MEMORY = 16 * 1024
+    # Release cached apps while free memory in bytes is below this threshold
 
+    IDLE_DELAY = 0.5
+    # The time in seconds without input after which idle tasks run
 
-class AppPad:
-    """
-    An abstraction layer on top of the macropad hardware.
+    PREFETCH_LIMIT = 2
+    # The maximum number of apps to prefetch each time an app is focused
 
-    Instantiating this class initializes the hardware.
+    PREFETCH_MIN_FREE_MEMORY = 32 * 1024
+    # Only prefetch apps while free memory in bytes is above this threshold
 
-    It also provides the following features on top of that hardware:
-    - Double-tap detection, so tapping a key twice quickly can trigger a
-      second function.
-    - Adding timers to trigger callbacks after a set delay.
+    MEMORY_SNAPSHOT_INTERVAL = 60.0
+    # The time in seconds between periodic memory snapshots and reports, or 0
+    # to disable
 
-    """
+    MEMORY_FOCUS_SNAPSHOTS = False
+    # Also take a memory snapshot, which collects garbage, on every app switch
 
-    DOUBLE_TAP_TIMEOUT = 0.2
-    # The delay in seconds to clear the double tap buffer
+    GC_MIN_FREE_MEMORY = 48 * 1024
+    # Collect garbage in idle windows while free memory in bytes is below this
 
-    DOUBLE_TAP_TIMER_ID = "_DRAIN_DOUBLE_TAP_BUFFER"
-    # The ID of the time to clear the double tap buffer
+    STUCK_KEY_TIMEOUT = HidState.STUCK_TIMEOUT
+    # Release keys and buttons held down longer than this, in seconds, or 0
 
     def __init__(self):
         self.macropad = self._init_macropad()
@@ -179,9 +133,28 @@ class AppPad:
         self._last_encoder_switch = self.encoder_switch
         self._running = False
 
+        # A bitmask of the keys held down, with ENCODER_SWITCH_BIT set while
+        # the encoder switch is pressed
+        self.keys_down = 0
+
         self._timers = dict()
 
-        self._double_tap_buffer: Optional[DoubleTapBuffer] = None
+        self._idle_tasks = dict()
+        self._idle_queue: List[str] = []
+        self._last_activity = time.monotonic()
+
+        self.history = NavigationHistory(self.HISTORY_DEPTH)
+        self.app_cache = AppCache(self.APP_CACHE_SIZE, self.APP_CACHE_MIN_FREE_MEMORY)
+        self.prefetcher = Prefetcher(
+            self, self.PREFETCH_LIMIT, self.PREFETCH_MIN_FREE_MEMORY
+        )
+        self.memory_monitor = MemoryMonitor(
+            self,
+            self.MEMORY_SNAPSHOT_INTERVAL,
+            focus_snapshots=self.MEMORY_FOCUS_SNAPSHOTS,
+        )
+        self.idle_collector = IdleCollector(self, self.GC_MIN_FREE_MEMORY)
+        self.hid = HidState(self, self.STUCK_KEY_TIMEOUT)
 
     @classmethod
     def _init_macropad(cls):
@@ -192,7 +165,18 @@ class AppPad:
 
         return macropad
 
-    def add_timer(self, id_: str, delay: float, callback: Callable):
+    def report(self):
+        """Print the memory, idle garbage collection and HID statistics.
+
+        This is printed after each periodic memory snapshot.
+        """
+        self.memory_monitor.report()
+        self.idle_collector.report()
+        self.hid.report()
+
+    def add_timer(
+        self, id_: str, delay: float, callback: Callable, quiet: bool = False
+    ):
         """Add a timer to run a callback after a delay.
 
         Args:
@@ -201,10 +185,15 @@ class AppPad:
             callback (Callable): A callback taking no arguments to run after
                                  the delay. The callback should return None or
                                  an Iterable of Events.
+            quiet (bool, optional): Don't print when the timer is added or
+                                    run. Use this for timers which are set
+                                    many times a second, like those of the
+                                    event pipeline. Defaults to False.
         """
         execute_time = time.monotonic() + delay
-        print(f"Added timer {id_}: {execute_time}")
-        self._timers[id_] = (execute_time, callback)
+        if not quiet:
+            print(f"Added timer {id_}: {execute_time}")
+        self._timers[id_] = (execute_time, callback, quiet)
 
     def delete_timer(self, id_: str):
         """Delete the timer with the given id_ if it exists.
@@ -215,6 +204,17 @@ class AppPad:
         if id_ in self._timers:
             del self._timers[id_]
 
+    @property
+    def timer_count(self) -> int:
+        """Return the number of pending timers."""
+        return len(self._timers)
+
+    def time_to_next_timer(self) -> Optional[float]:
+        """Return the seconds until the next timer is due, or None."""
+        if not self._timers:
+            return None
+        return min(timer[0] for timer in self._timers.values()) - time.monotonic()
+
     def execute_ready_timers(self) -> Iterable:
         """Execute the callback for any timers that are past their delay.
 
@@ -230,14 +230,15 @@ class AppPad:
         current_time = time.monotonic()
 
         finished_timers = [
-            (id_, timer[1])
+            (id_, timer[1], timer[2])
             for id_, timer in self._timers.items()
             if current_time >= timer[0]
         ]
 
         results = []
-        for id_, callback in finished_timers:
-            print(f"Executing timer {id_}")
+        for id_, callback, quiet in finished_timers:
+            if not quiet:
+                print(f"Executing timer {id_}")
             self._timers.pop(id_)
             callback_result = callback()
             try:
@@ -247,6 +248,59 @@ class AppPad:
 
         return results
 
+    def add_idle_task(self, id_: str, callback: Callable[[], bool]):
+        """Add a task to run when there has been no input for IDLE_DELAY.
+
+        During an idle window, one task runs per pass through check_events so
+        input stays responsive. Each task runs at least once per idle window,
+        and keeps running while its callback returns True. The task stays
+        registered for later idle windows until it is deleted.
+
+        Args:
+            id_ (str): The id of the task so it can be updated or deleted
+            callback (Callable[[], bool]): A callback taking no arguments.
+                Return True if there is more work to do in this idle window.
+        """
+        self._idle_tasks[id_] = callback
+        if id_ not in self._idle_queue:
+            self._idle_queue.append(id_)
+
+    def delete_idle_task(self, id_: str):
+        """Delete the idle task with the given id_ if it exists.
+
+        Args:
+            id_ (str): The id of the task
+        """
+        if id_ in self._idle_tasks:
+            del self._idle_tasks[id_]
+
+    @property
+    def idle_tasks_pending(self) -> int:
+        """Return the number of idle tasks still queued in this idle window."""
+        return len(self._idle_queue)
+
+    @property
+    def idle_time(self) -> float:
+        """Return the time in seconds since the last input."""
+        return time.monotonic() - self._last_activity
+
+    def mark_active(self):
+        """Record input, ending the current idle window."""
+        self._last_activity = time.monotonic()
+        self._idle_queue = list(self._idle_tasks)
+
+    def run_idle_task(self):
+        """Run the next idle task if the macropad has been idle long enough."""
+        if not self._idle_queue:
+            return
+        if time.monotonic() - self._last_activity < self.IDLE_DELAY:
+            return
+
+        id_ = self._idle_queue.pop(0)
+        callback = self._idle_tasks.get(id_)
+        if callback is not None and callback():
+            self._idle_queue.append(id_)
+
     @property
     def encoder_position(self) -> int:
         """Return the position of the encoder."""
@@ -269,80 +323,44 @@ class AppPad:
     ) -> Iterable[Union[DoubleTapEvent, EncoderButtonEvent, EncoderEvent, KeyEvent]]:
         """Check for changes in state and return a tuple of events.
 
-        Also execute any timers that are scheduled to run.
+        Also execute any timers that are scheduled to run. If there was no
+        input, run an idle task instead.
 
         Returns:
             Tuple[Union[DoubleTapEvent, EncoderButtonEvent, EncoderEvent, KeyEvent], ...]:
                 A tuple of Events.
         """
+        active = False
+
         position = self.encoder_position
         if position != self._last_encoder_position:
+            active = True
             last_encoder_position = self._last_encoder_position
             self._last_encoder_position = position
-            yield EncoderEvent(
-                position=position,
-                previous_position=last_encoder_position,
-            )
+            yield EncoderEvent(ENCODER_EVENT, position, last_encoder_position)
 
         encoder_switch = self.encoder_switch
         if encoder_switch != self._last_encoder_switch:
-            yield EncoderButtonEvent(pressed=encoder_switch)
+            active = True
+            self._last_encoder_switch = encoder_switch
+            if encoder_switch:
+                self.keys_down |= ENCODER_SWITCH_BIT
+            else:
+                self.keys_down &= ~ENCODER_SWITCH_BIT
+            yield EncoderButtonEvent(ENCODER_BUTTON_EVENT, encoder_switch)
 
         key_event = self.macropad.keys.events.get()
         if key_event:
-            yield from self._handle_double_tap_event(
-                KeyEvent(number=key_event.key_number, pressed=key_event.pressed)
-            )
+            active = True
+            if key_event.pressed:
+                self.keys_down |= 1 << key_event.key_number
+            else:
+                self.keys_down &= ~(1 << key_event.key_number)
+            yield KeyEvent(KEY_EVENT, key_event.key_number, key_event.pressed)
 
         yield from self.execute_ready_timers()
 
-    def _handle_double_tap_event(
-        self, event: KeyEvent
-    ) -> Iterable[Union[DoubleTapEvent, KeyEvent]]:
-        """Handle the DoubleTapBuffer and return any events as a result.
-
-        Args:
-            event (KeyEvent): The KeyEvent that was triggered.
-
-        Returns:
-            Iterable[Union[DoubleTapEvent, KeyEvent]]:
-                An iterable of events resulting from buffering the event.
-                This may be the events from the buffer or the DoubleTapEvents
-                of a completed DoubleTap.
-        """
-        if self._double_tap_buffer is None:
-            return (event,)
-
-        try:
-            self._double_tap_buffer.buffer_event(event)
-        except self._double_tap_buffer.DrainBufferException as err:
-            self.delete_timer(self.DOUBLE_TAP_TIMER_ID)
-            result = list(err.buffered_events)
-            result.append(event)
-            return result
-        except self._double_tap_buffer.DoubleTapDetected:
-            self.delete_timer(self.DOUBLE_TAP_TIMER_ID)
-            self._double_tap_buffer.drain_buffer()
-            return (
-                DoubleTapEvent(number=event.number, pressed=True),
-                DoubleTapEvent(number=event.number, pressed=False),
-            )
-        else:
-            self.add_timer(
-                self.DOUBLE_TAP_TIMER_ID,
-                self.DOUBLE_TAP_TIMEOUT,
-                self._double_tap_buffer.drain_buffer,
-            )
-            return tuple()
-
-    def track_double_taps(self, indices: Iterable[int]):
-        """Create a new DoubleTapBuffer tracking the specified key numbers.
-
-        Args:
-            indices (Iterable[int]): The key numbers to track.
-        """
-        print("Tracking double taps: ", indices)
-        if indices:
-            self._double_tap_buffer = DoubleTapBuffer(indices)
+        if active:
+            self.mark_active()
         else:
-            self._double_tap_buffer = None
+            self.run_idle_task()
@@ -4,32 +4,73 @@ Includes a BaseApp implementation which handles the basic app run loop.
 
 import os
 
+from utils.manifest import LOAD_ERRORS, AppManifest, ManifestEntry
+from utils.profiler import boot_profiler
 from utils.settings import BaseSettings
 
 try:
-    from typing import Iterable, List, Optional, Union
+    from typing import Callable, Iterable, List, Optional, Tuple, Union
 except ImportError:
     pass
 
-import displayio
-import terminalio
-from adafruit_display_shapes.rect import Rect
-from adafruit_display_text import label
-
 from utils.app_pad import (
+    CHORD_EVENT,
+    DOUBLE_TAP_EVENT,
+    ENCODER_BUTTON_EVENT,
+    ENCODER_EVENT,
+    EVENT_TYPES,
+    HOLD_EVENT,
+    KEY_EVENT,
+    REPEAT_EVENT,
+    SEQUENCE_EVENT,
     AppPad,
+    ChordEvent,
     DoubleTapEvent,
     EncoderButtonEvent,
     EncoderEvent,
+    HoldEvent,
     KeyEvent,
+    RepeatEvent,
+    SequenceEvent,
 )
 from utils.constants import DISPLAY_HEIGHT, DISPLAY_WIDTH
+from utils.pipeline import Stage, compile_pipeline
+
+# Display groups built so far, keyed by the function that builds the layout
+_display_groups = {}
+
+
+def get_display_group(layout: Callable[[int, int], "displayio.Group"]):
+    """Return the display group for a layout, building it on first use.
+
+    Every app using the same layout shares one group, so apps which are never
+    shown don't use any display memory, and a layout's labels are never
+    duplicated.
+
+    Args:
+        layout (Callable[[int, int], displayio.Group]): A function accepting
+            the display width and height which builds the group
+
+    Returns:
+        displayio.Group: The display group for the layout
+    """
+    group = _display_groups.get(layout)
+    if group is None:
+        group = layout(DISPLAY_WIDTH, DISPLAY_HEIGHT)
+        _display_groups[layout] = group
+    return group
 
 
 def init_display_group_base_app(
     display_width: int, display_height: int
-) -> displayio.Group:
+) -> "displayio.Group":
     """Set up a displayio group with a single label."""
+    # Imported here so importing an app module doesn't load display code
+    import displayio
+    import terminalio
+    from adafruit_display_shapes.rect import Rect
+    from adafruit_display_text import label
+
     group = displayio.Group()
     group.append(Rect(0, 0, display_width, 12, fill=0xFFFFFF))
     group.append(
@@ -37,7 +78,7 @@ def init_display_group_base_app(
             terminalio.FONT,
             text="",
             color=0x000000,
-            anchored_position=(display_height // 2, -2),
+            anchored_position=(display_width // 2, -2),
             anchor_point=(0.5, 0.0),
         )
     )
@@ -46,13 +87,25 @@ def init_display_group_base_app(
 
 
 class BaseApp:
-    display_group = init_display_group_base_app(DISPLAY_WIDTH, DISPLAY_HEIGHT)
+    # The function that builds the display group for the app
+    display_layout = staticmethod(init_display_group_base_app)
     name = "Base App"
 
+    # The color used for the app in menus. May be an int or a color name.
+    color: Union[int, str] = 0
+
+    # Factories for the stages every event passes through before it is
+    # handled, in order. Each is called with no arguments when the app is
+    # focused, e.g. (LoggingStage,).
+    event_stages: Tuple[Callable[[], Stage], ...] = ()
+
     @staticmethod
     def load_apps(directory: str) -> Iterable["BaseApp"]:
         """Load all the macro key setups from .py files in directory.
 
+        Every module is imported. To list the apps without importing them,
+        use load_manifest instead.
+
         Args:
             directory (str): The directory from which to load macros.
 
@@ -63,15 +116,7 @@ class BaseApp:
             if filename.endswith(".py"):
                 try:
                     __import__(directory + "/" + filename[:-3])
-                except (
-                    SyntaxError,
-                    ImportError,
-                    AttributeError,
-                    KeyError,
-                    NameError,
-                    IndexError,
-                    TypeError,
-                ) as err:
+                except LOAD_ERRORS as err:
                     print("Error loading %s" % filename)
                     print(err)
 
@@ -82,6 +127,25 @@ class BaseApp:
 
         return apps
 
+    @staticmethod
+    def load_manifest(directory: str) -> List[ManifestEntry]:
+        """List the apps registered in the .py files in directory.
+
+        The apps are read from the app manifest for the directory, which is
+        cached on flash and only updated for files that changed. No modules
+        are imported; each entry imports its module the first time its app is
+        constructed. See utils.manifest.scan_source for the app classes the
+        manifest can find.
+
+        Args:
+            directory (str): The directory containing the app modules.
+
+        Returns:
+            List[ManifestEntry]: The apps that were registered, sorted by
+                name. Each entry has a lazy_app to switch to it.
+        """
+        return AppManifest(directory).load()
+
     @staticmethod
     def register_app(app_class: "BaseApp") -> "BaseApp":
         """Register the specified app to the internal app list.
@@ -124,34 +188,52 @@ class BaseApp:
         """
         self.app_pad = app_pad
         self.macropad = app_pad.macropad
+        self.lazy_app: Optional[LazyApp] = None
+        self._handlers: Optional[Tuple[Callable, ...]] = None
+        self._stages: Tuple[Stage, ...] = ()
+        self._pipeline: Optional[Callable] = None
 
         if settings is None:
             self.settings = BaseSettings()
         else:
             self.settings = settings
 
+    @property
+    def display_group(self) -> "displayio.Group":
+        """Return the display group for the app's layout."""
+        return get_display_group(self.display_layout)
+
     def run(self):
         """The main run loop for the app.
 
         Checks the app_pad object for any new events, then processes them.
         """
-        self.on_focus()
+        self.app_pad.memory_monitor.focus(self)
 
-        for event in self.app_pad.event_stream():
-            self.process_event(event)
+        if boot_profiler.enabled:
+            with boot_profiler.section("first render " + self.name):
+                self.on_focus()
+            boot_profiler.finish()
+        else:
+            self.on_focus()
+
+        try:
+            for event in self.app_pad.event_stream():
+                # Looked up for each event, since handling an event may
+                # compile a new pipeline
+                self._pipeline(event)
+        finally:
+            self.on_blur()
 
     def on_focus(self):
         """Code to execute when an app is focused.
 
-        Resets the state of commands.
+        Releases any keys and buttons left held by commands.
         Sets up the display.
         Sets up the pixels.
 
         """
-        self.macropad.keyboard.release_all()
-        self.macropad.consumer_control.release()
-        self.macropad.mouse.release_all()
-        self.macropad.stop_tone()
+        self.app_pad.hid.release_all()
 
         self.display_on_focus()
         self.macropad.display.show(self.display_group)
@@ -160,13 +242,43 @@ class BaseApp:
         self.pixels_on_focus()
         self.macropad.pixels.show()
 
+        self.compile_event_handlers()
+        self.compile_pipeline()
+        self.app_pad.prefetcher.schedule(self)
+
+    def on_blur(self):
+        """Code to execute when the app stops running, such as when switching
+        to another app.
+
+        Drops any events held by the pipeline stages.
+
+        """
+        self.unbind_pipeline()
+
+    def prepare(self):
+        """Do any work needed before the app is focused ahead of time.
+
+        Called when the app is prefetched during idle time, so the first
+        focus is as fast as a revisit.
+
+        """
+        pass
+
+    def switch_targets(self) -> List["LazyApp"]:
+        """Return the apps this app can switch to, in order of appearance.
+
+        Returns:
+            List[LazyApp]: The apps this app can switch to
+        """
+        return []
+
     def display_on_focus(self):
         """Set up the display when an app is focused.
 
         Set the display label to the name of the app.
 
         """
-        self.display_group[0].text = self.name
+        self.display_group[1].text = self.name
 
     def pixels_on_focus(self):
         """Set up the pixels when an app is focused.
@@ -177,6 +289,72 @@ class BaseApp:
         for i in range(12):
             self.macropad.pixels[i] = 0
 
+    def event_handlers(self) -> List[Callable]:
+        """Return the handler for each event type, indexed by its type tag.
+
+        Returns:
+            List[Callable]: The handlers, each taking the event
+        """
+        handlers = [_ignore_event] * EVENT_TYPES
+        handlers[ENCODER_EVENT] = self.encoder_event
+        handlers[ENCODER_BUTTON_EVENT] = self.encoder_button_event
+        handlers[KEY_EVENT] = self.key_event
+        handlers[DOUBLE_TAP_EVENT] = self.double_tap_event
+        handlers[HOLD_EVENT] = self.hold_event
+        handlers[CHORD_EVENT] = self.chord_event
+        handlers[SEQUENCE_EVENT] = self.sequence_event
+        handlers[REPEAT_EVENT] = self.repeat_event
+        return handlers
+
+    def pipeline_stages(self) -> List[Stage]:
+        """Return the stages every event passes through before it is handled.
+
+        Returns a new instance from each of the event_stages factories.
+        Subclasses may add stages which depend on the state of the app.
+
+        Returns:
+            List[Stage]: The stages, in the order events pass through them
+        """
+        return [factory() for factory in self.event_stages]
+
+    def compile_pipeline(self) -> Callable:
+        """Bind the pipeline stages into the function run for every event.
+
+        Called when the app is focused. Call it again whenever the result of
+        pipeline_stages changes. Stages which are no longer in the pipeline
+        are unbound, dropping any events they hold. Stages which are still in
+        it are bound again, and keep their state.
+
+        Returns:
+            Callable: The function taking each event from the AppPad
+        """
+        stages = tuple(self.pipeline_stages())
+        for stage in self._stages:
+            if stage not in stages:
+                stage.unbind()
+        self._stages = stages
+        self._pipeline = compile_pipeline(self, self._stages, self.process_event)
+        return self._pipeline
+
+    def unbind_pipeline(self):
+        """Unbind the pipeline stages, dropping any events they hold."""
+        for stage in self._stages:
+            stage.unbind()
+        self._stages = ()
+        self._pipeline = self.process_event
+
+    def compile_event_handlers(self) -> Tuple[Callable, ...]:
+        """Build the handler table used by process_event.
+
+        Called when the app is focused. Call it again whenever the result of
+        event_handlers changes.
+
+        Returns:
+            Tuple[Callable, ...]: The handler for each event type
+        """
+        self._handlers = tuple(self.event_handlers())
+        return self._handlers
+
     def process_event(
         self, event: Union[DoubleTapEvent, EncoderButtonEvent, EncoderEvent, KeyEvent]
     ):
@@ -186,14 +364,10 @@ class BaseApp:
             event (Union[DoubleTapEvent, EncoderButtonEvent, EncoderEvent, KeyEvent]):
                 An event from the App Pad
         """
-        if isinstance(event, EncoderEvent):
-            self.encoder_event(event)
-        elif isinstance(event, EncoderButtonEvent):
-            self.encoder_button_event(event)
-        elif isinstance(event, KeyEvent):
-            self.key_event(event)
-        elif isinstance(event, DoubleTapEvent):
-            self.double_tap_event(event)
+        handlers = self._handlers
+        if handlers is None:
+            handlers = self.compile_event_handlers()
+        handlers[event[0]](event)
 
     def encoder_event(self, event: EncoderEvent):
         """Process an encoder event.
@@ -227,3 +401,156 @@ class BaseApp:
             event (DoubleTapEvent): An event triggered by double-tapping a key
         """
         pass
+
+    def hold_event(self, event: HoldEvent):
+        """Process a hold event.
+
+        Args:
+            event (HoldEvent): An event triggered by holding a key down, or
+                by releasing a held key
+        """
+        pass
+
+    def chord_event(self, event: ChordEvent):
+        """Process a chord event.
+
+        Args:
+            event (ChordEvent): An event triggered by pressing several keys
+                together, or by releasing them
+        """
+        pass
+
+    def sequence_event(self, event: SequenceEvent):
+        """Process a leader sequence event.
+
+        Args:
+            event (SequenceEvent): An event triggered by pressing or
+                releasing the last key of a leader sequence
+        """
+        pass
+
+    def repeat_event(self, event: RepeatEvent):
+        """Process a repeat event.
+
+        Args:
+            event (RepeatEvent): An event triggered by holding down a key
+                which repeats
+        """
+        pass
+
+
+def _ignore_event(event):
+    pass
+
+
+class LazyApp:
+    """A reference to an App that is constructed the first time it is needed.
+
+    Apps which are only reachable by switching to them don't need to exist at
+    boot. A LazyApp holds a factory (usually the App class itself) and the
+    settings to build it with. The App is built the first time get is called
+    and then cached, so later switches reuse the same instance.
+
+    Constructed apps are tracked by the AppPad app cache. If the cache
+    releases the App to free memory, it is rebuilt on the next call to get.
+
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[AppPad, Optional[BaseSettings]], BaseApp],
+        settings: Optional[BaseSettings] = None,
+    ):
+        """Initialize the LazyApp.
+
+        Args:
+            factory (Callable[[AppPad, Optional[BaseSettings]], BaseApp]):
+                A callable accepting an AppPad and settings which returns the
+                App. An App class may be passed directly.
+            settings (Optional[BaseSettings], optional): The settings for the
+                App. If None, the settings passed to get are used instead.
+                Defaults to None.
+        """
+        self.factory = factory
+        self.settings = settings
+        self.app: Optional[BaseApp] = None
+        self.rebuildable = True
+
+    @classmethod
+    def from_app(cls, app: BaseApp) -> "LazyApp":
+        """Return the LazyApp for an App that has already been constructed.
+
+        If the App wasn't built by a LazyApp, a new LazyApp is created for it.
+        It can't be rebuilt, so the app cache never releases it.
+
+        Args:
+            app (BaseApp): The constructed App
+
+        Returns:
+            LazyApp: A LazyApp which returns app
+        """
+        lazy_app = getattr(app, "lazy_app", None)
+        if lazy_app is None:
+            lazy_app = cls(app.__class__, app.settings)
+            lazy_app.app = app
+            lazy_app.rebuildable = False
+            app.lazy_app = lazy_app
+        return lazy_app
+
+    @property
+    def loaded(self) -> bool:
+        """Return True if the App has been constructed."""
+        return self.app is not None
+
+    def get(self, app_pad: AppPad, settings: Optional[BaseSettings] = None) -> BaseApp:
+        """Return the App, constructing it if necessary.
+
+        Args:
+            app_pad (AppPad): The AppPad to construct the App with
+            settings (Optional[BaseSettings], optional): Settings to use if
+                none were given when the LazyApp was created. Defaults to
+                None.
+
+        Returns:
+            BaseApp: The App instance
+        """
+        if self.app is None:
+            self._build(app_pad, settings)
+        app_pad.app_cache.touch(self)
+        return self.app
+
+    def prefetch(self, app_pad: AppPad, settings: Optional[BaseSettings] = None):
+        """Construct and prepare the App ahead of time.
+
+        Unlike get, this doesn't mark the App as recently used, so a
+        prefetched App that is never opened is the first one released.
+
+        Args:
+            app_pad (AppPad): The AppPad to construct the App with
+            settings (Optional[BaseSettings], optional): Settings to use if
+                none were given when the LazyApp was created. Defaults to
+                None.
+        """
+        if self.app is None:
+            self._build(app_pad, settings)
+            app_pad.app_cache.add_cold(self)
+        if self.app is not None:
+            self.app.prepare()
+
+    def _build(self, app_pad: AppPad, settings: Optional[BaseSettings]):
+        if self.settings is None:
+            # Keep the settings so a released App is rebuilt the same way
+            self.settings = settings
+        with boot_profiler.section("construct " + str(self)):
+            self.app = self.factory(app_pad, self.settings)
+        self.app.lazy_app = self
+
+    def release(self):
+        """Drop the reference to the App so it can be garbage collected."""
+        if self.rebuildable:
+            self.app = None
+
+    def __str__(self) -> str:
+        return "{0}({1})".format(
+            self.__class__.__name__, getattr(self.factory, "__name__", self.factory)
+        )
@@ -4,25 +4,26 @@ Also defines a Key class which combines the text for the key, the color for
 the key, and the command to execute for the key.
 """
 
+from collections import namedtuple
+
 try:
-    from typing import Any, Dict, List, Optional, Set, Union
+    from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 except ImportError:
     pass
 
-import displayio
-import terminalio
-from adafruit_display_shapes.rect import Rect
-from adafruit_display_text import label
-
 from utils.app_pad import (
     AppPad,
+    ChordEvent,
     DoubleTapEvent,
     EncoderButtonEvent,
     EncoderEvent,
+    HoldEvent,
     KeyEvent,
+    RepeatEvent,
+    SequenceEvent,
 )
-from utils.apps.base import BaseApp
-from utils.commands import Command
+from utils.apps.base import BaseApp, LazyApp, get_display_group
+from utils.commands import Command, SwitchAppCommand
 from utils.constants import (
     COLOR_1,
     COLOR_2,
@@ -34,23 +35,60 @@ from utils.constants import (
     COLOR_8,
     COLOR_9,
     COLOR_10,
-    DISPLAY_HEIGHT,
-    DISPLAY_WIDTH,
     EMPTY_VALUE,
     ONE_MINUTE,
     OS_LINUX,
     OS_MAC,
+    OS_SETTING,
     OS_WINDOWS,
+    PIXELS_DISABLED_SETTING,
     TIMER_DISABLE_PIXELS,
 )
-from utils.settings import BaseSettings
+from utils.interning import intern
+from utils.pipeline import (
+    ActivityStage,
+    ChordStage,
+    ChordTable,
+    DoubleTapStage,
+    HoldStage,
+    LeaderStage,
+    RepeatRate,
+    RepeatStage,
+    Stage,
+    chord_mask,
+    compile_sequence_trie,
+)
+from utils.settings import BaseSettings, Setting
+
+
+def _no_key():
+    pass
+
+
+# The handlers for a key number with no key bound, released and pressed
+_NO_KEY = (_no_key, _no_key)
+
+# Shared by apps without any hold commands or keys which repeat
+_NO_HOLD_TIMES = (None,) * 12
+_NO_HOLD_HANDLERS = (_NO_KEY,) * 12
+_NO_REPEAT_RATES = (None,) * 12
+
+# The index of each host OS in MacroKey.os_commands
+OS_ORDER = {OS_LINUX: 0, OS_MAC: 1, OS_WINDOWS: 2}
 
-EMPTY_DISPLAY_GROUP = displayio.Group()
+
+def init_display_group_empty(
+    display_width: int, display_height: int
+) -> "displayio.Group":
+    """Set up an empty displayio group, used to blank the display."""
+    import displayio
+
+    return displayio.Group()
 
 
 def init_display_group_macro_app(
     display_width: int, display_height: int
-) -> displayio.Group:
+) -> "displayio.Group":
     """Set up displayio group with an app name and labels for each key.
 
     Args:
@@ -59,6 +97,12 @@ def init_display_group_macro_app(
 
     Returns:
         displayio.Group: A display group"""
+    # Imported here so importing an app module doesn't load display code
+    import displayio
+    import terminalio
+    from adafruit_display_shapes.rect import Rect
+    from adafruit_display_text import label
+
     group = displayio.Group()
     for key_index in range(12):
         x = key_index % 3
@@ -90,22 +134,159 @@ def init_display_group_macro_app(
     return group
 
 
+# The keys and encoder commands of a KeyApp, compiled once per class.
+# keys is a tuple of 12 Keys (or None) and double_tap_indices is a tuple of
+# the key numbers with a double-tap command.
+KeyLayout = namedtuple(
+    "KeyLayout",
+    (
+        "keys",
+        "double_tap_indices",
+        "encoder_button",
+        "encoder_increase",
+        "encoder_decrease",
+    ),
+)
+
+
+def compile_layout(
+    keys: Iterable[Optional["Key"]],
+    encoder_button: Optional[Command] = None,
+    encoder_increase: Optional[Command] = None,
+    encoder_decrease: Optional[Command] = None,
+) -> KeyLayout:
+    """Compile keys and encoder commands into a KeyLayout.
+
+    Args:
+        keys (Iterable[Optional[Key]]): A Key (or None) for each key number
+        encoder_button (Optional[Command], optional): The command for the
+            encoder button. Defaults to None.
+        encoder_increase (Optional[Command], optional): The command for
+            rotating the encoder clockwise. Defaults to None.
+        encoder_decrease (Optional[Command], optional): The command for
+            rotating the encoder counter-clockwise. Defaults to None.
+
+    Returns:
+        KeyLayout: The compiled layout
+    """
+    keys = tuple(keys)
+    return KeyLayout(
+        keys,
+        tuple(
+            index
+            for index, key in enumerate(keys)
+            if getattr(key, "double_tap_command", None) is not None
+        ),
+        encoder_button,
+        encoder_increase,
+        encoder_decrease,
+    )
+
+
+# Layouts compiled so far, keyed by class
+_compiled_layouts: Dict[type, KeyLayout] = {}
+
+
+def compile_class_layout(cls: type) -> KeyLayout:
+    """Return the KeyLayout for the key and encoder attributes of a class.
+
+    The layout is compiled the first time and cached for the class.
+
+    Args:
+        cls (type): A class with key_0 to key_11, encoder_button,
+            encoder_increase and encoder_decrease attributes
+
+    Returns:
+        KeyLayout: The compiled layout
+    """
+    layout = _compiled_layouts.get(cls)
+    if layout is None:
+        layout = compile_layout(
+            [getattr(cls, "key_%s" % index) for index in range(12)],
+            cls.encoder_button,
+            cls.encoder_increase,
+            cls.encoder_decrease,
+        )
+        _compiled_layouts[cls] = layout
+    return layout
+
+
+# Chords compiled so far, keyed by class
+_compiled_chords: Dict[type, Tuple[Dict[int, Command], ChordTable]] = {}
+
+# Shared by classes without any chords
+_NO_CHORDS: Tuple[Dict[int, Command], ChordTable] = ({}, ChordTable(()))
+
+
+def compile_class_chords(cls: type) -> Tuple[Dict[int, Command], ChordTable]:
+    """Return the commands and ChordTable for the chords attribute of a class.
+
+    The chords are compiled the first time and cached for the class.
+
+    Args:
+        cls (type): A class with a chords attribute mapping tuples of key
+            numbers to commands
+
+    Returns:
+        Tuple[Dict[int, Command], ChordTable]: The command for each chord
+            bitmask, and the table used to detect the chords
+    """
+    chords = _compiled_chords.get(cls)
+    if chords is None:
+        if cls.chords:
+            commands = {
+                chord_mask(keys): command for keys, command in cls.chords.items()
+            }
+            chords = (commands, ChordTable(commands))
+        else:
+            chords = _NO_CHORDS
+        _compiled_chords[cls] = chords
+    return chords
+
+
+# Sequence tries compiled so far, keyed by class
+_compiled_sequences: Dict[type, Dict[int, Any]] = {}
+
+
+def compile_class_sequences(cls: type) -> Dict[int, Any]:
+    """Return the trie for the sequences attribute of a class.
+
+    The trie is compiled the first time and cached for the class.
+
+    Args:
+        cls (type): A class with a sequences attribute mapping tuples of key
+            numbers to Keys
+
+    Returns:
+        Dict[int, Any]: The root node of the trie, see compile_sequence_trie
+    """
+    trie = _compiled_sequences.get(cls)
+    if trie is None:
+        trie = _compiled_sequences[cls] = compile_sequence_trie(cls.sequences)
+    return trie
+
+
 class KeyAppSettings(BaseSettings):
-    color_scheme: Dict[str, int] = {
-        COLOR_1: 0x4D0204,
-        COLOR_2: 0x431A04,
-        COLOR_3: 0x442602,
-        COLOR_4: 0x4E1C02,
-        COLOR_5: 0x4F3803,
-        COLOR_6: 0x243417,
-        COLOR_7: 0x112A22,
-        COLOR_8: 0x132423,
-        COLOR_9: 0x161D24,
-        COLOR_10: 0x0A1F28,
-    }
-    host_os: str = OS_WINDOWS
-    pixels_disabled: bool = False
-    pixels_disabled_timeout: int = 15 * ONE_MINUTE
+    color_scheme = Setting(
+        {
+            COLOR_1: 0x4D0204,
+            COLOR_2: 0x431A04,
+            COLOR_3: 0x442602,
+            COLOR_4: 0x4E1C02,
+            COLOR_5: 0x4F3803,
+            COLOR_6: 0x243417,
+            COLOR_7: 0x112A22,
+            COLOR_8: 0x132423,
+            COLOR_9: 0x161D24,
+            COLOR_10: 0x0A1F28,
+        },
+        type_=dict,
+    )
+    host_os = Setting(OS_WINDOWS, choices=(OS_LINUX, OS_MAC, OS_WINDOWS))
+    pixels_disabled = Setting(False, type_=bool)
+    pixels_disabled_timeout = Setting(15 * ONE_MINUTE, type_=int)
+
+    persistent_settings = (OS_SETTING,)
 
     def __init__(
         self,
@@ -115,14 +296,14 @@ class KeyAppSettings(BaseSettings):
         pixels_disabled_timeout: Optional[int] = None,
         **kwargs,
     ):
-        if color_scheme is not None:
-            self.color_scheme = color_scheme
-        if host_os is not None:
-            self.host_os = host_os
-        if pixels_disabled is not None:
-            self.pixels_disabled = pixels_disabled
-        if pixels_disabled_timeout is not None:
-            self.pixels_disabled_timeout = pixels_disabled_timeout
+        for name, value in (
+            ("color_scheme", color_scheme),
+            ("host_os", host_os),
+            ("pixels_disabled", pixels_disabled),
+            ("pixels_disabled_timeout", pixels_disabled_timeout),
+        ):
+            if value is not None:
+                kwargs[name] = value
         super().__init__(**kwargs)
 
     def color(self, color_name: str) -> int:
@@ -143,13 +324,17 @@ class KeyApp(BaseApp):
     To use this class, subclass KeyApp and specify values for each key you
     want to use.
 
+    The key and encoder attributes are compiled into a KeyLayout the first
+    time the class is instantiated. Changing them afterwards has no effect.
+    Instances only hold their own bound keys.
+
     """
 
     name = "Key App"
 
     settings: KeyAppSettings
 
-    display_group = init_display_group_macro_app(DISPLAY_WIDTH, DISPLAY_HEIGHT)
+    display_layout = staticmethod(init_display_group_macro_app)
 
     # First row
     key_0: Optional["Key"] = None
@@ -176,6 +361,37 @@ class KeyApp(BaseApp):
     encoder_increase: Optional[Command] = None
     encoder_decrease: Optional[Command] = None
 
+    # Commands run by pressing several keys together, keyed by a tuple of the
+    # key numbers, e.g. {(0, 2): Press(Keycode.CONTROL, Keycode.D)}
+    chords: Dict[Tuple[int, ...], Command] = {}
+
+    # Keys selected by a sequence of key presses after a LeaderCommand, keyed
+    # by a tuple of the key numbers, e.g. {(3, 1, 4): Key("Pi", 0, Text("pi"))}
+    sequences: Dict[Tuple[int, ...], "Key"] = {}
+
+    HOLD_TIME = 0.3
+    # The time in seconds a key must be held down to run its hold command,
+    # unless the Key sets its own
+
+    CHORD_TIMEOUT = 0.05
+    # The time in seconds to wait for the rest of a chord after its first key
+
+    LEADER_TIMEOUT = 2.0
+    # The time in seconds to wait for each key of a leader sequence
+
+    LEADER_COLOR = 0x202020
+    # The pixel color of keys which continue a leader sequence
+
+    REPEAT_RATE = RepeatRate(0.4, 0.1, 0.85, 0.02)
+    # How keys repeat while held down, unless the Key sets its own
+
+    # Created when first needed and kept across pipeline compiles, so a layer
+    # change doesn't lose a hold, a chord or a leader sequence
+    _hold_stage: Optional[HoldStage] = None
+    _chord_stage: Optional[ChordStage] = None
+    _leader_stage: Optional[LeaderStage] = None
+    _repeat_stage: Optional[RepeatStage] = None
+
     def __init__(self, app_pad: AppPad, settings: Optional[KeyAppSettings] = None):
         """Initialize the KeyApp.
 
@@ -183,26 +399,115 @@ class KeyApp(BaseApp):
             app_pad (AppPad): An AppPad instance
             settings (KeyAppSettings): A KeyAppSettings instance
         """
+        self.layout = self.get_layout()
+        self.double_tap_key_indices: Tuple[int, ...] = self.layout.double_tap_indices
+        self._prepared: Optional[tuple] = None
+        self.chord_commands, self.chord_table = compile_class_chords(self.__class__)
+        self.sequence_trie = compile_class_sequences(self.__class__)
+
+        if settings is None:
+            settings = KeyAppSettings()
+
+        super().__init__(app_pad, settings)
+
+        # Keys resolve anything that depends on settings when they are bound
+        self._settings_version = self.settings.version
         self.keys: List[Optional[Key.BoundKey]] = []
-        self.double_tap_key_indices: Set[int] = set()
+        for index, key in enumerate(self.layout.keys):
+            self.keys.append(None if key is None else key.bind(self, index))
+        self.compile_key_handlers()
+
+        # The commands executed by the encoder button, each held chord and the
+        # held leader sequence, so their release undoes the same command even
+        # if a setting changed in between
+        self._encoder_button_pressed: Optional[Command] = None
+        self._chords_pressed: Dict[int, Optional[Command]] = {}
+        self._sequence_pressed: Optional[Command] = None
+
+        # The bound keys that use each setting, subscribed to while focused
+        self._dependents: Dict[str, List[Key.BoundKey]] = {}
+        self._subscribed = False
+        self._settings_callback = self.setting_changed
+        for key in self.bound_keys():
+            self.index_key(key)
+
+    @classmethod
+    def compile_layout(cls) -> KeyLayout:
+        """Return the KeyLayout for this class, compiling it on first use.
+
+        Returns:
+            KeyLayout: The compiled key and encoder bindings of the class
+        """
+        return compile_class_layout(cls)
 
-        for index in range(12):
-            key = getattr(self, "key_%s" % index)
+    def get_layout(self) -> KeyLayout:
+        """Return the KeyLayout for this instance.
 
-            try:
-                bound_key = key.bind(self, index)
-            except AttributeError:
-                bound_key = None
-            else:
-                if key.double_tap_command is not None:
-                    self.double_tap_key_indices.add(index)
+        Override this for apps whose keys aren't known until they are
+        constructed.
 
-            self.keys.append(bound_key)
+        Returns:
+            KeyLayout: The key and encoder bindings for the app
+        """
+        return self.compile_layout()
 
-        if settings is None:
-            settings = KeyAppSettings()
+    def compile_key_handlers(self):
+        """Build the per-key handler arrays used by key_event,
+        double_tap_event and hold_event, and the hold time and repeat rate of
+        each key.
 
-        super().__init__(app_pad, settings)
+        Call this whenever self.keys changes.
+        """
+        self._key_handlers = tuple(
+            _NO_KEY if key is None else (key.release, key.press) for key in self.keys
+        )
+        self._double_tap_handlers = tuple(
+            _NO_KEY if key is None else (key.double_tap_release, key.double_tap)
+            for key in self.keys
+        )
+        # None for keys without a hold command, which are never delayed
+        hold_times = tuple(
+            None
+            if key is None or key.key.hold_command is None
+            else key.key.hold_time or self.HOLD_TIME
+            for key in self.keys
+        )
+        if not any(hold_time is not None for hold_time in hold_times):
+            self.hold_times: Tuple[Optional[float], ...] = _NO_HOLD_TIMES
+            self._hold_handlers = _NO_HOLD_HANDLERS
+        else:
+            self.hold_times = hold_times
+            self._hold_handlers = tuple(
+                _NO_KEY if hold_time is None else (key.hold_release, key.hold)
+                for key, hold_time in zip(self.keys, hold_times)
+            )
+
+        # Keys with a hold command don't repeat
+        repeat_rates = tuple(
+            None
+            if key is None or hold_time is not None
+            else self.key_repeat_rate(key.key)
+            for key, hold_time in zip(self.keys, hold_times)
+        )
+        if not any(rate is not None for rate in repeat_rates):
+            repeat_rates = _NO_REPEAT_RATES
+        self.repeat_rates: Tuple[Optional[RepeatRate], ...] = repeat_rates
+
+    def key_repeat_rate(self, key: "Key") -> Optional[RepeatRate]:
+        """Return how a Key repeats while held down.
+
+        Args:
+            key (Key): The Key
+
+        Returns:
+            Optional[RepeatRate]: The rate, or None if the Key doesn't repeat
+        """
+        rate = key.repeat_rate
+        if rate is None:
+            rate = getattr(key.command, "repeats", False)
+        if rate is True:
+            return self.REPEAT_RATE
+        return rate or None
 
     def __getitem__(self, index):
         try:
@@ -221,15 +526,22 @@ class KeyApp(BaseApp):
     def on_focus(self):
         """Code to execute when an app is focused.
 
-        In addition to setting up the state of the display and pixels, instruct
-        the app_pad to track double-taps for any keys with a double-tap command.
+        In addition to setting up the state of the display and pixels, the
+        event pipeline detects double-taps for any keys with a double-tap
+        command.
 
         Also add a timer to disable the pixels after a certain period of
         inactivity.
 
         """
+        # Discard labels and colors rendered before a setting changed
+        if self._prepared is not None and self._prepared[0] != self.settings.version:
+            self._prepared = None
+
+        self.refresh_settings()
+        self.subscribe_settings()
         super().on_focus()
-        self.app_pad.track_double_taps(self.double_tap_key_indices)
+        self._prepared = None
 
         if self.settings.pixels_disabled_timeout:
             self.app_pad.add_timer(
@@ -238,82 +550,233 @@ class KeyApp(BaseApp):
                 self.disable_pixels,
             )
 
+    def bound_keys(self) -> Iterable["Key.BoundKey"]:
+        """Return every key bound to this app.
+
+        Returns:
+            Iterable[Key.BoundKey]: The bound keys
+        """
+        return (key for key in self.keys if key is not None)
+
+    def refresh_settings(self):
+        """Resolve the keys again if any setting changed since they were
+        resolved.
+
+        Keys cache whatever depends on settings, such as the command for the
+        host OS, so pressing them doesn't have to look it up.
+        """
+        version = self.settings.version
+        if version != self._settings_version:
+            self._settings_version = version
+            for key in self.bound_keys():
+                key.resolve()
+
+    def on_blur(self):
+        """Stop listening for setting changes when the app stops running."""
+        super().on_blur()
+        self.unsubscribe_settings()
+
+    def index_key(self, key: "Key.BoundKey"):
+        """Add a bound key to the index of the keys using each setting.
+
+        Args:
+            key (Key.BoundKey): A key bound to this app
+        """
+        for setting in key.key.settings_used():
+            dependents = self._dependents.get(setting)
+            if dependents is None:
+                dependents = self._dependents[setting] = []
+                if self._subscribed:
+                    self.settings.subscribe(setting, self._settings_callback)
+            if key not in dependents:
+                dependents.append(key)
+
+    def subscribe_settings(self):
+        """Subscribe to changes to the settings used by the keys."""
+        if not self._subscribed:
+            self._subscribed = True
+            for setting in self._dependents:
+                self.settings.subscribe(setting, self._settings_callback)
+
+    def unsubscribe_settings(self):
+        """Stop listening for changes to the settings used by the keys."""
+        if self._subscribed:
+            self._subscribed = False
+            for setting in self._dependents:
+                self.settings.unsubscribe(setting, self._settings_callback)
+
+    def setting_changed(self, setting: str, value: Any):
+        """Re-render the keys that use a setting after it changed.
+
+        Only keys in the dependency index for the setting are updated.
+
+        Args:
+            setting (str): The name of the setting
+            value (Any): The new value of the setting
+        """
+        keys = self.keys
+        for key in self._dependents.get(setting, ()):
+            key.resolve()
+            if keys[key.key_number] is key and not self.settings.pixels_disabled:
+                key.label = key.text()
+                key.pixel = key.color()
+        # Only the keys above depend on settings that changed while focused
+        self._settings_version = self.settings.version
+        self.macropad.display.refresh()
+        self.macropad.pixels.show()
+
+    def prepare(self):
+        """Render the text and color of each key ahead of the next focus."""
+        self.refresh_settings()
+        self._prepared = (
+            self.settings.version,
+            [key.text() if key is not None else "" for key in self.keys],
+            [key.color() if key is not None else 0 for key in self.keys],
+        )
+
+    def switch_targets(self) -> List[LazyApp]:
+        """Return the apps the keys and encoder of this app can switch to.
+
+        Returns:
+            List[LazyApp]: The apps this app can switch to, in key order
+        """
+        commands = []
+        for key in self.keys:
+            if key is not None:
+                commands.extend(key.key.commands())
+        commands.extend(
+            (
+                self.layout.encoder_button,
+                self.layout.encoder_increase,
+                self.layout.encoder_decrease,
+            )
+        )
+
+        targets = []
+        while commands:
+            command = commands.pop(0)
+            if command is None:
+                continue
+            if isinstance(command, SwitchAppCommand):
+                if command.lazy_app not in targets:
+                    targets.append(command.lazy_app)
+            commands.extend(command.subcommands())
+        return targets
+
     def display_on_focus(self):
         """Set up the display when an app is focused.
 
         Set the display label to the name of the app, and set any key labels
-        that have Keys defined.
+        that have Keys defined. Labels rendered by prepare are used if they
+        are still valid.
 
         """
         self.display_group[13].text = self.name
 
+        prepared = self._prepared
         for i, key in enumerate(self.keys):
-            try:
-                key.label = key.text()
-            except AttributeError:
+            if key is None:
                 self.display_group[i].text = ""
+            elif prepared is not None:
+                key.label = prepared[1][i]
+            else:
+                key.label = key.text()
 
     def pixels_on_focus(self):
         """Set up the pixels when an app is focused.
 
-        Set the pixel colors for any keys that have Keys defined.
+        Set the pixel colors for any keys that have Keys defined. Colors
+        rendered by prepare are used if they are still valid.
+
+        The pixels_disabled setting is only changed when the pixels wake, as
+        each change invalidates the keys resolved and rendered by every app.
 
         """
+        prepared = self._prepared
         for i, key in enumerate(self.keys):
-            try:
-                key.pixel = key.color()
-            except AttributeError:
+            if key is None:
                 self.macropad.pixels[i] = 0
-        self.settings.pixels_disabled = False
+            elif prepared is not None:
+                key.pixel = prepared[2][i]
+            else:
+                key.pixel = key.color()
+        if self.settings.pixels_disabled:
+            self.settings[PIXELS_DISABLED_SETTING] = False
 
     def disable_pixels(self):
-        """Turn off all the pixels on the keypad."""
+        """Turn off all the pixels on the keypad.
+
+        Runs when the pixel timer is due. If there was input since the timer
+        was set, the timer is set again for the rest of the timeout instead.
+        """
+        timeout = self.settings.pixels_disabled_timeout
+        idle_time = self.app_pad.idle_time
+        if timeout and idle_time < timeout:
+            self.app_pad.add_timer(
+                TIMER_DISABLE_PIXELS, timeout - idle_time, self.disable_pixels
+            )
+            return
+
         # Clear the pixels
         for i in range(len(self.keys)):
             self.app_pad.pixels[i] = 0
         self.app_pad.pixels.show()
 
         # Clear the display
-        self.macropad.display.show(EMPTY_DISPLAY_GROUP)
+        self.macropad.display.show(get_display_group(init_display_group_empty))
         self.macropad.display.refresh()
 
-        self.settings.pixels_disabled = True
+        self.settings[PIXELS_DISABLED_SETTING] = True
+        self.compile_pipeline()
 
-    def process_event(
-        self, event: Union[DoubleTapEvent, EncoderButtonEvent, EncoderEvent, KeyEvent]
-    ):
-        # Reset the pixel disable timer
-        if self.settings.pixels_disabled_timeout:
-            self.app_pad.add_timer(
-                TIMER_DISABLE_PIXELS,
-                self.settings.pixels_disabled_timeout,
-                self.disable_pixels,
-            )
+    def pipeline_stages(self) -> List[Stage]:
+        """Return the stages every event passes through before it is handled.
 
-        # If pixels are disabled, redisplay
-        if self.settings.pixels_disabled:
-            self.on_focus()
-            return
+        While the pixels are disabled, the first event only wakes the app.
+        Leader sequences and chords are detected if the app has any, then
+        holds and double-taps for any keys with a hold or double-tap command.
+        Last, keys which repeat are repeated while held down.
 
-        super().process_event(event)
+        Returns:
+            List[Stage]: The stages, in the order events pass through them
+        """
+        stages = super().pipeline_stages()
+        if self.settings.pixels_disabled:
+            stages.insert(0, ActivityStage(self._wake))
+        if self.sequence_trie:
+            if self._leader_stage is None:
+                self._leader_stage = LeaderStage(self.LEADER_TIMEOUT)
+            stages.append(self._leader_stage)
+        if self.chord_table.keys:
+            if self._chord_stage is None:
+                self._chord_stage = ChordStage(self.CHORD_TIMEOUT)
+            stages.append(self._chord_stage)
+        if self.hold_times is not _NO_HOLD_TIMES:
+            if self._hold_stage is None:
+                self._hold_stage = HoldStage()
+            stages.append(self._hold_stage)
+        if self.double_tap_key_indices:
+            stages.append(DoubleTapStage())
+        if self.repeat_rates is not _NO_REPEAT_RATES:
+            if self._repeat_stage is None:
+                self._repeat_stage = RepeatStage()
+            stages.append(self._repeat_stage)
+        return stages
+
+    def _wake(self, event) -> bool:
+        self.on_focus()
+        return True
 
     def key_event(self, event: KeyEvent):
         """Process a key event.
 
-        Delegate to the command defined on the Key.BoundKey object.
+        Delegate to the press or release method of the Key.BoundKey, looked
+        up in the per-key handler array.
 
         Args:
             event (KeyEvent): An event triggered by pressing a key
         """
-        key = self[event.number]
-
-        if key is None:
-            return
-
-        if event.pressed:
-            key.press()
-        else:
-            key.release()
+        self._key_handlers[event.number][1 if event.pressed else 0]()
 
     def encoder_button_event(self, event: EncoderButtonEvent):
         """Process an encoder button event.
@@ -324,53 +787,156 @@ class KeyApp(BaseApp):
             event (EncoderButtonEvent): An event triggered by pressing the
                 encoder button
         """
-        if self.encoder_button is None:
+        encoder_button = self.layout.encoder_button
+        if encoder_button is None:
             return
 
         if event.pressed:
-            self.encoder_button.execute(self)
-        else:
-            self.encoder_button.undo(self)
+            self._encoder_button_pressed = Key._execute(encoder_button, self)
+            return
+
+        command = self._encoder_button_pressed or encoder_button
+        self._encoder_button_pressed = None
+        command.undo(self)
 
     def encoder_event(self, event: EncoderEvent):
         """Process an encoder event.
 
         Delegate to the commands defined on the encoder_increase and
-        encoder_decrease attributes.
+        encoder_decrease attributes. The command runs once for each step of
+        the rotation, so merged events behave the same as separate ones.
 
         Args:
             event (EncoderEvent): An event triggered by rotating the encoder
         """
-        if (
-            event.position > event.previous_position
-            and self.encoder_increase is not None
-        ):
-            self.encoder_increase.execute(self)
-            self.encoder_increase.undo(self)
-        elif (
-            event.position < event.previous_position
-            and self.encoder_decrease is not None
-        ):
-            self.encoder_decrease.execute(self)
-            self.encoder_decrease.undo(self)
+        steps = event.position - event.previous_position
+        if steps > 0:
+            command = self.layout.encoder_increase
+        elif steps < 0:
+            command = self.layout.encoder_decrease
+            steps = -steps
+        else:
+            return
+
+        if command is not None:
+            for _ in range(steps):
+                command.execute(self)
+                command.undo(self)
 
     def double_tap_event(self, event: DoubleTapEvent):
         """Process a double tap event.
 
-        Delegate to the command defined on the Key.BoundKey object.
+        Delegate to the double-tap methods of the Key.BoundKey, looked up in
+        the per-key handler array.
 
         Args:
             event (DoubleTapEvent): An event triggered by double-tapping a key
         """
-        key = self[event.number]
+        self._double_tap_handlers[event.number][1 if event.pressed else 0]()
+
+    def hold_event(self, event: HoldEvent):
+        """Process a hold event.
+
+        Delegate to the hold methods of the Key.BoundKey, looked up in the
+        per-key handler array.
+
+        Args:
+            event (HoldEvent): An event triggered by holding a key down, or
+                by releasing a held key
+        """
+        self._hold_handlers[event.number][1 if event.pressed else 0]()
+
+    def chord_event(self, event: ChordEvent):
+        """Process a chord event.
 
-        if key is None:
+        Delegate to the command for the chord in the chords attribute.
+
+        Args:
+            event (ChordEvent): An event triggered by pressing several keys
+                together, or by releasing them
+        """
+        command = self.chord_commands.get(event.keys)
+        if command is None:
             return
 
         if event.pressed:
-            key.double_tap()
+            self._chords_pressed[event.keys] = Key._execute(command, self)
+        else:
+            (self._chords_pressed.pop(event.keys, None) or command).undo(self)
+
+    def sequence_event(self, event: SequenceEvent):
+        """Process a leader sequence event.
+
+        Delegate to the press or release method of the Key for the sequence.
+
+        Args:
+            event (SequenceEvent): An event triggered by pressing or
+                releasing the last key of a leader sequence
+        """
+        if event.pressed:
+            self._sequence_pressed = event.key.press(self)
         else:
-            key.double_tap_release()
+            event.key.release(self, self._sequence_pressed)
+            self._sequence_pressed = None
+
+    def repeat_event(self, event: RepeatEvent):
+        """Process a repeat event.
+
+        Delegate to the repeat method of the Key.BoundKey.
+
+        Args:
+            event (RepeatEvent): An event triggered by holding down a key
+                which repeats
+        """
+        key = self.keys[event.number]
+        if key is not None:
+            key.repeat()
+
+    def start_leader(self):
+        """Match the next key presses against the app's sequences.
+
+        Does nothing if the app has no sequences.
+        """
+        if self._leader_stage is not None:
+            self._leader_stage.start()
+
+    def show_sequence_hints(self, node: Dict[int, Any], sequence: List[int]):
+        """Show the keys which can continue a leader sequence.
+
+        Keys which complete a sequence show the label and color of its Key.
+        Keys which lead to longer sequences show "..." in LEADER_COLOR. The
+        other keys are blanked.
+
+        Args:
+            node (Dict[int, Any]): The trie node reached so far
+            sequence (List[int]): The key numbers pressed so far
+        """
+        pixels = self.macropad.pixels
+        group = self.display_group
+        for i in range(12):
+            child = node.get(i)
+            if child is None:
+                pixels[i] = 0
+                group[i].text = ""
+            elif isinstance(child, dict):
+                pixels[i] = self.LEADER_COLOR
+                group[i].text = "..."
+            else:
+                pixels[i] = child.color(self)
+                group[i].text = child.text(self)
+        title = "Leader"
+        if sequence:
+            title += " " + "-".join(str(number) for number in sequence)
+        group[13].text = title
+        pixels.show()
+        self.macropad.display.refresh()
+
+    def hide_sequence_hints(self):
+        """Show the app's own keys again after a leader sequence."""
+        self.display_on_focus()
+        self.macropad.display.refresh()
+        self.pixels_on_focus()
+        self.macropad.pixels.show()
 
 
 class Key:
@@ -380,11 +946,35 @@ class Key:
     key is pressed, and an optional double-tap Command that is executed when
     the key is pressed twice quickly.
 
+    Keys created with the same arguments share one instance, since a Key
+    doesn't change after it is created. State for a key in a particular app is
+    kept in its BoundKey.
+
     """
 
+    __slots__ = (
+        "command",
+        "double_tap_command",
+        "hold_command",
+        "hold_time",
+        "repeat_rate",
+        "_color",
+        "_text",
+    )
+
+    interned = False
+    # Whether equal calls share one instance, see utils.interning
+
+    def __new__(cls, *args, **kwargs):
+        if cls.interned:
+            return intern(cls, args, kwargs)
+        return object.__new__(cls)
+
     class BoundKey:
         """A class representing a Key bound to a specific App and key number."""
 
+        __slots__ = ("key", "app", "key_number", "_pressed")
+
         def __init__(self, key: "Key", app: KeyApp, key_number: int):
             """Initialize the BoundKey.
 
@@ -397,6 +987,9 @@ class Key:
             self.key = key
             self.app = app
             self.key_number = key_number
+            # The command executed by the last press, double tap or hold,
+            # which is undone when the key is released
+            self._pressed: Optional[Command] = None
 
         @property
         def pixel(self) -> int:
@@ -455,21 +1048,43 @@ class Key:
             """
             return self.key.color(self.app)
 
+        def resolve(self):
+            """Update anything cached from the app settings.
+
+            Called when a setting has changed.
+            """
+            pass
+
         def press(self):
             """Execute the Command defined for the key."""
-            self.key.press(self.app)
+            self._pressed = self.key.press(self.app)
 
         def release(self):
-            """Undo the Command defined for the key."""
-            self.key.release(self.app)
+            """Undo the Command executed when the key was pressed."""
+            self.key.release(self.app, self._pressed)
+            self._pressed = None
 
         def double_tap(self):
             """Execute the double-tap command defined for the key."""
-            self.key.double_tap(self.app)
+            self._pressed = self.key.double_tap(self.app)
 
         def double_tap_release(self):
-            """Undo the double-tap command defined for the key."""
-            self.key.double_tap_release(self.app)
+            """Undo the double-tap command executed for the key."""
+            self.key.double_tap_release(self.app, self._pressed)
+            self._pressed = None
+
+        def hold(self):
+            """Execute the hold command defined for the key."""
+            self._pressed = self.key.hold(self.app)
+
+        def hold_release(self):
+            """Undo the hold command executed for the key."""
+            self.key.hold_release(self.app, self._pressed)
+            self._pressed = None
+
+        def repeat(self):
+            """Repeat the Command defined for the key while it is held."""
+            self.key.repeat(self.app, self._pressed)
 
         def __str__(self) -> str:
             return f"{self.__class__.__name__}({self.key_number} - {self.key})"
@@ -480,6 +1095,9 @@ class Key:
         color: Union[int, str] = 0,
         command: Optional[Command] = None,
         double_tap_command: Optional[Command] = None,
+        hold_command: Optional[Command] = None,
+        hold_time: Optional[float] = None,
+        repeat_rate: Union[None, bool, RepeatRate] = None,
     ):
         """Initialize the Key.
 
@@ -493,10 +1111,24 @@ class Key:
                 pressing the key. Defaults to None.
             double_tap_command (Optional[Command], optional): The Command to
                 execute when double-tapping a Key. Defaults to None.
+            hold_command (Optional[Command], optional): The Command to execute
+                when holding a Key down. Defaults to None.
+            hold_time (Optional[float], optional): The time in seconds the Key
+                must be held down to execute hold_command. If None, the app's
+                HOLD_TIME is used. Defaults to None.
+            repeat_rate (Union[None, bool, RepeatRate], optional): How the
+                command repeats while the Key is held down. True repeats at
+                the app's REPEAT_RATE and False never repeats. If None, the
+                Key repeats if its command repeats, like MouseMove and
+                Scroll. Keys with a hold command never repeat.
+                Defaults to None.
 
         """
         self.command = command
         self.double_tap_command = double_tap_command
+        self.hold_command = hold_command
+        self.hold_time = hold_time
+        self.repeat_rate = repeat_rate
         self._color = color
         self._text = text
 
@@ -524,45 +1156,131 @@ class Key:
             return app.settings.color(self._color)
         return self._color
 
-    def press(self, app: KeyApp):
+    @staticmethod
+    def _execute(command: Optional[Command], app: KeyApp) -> Optional[Command]:
+        """Resolve a command for the current settings and execute it.
+
+        Args:
+            command (Optional[Command]): The command to execute
+            app (KeyApp): A KeyApp instance
+
+        Returns:
+            Optional[Command]: The command that was executed
+        """
+        if command:
+            command = command.resolve(app)
+            if command:
+                command.execute(app)
+        return command
+
+    def press(self, app: KeyApp) -> Optional[Command]:
         """Execute the command for this Key.
 
         Args:
             app (KeyApp): A KeyApp instance
 
+        Returns:
+            Optional[Command]: The command that was executed, to pass to
+                release
         """
-        if self.command:
-            self.command.execute(app)
+        return self._execute(self.command, app)
 
-    def release(self, app: KeyApp):
+    def release(self, app: KeyApp, command: Optional[Command] = None):
         """Undo the command for this Key.
 
         Args:
             app (KeyApp): A KeyApp instance
+            command (Optional[Command], optional): The command returned by
+                press. Defaults to the command for the current settings.
 
         """
-        if self.command:
-            self.command.undo(app)
+        command = command or self.command
+        if command:
+            command.undo(app)
 
-    def double_tap(self, app: KeyApp):
+    def double_tap(self, app: KeyApp) -> Optional[Command]:
         """Execute the double-tap command for this Key.
 
         Args:
             app (KeyApp): A KeyApp instance
 
+        Returns:
+            Optional[Command]: The command that was executed, to pass to
+                double_tap_release
         """
-        if self.double_tap_command:
-            self.double_tap_command.execute(app)
+        return self._execute(self.double_tap_command, app)
 
-    def double_tap_release(self, app):
+    def double_tap_release(self, app: KeyApp, command: Optional[Command] = None):
         """Undo the double-tap command for this Key.
 
         Args:
             app (KeyApp): A KeyApp instance
+            command (Optional[Command], optional): The command returned by
+                double_tap. Defaults to the command for the current settings.
+
+        """
+        command = command or self.double_tap_command
+        if command:
+            command.undo(app)
+
+    def hold(self, app: KeyApp) -> Optional[Command]:
+        """Execute the hold command for this Key.
+
+        Args:
+            app (KeyApp): A KeyApp instance
+
+        Returns:
+            Optional[Command]: The command that was executed, to pass to
+                hold_release
+        """
+        return self._execute(self.hold_command, app)
+
+    def hold_release(self, app: KeyApp, command: Optional[Command] = None):
+        """Undo the hold command for this Key.
+
+        Args:
+            app (KeyApp): A KeyApp instance
+            command (Optional[Command], optional): The command returned by
+                hold. Defaults to the command for the current settings.
+
+        """
+        command = command or self.hold_command
+        if command:
+            command.undo(app)
+
+    def repeat(self, app: KeyApp, command: Optional[Command] = None):
+        """Repeat the command for this Key while it is held down.
+
+        The command is undone and executed again.
+
+        Args:
+            app (KeyApp): A KeyApp instance
+            command (Optional[Command], optional): The command returned by
+                press. Defaults to the command for the current settings.
 
         """
-        if self.double_tap_command:
-            self.double_tap_command.undo(app)
+        command = command or self.command
+        if command:
+            command.undo(app)
+            command.execute(app)
+
+    def commands(self) -> Iterable[Command]:
+        """Return the commands bound to this Key.
+
+        Returns:
+            Iterable[Command]: The commands, which may include None
+        """
+        return (self.command, self.double_tap_command, self.hold_command)
+
+    def settings_used(self) -> Iterable[str]:
+        """Return the names of the settings the text or color depend on.
+
+        Returns:
+            Iterable[str]: The setting names
+        """
+        if isinstance(self._color, str):
+            return ("color_scheme",)
+        return ()
 
     def bind(self, app: KeyApp, key_number: int) -> BoundKey:
         """Bind this Key to a KeyApp and return a BoundKey instance.
@@ -586,6 +1304,8 @@ class SettingsValueKey(Key):
 
     """
 
+    __slots__ = ("setting", "color_mapping", "text_template")
+
     def __init__(
         self,
         setting: str,
@@ -593,6 +1313,9 @@ class SettingsValueKey(Key):
         double_tap_command: Optional[Command] = None,
         color_mapping: Optional[Dict[str, Union[int, str]]] = None,
         text_template: str = "{value}",
+        hold_command: Optional[Command] = None,
+        hold_time: Optional[float] = None,
+        repeat_rate: Union[None, bool, RepeatRate] = None,
     ):
         """Initialize the SettingsValueKey.
 
@@ -610,9 +1333,21 @@ class SettingsValueKey(Key):
             text_template (str, optional): A template string to determine the
                 text for the key. The keys for the template string are setting
                 and value. Defaults to "{value}".
+            hold_command (Optional[Command], optional): A command to execute
+                when the key is held down. Defaults to None.
+            hold_time (Optional[float], optional): The time in seconds the key
+                must be held down to execute hold_command. Defaults to None.
+            repeat_rate (Union[None, bool, RepeatRate], optional): How the
+                command repeats while the key is held down. Defaults to None.
 
         """
-        super().__init__(command=command, double_tap_command=double_tap_command)
+        super().__init__(
+            command=command,
+            double_tap_command=double_tap_command,
+            hold_command=hold_command,
+            hold_time=hold_time,
+            repeat_rate=repeat_rate,
+        )
         self.setting = setting
         self.color_mapping = color_mapping
         self.text_template = text_template
@@ -630,61 +1365,23 @@ class SettingsValueKey(Key):
             return color
         return 0
 
+    def settings_used(self) -> Iterable[str]:
+        return (self.setting, "color_scheme")
+
 
 class SettingsSelectKey(Key):
     """A key which stores a value to a setting when pressed.
 
     Multiple keys can be linked to the same setting. The text and color for all
-    keys will be updated whenever the key is pressed.
+    keys using the setting are updated whenever the key is pressed.
 
     """
 
+    __slots__ = ("setting", "value")
+
     marker = ">"
     template = "{marker} {text}"
 
-    class BoundKey(Key.BoundKey):
-        """A SettingsSelectKey bound to a specific app and key number."""
-
-        def __init__(self, key: "SettingsSelectKey", app: KeyApp, key_number: int):
-            """Initialize the BoundKey.
-
-            Args:
-                key (SettingsSelectKey): A SettingsSelectKey instance
-                app (KeyApp): A KeyApp instance to bind
-                    to
-                key_number (int): The key number to bind to
-            """
-            super().__init__(key, app, key_number)
-            self.related_keys: Set[SettingsSelectKey.BoundKey] = set()
-
-            setting = key.setting
-            for bound_key in app.keys:
-                if not isinstance(bound_key, SettingsSelectKey.BoundKey):
-                    continue
-
-                if bound_key.key.setting == setting:
-                    self.related_keys.add(bound_key)
-                    bound_key.related_keys.add(self)
-
-        def press(self):
-            """Logic to run when the key is pressed.
-
-            Update the setting associated with the key.
-            Optionally run the command tied to the key.
-            Update the text and pixel for the key and any related keys.
-
-            """
-            self.key.press(self.app)
-            self.pixel = self.color()
-            self.label = self.text()
-
-            for key in self.related_keys:
-                key.pixel = key.color()
-                key.label = key.text()
-
-            self.app.macropad.display.refresh()
-            self.app.macropad.pixels.show()
-
     def __init__(
         self,
         text: str = "",
@@ -748,32 +1445,76 @@ class SettingsSelectKey(Key):
             return super().color(app)
         return 0
 
-    def press(self, app: KeyApp):
+    def press(self, app: KeyApp) -> Optional[Command]:
         """Update the setting for the key. Then run the command for the key.
 
+        Changing the setting re-renders every key that uses it.
+
         Args:
             app (KeyApp): An instance of KeyApp.
 
+        Returns:
+            Optional[Command]: The command that was executed, to pass to
+                release
         """
         app.settings[self.setting] = self.value
-        super().press(app)
+        return super().press(app)
+
+    def settings_used(self) -> Iterable[str]:
+        return (self.setting,) + tuple(super().settings_used())
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}({self.setting}: {self.value})"
 
 
 class MacroKey(Key):
+    """A Key with a different command for each host OS."""
+
+    __slots__ = ("os_commands",)
+
     class BoundKey(Key.BoundKey):
+        """A MacroKey bound to an app, with the command for the host OS
+        resolved ahead of time."""
+
+        __slots__ = ("command", "_text", "_color")
+
+        def __init__(self, key: "MacroKey", app: KeyApp, key_number: int):
+            super().__init__(key, app, key_number)
+            self.resolve()
+
+        def resolve(self):
+            """Resolve the command, text and color for the host OS."""
+            key = self.key
+            self.command = key._get_command(self.app)
+            self._text = key.text(self.app)
+            self._color = key.color(self.app)
+
+        def text(self) -> str:
+            return self._text
+
+        def color(self) -> int:
+            return self._color
+
         def press(self):
             self.pixel = 0xFFFFFF
             self.app.macropad.pixels.show()
-            self.key.press(self.app)
+            self._pressed = self.key._execute(self.command, self.app)
 
         def release(self):
-            self.key.release(self.app)
-            self.pixel = self.color()
+            command = self._pressed or self.command
+            self._pressed = None
+            if command:
+                command.undo(self.app)
+            self.pixel = self._color
             self.app.macropad.pixels.show()
 
+        def repeat(self):
+            # The pixel stays lit while the key is held
+            command = self._pressed or self.command
+            if command:
+                command.undo(self.app)
+                command.execute(self.app)
+
     def __init__(
         self,
         text: str = "",
@@ -783,24 +1524,41 @@ class MacroKey(Key):
         linux_command=EMPTY_VALUE,
         mac_command=EMPTY_VALUE,
         windows_command=EMPTY_VALUE,
+        hold_command: Optional[Command] = None,
+        hold_time: Optional[float] = None,
+        repeat_rate: Union[None, bool, RepeatRate] = None,
     ):
-        super().__init__(text, color, command, double_tap_command)
+        super().__init__(
+            text,
+            color,
+            command,
+            double_tap_command,
+            hold_command,
+            hold_time,
+            repeat_rate,
+        )
 
-        self.os_commands: Dict[str, Optional[Command]] = {
-            os: com if (com is not EMPTY_VALUE) else self.command
-            for os, com in zip(
-                (OS_LINUX, OS_MAC, OS_WINDOWS),
-                (linux_command, mac_command, windows_command),
-            )
-        }
+        # A tuple in OS_ORDER takes less memory than a dict
+        self.os_commands: Tuple[Optional[Command], ...] = tuple(
+            com if (com is not EMPTY_VALUE) else self.command
+            for com in (linux_command, mac_command, windows_command)
+        )
+
+    def commands(self) -> Iterable[Command]:
+        return (self.double_tap_command, self.hold_command) + self.os_commands
+
+    def settings_used(self) -> Iterable[str]:
+        return (OS_SETTING,) + tuple(super().settings_used())
 
     @staticmethod
     def _get_os(app) -> str:
         return app.settings.host_os
 
     def _get_command(self, app) -> Optional[Command]:
-        os = self._get_os(app)
-        return self.os_commands[os]
+        index = OS_ORDER.get(self._get_os(app))
+        if index is None:
+            return self.command
+        return self.os_commands[index]
 
     def text(self, app) -> str:
         if self._get_command(app):
@@ -812,12 +1570,13 @@ class MacroKey(Key):
             return super().color(app)
         return 0
 
-    def press(self, app):
-        command = self._get_command(app)
-        if command:
-            command.execute(app)
+    def press(self, app) -> Optional[Command]:
+        return self._execute(self._get_command(app), app)
 
-    def release(self, app):
-        command = self._get_command(app)
+    def release(self, app, command: Optional[Command] = None):
+        command = command or self._get_command(app)
         if command:
             command.undo(app)
+
+    def repeat(self, app, command: Optional[Command] = None):
+        super().repeat(app, command or self._get_command(app))
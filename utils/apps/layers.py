@@ -0,0 +1,326 @@
+"""Defines a KeyApp with a QMK-style stack of key layers.
+
+A Layer defines keys and encoder commands like a KeyApp. Anything a layer
+leaves as TRANSPARENT falls through to the layers below it. Layers are
+activated with the MomentaryLayer, ToggleLayer and OneShotLayer commands.
+"""
+
+try:
+    from typing import Dict, Iterable, List, Optional, Tuple
+except ImportError:
+    pass
+
+from utils.app_pad import AppPad, KeyEvent, RepeatEvent
+from utils.apps.key import (
+    Key,
+    KeyApp,
+    KeyAppSettings,
+    KeyLayout,
+    compile_class_layout,
+    compile_layout,
+)
+from utils.commands import Command
+
+# Marks a key or encoder command which falls through to the layer below
+TRANSPARENT = object()
+
+
+class Layer:
+    """A set of keys and encoder commands which can be stacked in a
+    LayeredKeyApp.
+
+    To use this class, subclass Layer and specify values for the keys you
+    want the layer to define. Keys left as TRANSPARENT fall through to the
+    layer below. Set a key to None to disable it while the layer is active.
+
+    """
+
+    name = "Layer"
+
+    # First row
+    key_0 = TRANSPARENT
+    key_1 = TRANSPARENT
+    key_2 = TRANSPARENT
+
+    # Second row
+    key_3 = TRANSPARENT
+    key_4 = TRANSPARENT
+    key_5 = TRANSPARENT
+
+    # Third row
+    key_6 = TRANSPARENT
+    key_7 = TRANSPARENT
+    key_8 = TRANSPARENT
+
+    # Fourth row
+    key_9 = TRANSPARENT
+    key_10 = TRANSPARENT
+    key_11 = TRANSPARENT
+
+    encoder_button = TRANSPARENT
+
+    encoder_increase = TRANSPARENT
+    encoder_decrease = TRANSPARENT
+
+
+class LayeredKeyApp(KeyApp):
+    """A KeyApp whose keys are resolved from a stack of layers.
+
+    The stack holds, from the bottom up, the layers in base_layers, the keys
+    defined on the app itself, and any layers activated by commands. Keys and
+    encoder commands the app doesn't define fall through to base_layers.
+
+    Whenever the stack changes, the key for each slot is resolved once, so
+    looking up a key costs the same no matter how many layers are active. A
+    key keeps the binding it had when pressed until it is released.
+
+    """
+
+    # Layers below the keys defined on the app, from the bottom up
+    base_layers: Tuple[type, ...] = ()
+
+    def __init__(self, app_pad: AppPad, settings: Optional[KeyAppSettings] = None):
+        """Initialize the LayeredKeyApp.
+
+        Args:
+            app_pad (AppPad): An AppPad instance
+            settings (KeyAppSettings): A KeyAppSettings instance
+        """
+        self.layer_stack: List[type] = list(self.base_layers) + [self.__class__]
+        self._key_layers: List[Optional[type]] = []
+        self._bound_keys: Dict[Tuple[type, int], Key.BoundKey] = {}
+        self._pressed: Dict[int, Optional[Key.BoundKey]] = {}
+        self._one_shot: Dict[type, set] = {}
+
+        super().__init__(app_pad, settings)
+
+        for index, layer in enumerate(self._key_layers):
+            if layer is not None:
+                self._bound_keys[(layer, index)] = self.keys[index]
+                self.index_key(self.keys[index])
+
+    @classmethod
+    def layer_layout(cls, layer: type) -> KeyLayout:
+        """Return the compiled layout for a layer in the stack.
+
+        Keys and encoder commands left as None on the app itself are treated
+        as TRANSPARENT.
+
+        Args:
+            layer (type): A Layer subclass, or the app class
+
+        Returns:
+            KeyLayout: The compiled layout for the layer
+        """
+        layout = compile_class_layout(layer)
+        if layer is not cls:
+            return layout
+        return KeyLayout(
+            tuple(TRANSPARENT if key is None else key for key in layout.keys),
+            layout.double_tap_indices,
+            *(TRANSPARENT if command is None else command for command in layout[2:])
+        )
+
+    def get_layout(self) -> KeyLayout:
+        """Resolve the layer stack into a single layout.
+
+        Returns:
+            KeyLayout: The key and encoder bindings of the top-most layers
+        """
+        layouts = [self.layer_layout(layer) for layer in reversed(self.layer_stack)]
+
+        keys = []
+        self._key_layers = []
+        for index in range(12):
+            key, layer = None, None
+            for candidate, layout in zip(reversed(self.layer_stack), layouts):
+                if layout.keys[index] is not TRANSPARENT:
+                    key, layer = layout.keys[index], candidate
+                    break
+            keys.append(key)
+            self._key_layers.append(layer if key is not None else None)
+
+        encoders = []
+        for field in ("encoder_button", "encoder_increase", "encoder_decrease"):
+            command = None
+            for layout in layouts:
+                value = getattr(layout, field)
+                if value is not TRANSPARENT:
+                    command = value
+                    break
+            encoders.append(command)
+
+        return compile_layout(keys, *encoders)
+
+    def bound_keys(self) -> Iterable[Key.BoundKey]:
+        """Return every key bound to this app, including inactive layers.
+
+        Returns:
+            Iterable[Key.BoundKey]: The bound keys
+        """
+        return self._bound_keys.values()
+
+    def activate_layer(self, layer: type, one_shot: bool = False):
+        """Push a layer onto the top of the stack.
+
+        Args:
+            layer (type): The Layer subclass to activate
+            one_shot (bool, optional): If True, the layer is deactivated
+                after the next key press is released. Defaults to False.
+        """
+        if layer in self.layer_stack:
+            self.layer_stack.remove(layer)
+        self.layer_stack.append(layer)
+        if one_shot:
+            # Keys already held, like the one activating the layer, don't
+            # use up the one-shot layer
+            self._one_shot[layer] = set(self._pressed)
+        self.update_layers()
+
+    def deactivate_layer(self, layer: type):
+        """Remove a layer from the stack if it was activated.
+
+        Args:
+            layer (type): The Layer subclass to deactivate
+        """
+        if layer in self.layer_stack and layer not in self.base_layers:
+            if layer is not self.__class__:
+                self.layer_stack.remove(layer)
+                self._one_shot.pop(layer, None)
+                self.update_layers()
+
+    def toggle_layer(self, layer: type):
+        """Activate a layer if it is inactive, otherwise deactivate it.
+
+        Args:
+            layer (type): The Layer subclass to toggle
+        """
+        if layer in self.layer_stack:
+            self.deactivate_layer(layer)
+        else:
+            self.activate_layer(layer)
+
+    def update_layers(self):
+        """Resolve the layer stack and redisplay the keys."""
+        self.layout = self.get_layout()
+        self.double_tap_key_indices = self.layout.double_tap_indices
+
+        keys = []
+        for index, layer in enumerate(self._key_layers):
+            if layer is None:
+                keys.append(None)
+                continue
+            bound_key = self._bound_keys.get((layer, index))
+            if bound_key is None:
+                bound_key = self.layout.keys[index].bind(self, index)
+                self._bound_keys[(layer, index)] = bound_key
+                self.index_key(bound_key)
+            keys.append(bound_key)
+        self.keys = keys
+        self.compile_key_handlers()
+
+        self.compile_pipeline()
+        self.display_on_focus()
+        self.macropad.display.refresh()
+        self.pixels_on_focus()
+        self.macropad.pixels.show()
+
+    def display_on_focus(self):
+        """Set up the display, showing the name of the top activated layer."""
+        super().display_on_focus()
+        top = self.layer_stack[-1]
+        if top is not self.__class__:
+            self.display_group[13].text = top.name
+
+    def key_event(self, event: KeyEvent):
+        """Process a key event.
+
+        A release is sent to the key that was resolved when the key was
+        pressed, even if the layer stack changed in between.
+
+        Args:
+            event (KeyEvent): An event triggered by pressing a key
+        """
+        number = event.number
+        if event.pressed:
+            key = self[number]
+            self._pressed[number] = key
+            if key is not None:
+                key.press()
+            return
+
+        key = self._pressed.pop(number, self[number])
+        if key is not None:
+            key.release()
+
+        for layer, held in list(self._one_shot.items()):
+            if number in held:
+                held.discard(number)
+            else:
+                self.deactivate_layer(layer)
+
+    def repeat_event(self, event: RepeatEvent):
+        """Process a repeat event.
+
+        The repeat is sent to the key that was resolved when the key was
+        pressed, even if the layer stack changed in between.
+
+        Args:
+            event (RepeatEvent): An event triggered by holding down a key
+                which repeats
+        """
+        key = self._pressed.get(event.number)
+        if key is not None:
+            key.repeat()
+
+
+class MomentaryLayer(Command):
+    """Activate a layer while the key is held."""
+
+    __slots__ = ("layer",)
+
+    def __init__(self, layer: type):
+        """Initialize the MomentaryLayer command.
+
+        Args:
+            layer (type): The Layer subclass to activate
+        """
+        super().__init__()
+        self.layer = layer
+
+    def execute(self, app: LayeredKeyApp):
+        """Activate the layer."""
+        app.activate_layer(self.layer)
+
+    def undo(self, app: LayeredKeyApp):
+        """Deactivate the layer."""
+        app.deactivate_layer(self.layer)
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.layer.name)
+
+
+class ToggleLayer(MomentaryLayer):
+    """Toggle a layer on or off each time the key is pressed."""
+
+    __slots__ = ()
+
+    def execute(self, app: LayeredKeyApp):
+        """Toggle the layer."""
+        app.toggle_layer(self.layer)
+
+    def undo(self, app: LayeredKeyApp):
+        pass
+
+
+class OneShotLayer(MomentaryLayer):
+    """Activate a layer for the next key press only."""
+
+    __slots__ = ()
+
+    def execute(self, app: LayeredKeyApp):
+        """Activate the layer until the next key press is released."""
+        app.activate_layer(self.layer, one_shot=True)
+
+    def undo(self, app: LayeredKeyApp):
+        pass
@@ -0,0 +1,623 @@
+"""
+Defines KeyApps which are described by JSON layout files instead of Python
+modules.
+
+A layout file describes the name and color of the app, its keys and its
+encoder commands:
+
+    {
+        "name": "Chrome",
+        "color": "COLOR_CHROME",
+        "keys": [
+            {"text": "Back", "color": "COLOR_BACK", "command": ["Previous"]},
+            {"text": "New", "color": 3355443,
+             "command": ["Press", "CONTROL", "T"],
+             "mac": ["Press", "COMMAND", "T"]},
+            null
+        ],
+        "encoder_increase": ["Press", "CONTROL", "TAB"],
+        "encoder_decrease": ["Press", "CONTROL", "SHIFT", "TAB"]
+    }
+
+Keys are listed in key order and missing keys are None. A key with a "mac",
+"windows" or "linux" command is a MacroKey. A key may also have a
+"double_tap" command, and a "hold" command with an optional "hold_time" in
+seconds. "repeat" is true or false to choose whether the key repeats while
+held down, or a list of the delay, interval, acceleration and minimum
+interval it repeats at. Colors are ints, hex strings or color names.
+
+Commands are lists of a command name followed by its arguments. Keycodes,
+ConsumerControlCodes and mouse buttons are given by name:
+
+    ["Press", "CONTROL", "C"]           ["Release", "SHIFT"]
+    ["Wait", 0.1]                       ["Text", "Hello"]
+    ["Media", "PLAY_PAUSE"]             ["MouseClick", "LEFT_BUTTON"]
+    ["MouseMove", 10, 0]                ["Scroll", -1]
+    ["Tone", 440]                       ["PlayFile", "beep.wav"]
+    ["Sequence", [...], [...]]          ["Macro", [...], {"MAC": [...]}]
+    ["Previous"]                        ["Switch", "other_layout"]
+
+A Switch target is the name of another layout file in the same directory, or
+the dotted path of an app class, like "apps.home.HomeApp". Layouts which
+switch to a layout that doesn't exist are skipped when the directory is
+loaded. A module in a dotted path is only imported when the app is opened,
+and if that fails the error is reported and the current app stays open.
+
+Parsing a layout resolves every name to its value. The compiled layouts are
+cached in the directory as JSON, and a layout is only parsed again when its
+file changes. The app class for a layout is only built the first time the
+app is opened.
+"""
+
+import json
+import os
+
+try:
+    from typing import Any, Dict, List, Optional, Union
+except ImportError:
+    pass
+
+from utils import constants
+from utils.apps.base import LazyApp
+from utils.apps.key import Key, KeyApp, MacroKey
+from utils.commands import (
+    Command,
+    ConsumerControlCode,
+    Keycode,
+    MacroCommand,
+    Media,
+    Mouse,
+    MouseClick,
+    MouseMove,
+    PlayFile,
+    Press,
+    PreviousAppCommand,
+    Release,
+    Scroll,
+    Sequence,
+    SwitchAppCommand,
+    Text,
+    Tone,
+    Wait,
+)
+from utils.manifest import LOAD_ERRORS, get_entry
+from utils.pipeline import RepeatRate
+
+LAYOUT_CACHE_FILE = ".layout_cache.json"
+LAYOUT_CACHE_VERSION = 3
+
+# Libraries are reused across loads so every menu shares one LazyApp per layout
+_libraries: Dict[str, "LayoutLibrary"] = {}
+
+# The keys of a key description naming the command for each OS
+OS_COMMAND_KEYS = {
+    "linux": "linux_command",
+    "mac": "mac_command",
+    "windows": "windows_command",
+}
+
+
+class LayoutError(ValueError):
+    """Raised when a layout file can't be parsed."""
+
+
+def _resolve_name(namespace: Any, value: Union[int, str], kind: str) -> int:
+    if isinstance(value, int):
+        return value
+    resolved = getattr(namespace, str(value).upper(), None)
+    if not isinstance(resolved, int):
+        raise LayoutError("Unknown %s: %s" % (kind, value))
+    return resolved
+
+
+def _parse_color(value: Union[int, str, None]) -> Union[int, str]:
+    if value is None:
+        return 0
+    if isinstance(value, str) and value[:2].lower() == "0x":
+        return int(value, 16)
+    if isinstance(value, str):
+        return getattr(constants, value, value)
+    return value
+
+
+def _parse_hold_time(value: Optional[float]) -> Optional[float]:
+    if value is None:
+        return None
+    if not isinstance(value, (int, float)) or value <= 0:
+        raise LayoutError("Invalid hold_time: %r" % (value,))
+    return value
+
+
+def _parse_repeat(value: Union[bool, list, None]) -> Union[bool, list, None]:
+    if value is None or isinstance(value, bool):
+        return value
+    if (
+        not isinstance(value, list)
+        or len(value) != 4
+        or not all(isinstance(item, (int, float)) for item in value)
+    ):
+        raise LayoutError("Invalid repeat: %r" % (value,))
+    return value
+
+
+def compile_command(spec: Optional[list]) -> Optional[list]:
+    """Validate a command description and resolve the names in it.
+
+    Args:
+        spec (Optional[list]): A command name followed by its arguments,
+            or None
+
+    Raises:
+        LayoutError: If the command or one of its arguments is unknown
+
+    Returns:
+        Optional[list]: The command with every name resolved to its value
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        spec = [spec]
+    if not isinstance(spec, list) or not spec:
+        raise LayoutError("Invalid command: %s" % (spec,))
+
+    name, args = spec[0], spec[1:]
+    if name in ("Press", "Release"):
+        args = [_resolve_name(Keycode, arg, "keycode") for arg in args]
+    elif name == "Media":
+        args = [_resolve_name(ConsumerControlCode, args[0], "media code")]
+    elif name == "MouseClick":
+        args = [_resolve_name(Mouse, args[0], "mouse button")]
+    elif name == "Sequence":
+        args = [compile_command(arg) for arg in args]
+    elif name == "Macro":
+        overrides = args[1] if len(args) > 1 else {}
+        args = [
+            compile_command(args[0]),
+            {os_: compile_command(arg) for os_, arg in overrides.items()},
+        ]
+    elif name in ("Wait", "MouseMove", "Scroll", "Tone"):
+        if not all(isinstance(arg, (int, float)) for arg in args):
+            raise LayoutError("Invalid arguments: %s" % (spec,))
+    elif name in ("Text", "PlayFile", "Switch"):
+        if len(args) != 1 or not isinstance(args[0], str):
+            raise LayoutError("Invalid arguments: %s" % (spec,))
+    elif name != "Previous":
+        raise LayoutError("Unknown command: %s" % name)
+    return [name] + args
+
+
+def switch_targets(compiled: Optional[list]) -> List[str]:
+    """Return the targets of the Switch commands in a compiled command.
+
+    Args:
+        compiled (Optional[list]): A command compiled by compile_command
+
+    Returns:
+        List[str]: The target of each Switch command, in order
+    """
+    if compiled is None:
+        return []
+    name, args = compiled[0], compiled[1:]
+    if name == "Switch":
+        return [args[0]]
+    if name == "Sequence":
+        return [target for arg in args for target in switch_targets(arg)]
+    if name == "Macro":
+        targets = switch_targets(args[0])
+        for override in args[1].values():
+            targets.extend(switch_targets(override))
+        return targets
+    return []
+
+
+def layout_switch_targets(compiled: dict) -> List[str]:
+    """Return the targets of the Switch commands in a compiled layout.
+
+    Args:
+        compiled (dict): A layout compiled by compile_layout_file
+
+    Returns:
+        List[str]: The target of each Switch command
+    """
+    commands = list(compiled["encoders"])
+    for key in compiled["keys"]:
+        if key is not None:
+            commands.extend((key[2], key[3], key[5]))
+            if key[4]:
+                commands.extend(key[4].values())
+    return [target for command in commands for target in switch_targets(command)]
+
+
+def is_app_path(target: str) -> bool:
+    """Return True if a Switch target has the form of a dotted class path.
+
+    Args:
+        target (str): The target of a Switch command
+    """
+    parts = target.split(".")
+    return len(parts) > 1 and all(parts)
+
+
+def compile_layout_file(data: dict) -> dict:
+    """Validate a parsed layout file and resolve the names in it.
+
+    Args:
+        data (dict): The parsed JSON of a layout file
+
+    Raises:
+        LayoutError: If the layout is invalid
+
+    Returns:
+        dict: The compiled layout, in the form stored in the layout cache
+    """
+    keys = data.get("keys", [])
+    if len(keys) > 12:
+        raise LayoutError("A layout may have at most 12 keys")
+
+    compiled_keys = []
+    for key in keys:
+        if key is None:
+            compiled_keys.append(None)
+            continue
+        os_commands = {
+            argument: compile_command(key[name])
+            for name, argument in OS_COMMAND_KEYS.items()
+            if name in key
+        }
+        compiled_keys.append(
+            [
+                str(key.get("text", "")),
+                _parse_color(key.get("color")),
+                compile_command(key.get("command")),
+                compile_command(key.get("double_tap")),
+                os_commands or None,
+                compile_command(key.get("hold")),
+                _parse_hold_time(key.get("hold_time")),
+                _parse_repeat(key.get("repeat")),
+            ]
+        )
+    compiled_keys.extend([None] * (12 - len(compiled_keys)))
+
+    return {
+        "name": str(data.get("name", "Layout")),
+        "color": _parse_color(data.get("color")),
+        "keys": compiled_keys,
+        "encoders": [
+            compile_command(data.get(name))
+            for name in ("encoder_button", "encoder_increase", "encoder_decrease")
+        ],
+    }
+
+
+class LayoutEntry:
+    """A layout in a LayoutLibrary.
+
+    A LayoutEntry may be used as the factory for a LazyApp. Calling it builds
+    the KeyApp subclass for the layout, if needed, and constructs the app.
+
+    """
+
+    def __init__(self, library: "LayoutLibrary", layout_name: str, compiled: dict):
+        """Initialize the LayoutEntry.
+
+        Args:
+            library (LayoutLibrary): The library containing the layout
+            layout_name (str): The file name of the layout, without .json
+            compiled (dict): The compiled layout
+        """
+        self.library = library
+        self.layout_name = layout_name
+        self.name = compiled["name"]
+        self.color = compiled["color"]
+        self.__name__ = layout_name
+        self._compiled: Optional[dict] = compiled
+        self._app_class: Optional[type] = None
+        self._lazy_app: Optional[LazyApp] = None
+
+    @property
+    def lazy_app(self) -> LazyApp:
+        """Return the LazyApp shared by everything that opens this layout."""
+        if self._lazy_app is None:
+            self._lazy_app = LazyApp(self)
+        return self._lazy_app
+
+    def update(self, compiled: dict):
+        """Replace the layout with a newly compiled version.
+
+        Args:
+            compiled (dict): The compiled layout
+        """
+        self.name = compiled["name"]
+        self.color = compiled["color"]
+        self._compiled = compiled
+        self._app_class = None
+
+    def app_class(self) -> type:
+        """Return the KeyApp subclass for the layout, building it if needed.
+
+        Raises:
+            LayoutError: If the layout can't be built, such as when a layout
+                it switches to was removed since it was loaded
+
+        Returns:
+            type: The KeyApp subclass
+        """
+        if self._app_class is None:
+            print("Building layout %s" % self.layout_name)
+            try:
+                self._app_class = self.library.build_app_class(self._compiled)
+            except LOAD_ERRORS as err:
+                print("Error building layout %s" % self.layout_name)
+                print(err)
+                raise LayoutError(
+                    "Unable to build layout %s: %s" % (self.layout_name, err)
+                )
+            # The class holds everything needed from here on
+            self._compiled = None
+        return self._app_class
+
+    def __call__(self, app_pad: "AppPad", settings=None) -> KeyApp:
+        return self.app_class()(app_pad, settings)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.layout_name})"
+
+
+class LayoutLibrary:
+    """The layout files in a directory."""
+
+    def __init__(self, directory: str):
+        """Initialize the LayoutLibrary.
+
+        Args:
+            directory (str): The directory containing the layout files
+        """
+        self.directory = directory.rstrip("/")
+        self.path = self.directory + "/" + LAYOUT_CACHE_FILE
+        self._entries: Dict[str, LayoutEntry] = {}
+
+    def load(self) -> List[LayoutEntry]:
+        """Return the entries for the directory, updating the cache if needed.
+
+        Layouts that fail to parse, or that switch to a layout which doesn't
+        exist, are reported and skipped.
+
+        Returns:
+            List[LayoutEntry]: The layouts in the directory, sorted by name
+        """
+        cached = self._read()
+        files = {}
+        compiled_files = set()
+
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.startswith(".") or not filename.endswith(".json"):
+                continue
+
+            path = self.directory + "/" + filename
+            stat = os.stat(path)
+            signature = [stat[6], stat[8]]
+            record = cached.get(filename)
+            if record is None or record["stat"] != signature:
+                print("Compiling layout %s" % path)
+                try:
+                    with open(path, "r") as file_:
+                        compiled = compile_layout_file(json.load(file_))
+                except (
+                    AttributeError,
+                    IndexError,
+                    KeyError,
+                    TypeError,
+                    ValueError,
+                ) as err:
+                    print("Error loading layout %s" % path)
+                    print(err)
+                    continue
+                record = {"stat": signature, "layout": compiled}
+                compiled_files.add(filename)
+            files[filename] = record
+
+        if compiled_files or len(files) != len(cached):
+            self._write(files)
+
+        entries = []
+        for filename in self._check_switch_targets(files):
+            record = files[filename]
+            layout_name = filename[:-5]
+            entry = self._entries.get(layout_name)
+            if entry is None:
+                entry = LayoutEntry(self, layout_name, record["layout"])
+                self._entries[layout_name] = entry
+            elif filename in compiled_files:
+                entry.update(record["layout"])
+            entries.append(entry)
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+    def _check_switch_targets(self, files: Dict[str, dict]) -> List[str]:
+        """Return the layout files whose Switch targets can all be found.
+
+        A layout switching to a layout that was skipped is skipped too.
+
+        Args:
+            files (Dict[str, dict]): The cache records, by file name
+
+        Returns:
+            List[str]: The file names of the valid layouts
+        """
+        valid = {filename[:-5]: filename for filename in files}
+        checking = True
+        while checking:
+            checking = False
+            for layout_name, filename in list(valid.items()):
+                for target in layout_switch_targets(files[filename]["layout"]):
+                    if target not in valid and not is_app_path(target):
+                        print("Error loading layout %s" % filename)
+                        print("Unknown layout: %s" % target)
+                        del valid[layout_name]
+                        # Layouts switching to this one are now invalid too
+                        checking = True
+                        break
+        return [filename for filename in files if filename[:-5] in valid]
+
+    def build_app_class(self, compiled: dict) -> type:
+        """Build a KeyApp subclass from a compiled layout.
+
+        Args:
+            compiled (dict): The compiled layout
+
+        Returns:
+            type: The KeyApp subclass
+        """
+        attributes = {"name": compiled["name"], "color": compiled["color"]}
+        for index, key in enumerate(compiled["keys"]):
+            attributes["key_%s" % index] = self.build_key(key)
+        for name, command in zip(
+            ("encoder_button", "encoder_increase", "encoder_decrease"),
+            compiled["encoders"],
+        ):
+            attributes[name] = self.build_command(command)
+
+        class_name = "".join(
+            char for char in compiled["name"].title() if char.isalnum()
+        )
+        return type(class_name + "App", (KeyApp,), attributes)
+
+    def build_key(self, compiled: Optional[list]) -> Optional[Key]:
+        """Build a Key from a compiled key.
+
+        Args:
+            compiled (Optional[list]): The compiled key, or None
+
+        Returns:
+            Optional[Key]: The Key, or None
+        """
+        if compiled is None:
+            return None
+        (
+            text,
+            color,
+            command,
+            double_tap,
+            os_commands,
+            hold,
+            hold_time,
+            repeat,
+        ) = compiled
+        command = self.build_command(command)
+        double_tap = self.build_command(double_tap)
+        hold = self.build_command(hold)
+        if isinstance(repeat, list):
+            repeat = RepeatRate(*repeat)
+        if os_commands:
+            return MacroKey(
+                text,
+                color,
+                command,
+                double_tap,
+                hold_command=hold,
+                hold_time=hold_time,
+                repeat_rate=repeat,
+                **{
+                    argument: self.build_command(os_command)
+                    for argument, os_command in os_commands.items()
+                },
+            )
+        return Key(text, color, command, double_tap, hold, hold_time, repeat)
+
+    def build_command(self, compiled: Optional[list]) -> Optional[Command]:
+        """Build a Command from a compiled command.
+
+        Args:
+            compiled (Optional[list]): The compiled command, or None
+
+        Returns:
+            Optional[Command]: The Command, or None
+        """
+        if compiled is None:
+            return None
+
+        name, args = compiled[0], compiled[1:]
+        if name == "Sequence":
+            return Sequence(*(self.build_command(arg) for arg in args))
+        if name == "Macro":
+            return MacroCommand(
+                self.build_command(args[0]),
+                **{
+                    os_: self.build_command(override)
+                    for os_, override in args[1].items()
+                },
+            )
+        if name == "Previous":
+            return PreviousAppCommand()
+        if name == "Switch":
+            return SwitchAppCommand(self.switch_target(args[0]))
+        return _COMMANDS[name](*args)
+
+    def switch_target(self, target: str) -> LazyApp:
+        """Return the LazyApp for the target of a Switch command.
+
+        Args:
+            target (str): The name of a layout in this library, or the dotted
+                path of an app class
+
+        Raises:
+            LayoutError: If the target can't be found
+
+        Returns:
+            LazyApp: The app to switch to
+        """
+        if target in self._entries:
+            return self._entries[target].lazy_app
+        module, _, class_name = target.rpartition(".")
+        if not module:
+            raise LayoutError("Unknown layout: %s" % target)
+        return get_entry(module, class_name).lazy_app
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r") as file_:
+                cache = json.load(file_)
+        except (OSError, ValueError):
+            return {}
+        if cache.get("version") != LAYOUT_CACHE_VERSION:
+            return {}
+        return cache.get("files", {})
+
+    def _write(self, files: Dict[str, dict]):
+        try:
+            with open(self.path, "w") as file_:
+                json.dump({"version": LAYOUT_CACHE_VERSION, "files": files}, file_)
+        except OSError as err:
+            # The filesystem is read-only unless boot.py remounts it
+            print("Unable to cache layouts: %s" % err)
+
+
+def get_library(directory: str) -> LayoutLibrary:
+    """Return the shared LayoutLibrary for a directory.
+
+    Args:
+        directory (str): The directory containing the layout files
+
+    Returns:
+        LayoutLibrary: The library for the directory
+    """
+    library = _libraries.get(directory)
+    if library is None:
+        library = LayoutLibrary(directory)
+        _libraries[directory] = library
+    return library
+
+
+# The commands built directly from their resolved arguments
+_COMMANDS = {
+    "Press": Press,
+    "Release": Release,
+    "Wait": Wait,
+    "Text": Text,
+    "Media": Media,
+    "MouseClick": MouseClick,
+    "MouseMove": MouseMove,
+    "Scroll": Scroll,
+    "Tone": Tone,
+    "PlayFile": PlayFile,
+}
@@ -0,0 +1,74 @@
+"""Defines menu Apps whose keys switch to the apps listed in a directory."""
+
+try:
+    from typing import List
+except ImportError:
+    pass
+
+from utils.apps.base import BaseApp
+from utils.apps.key import Key, KeyApp, KeyLayout, compile_layout
+from utils.apps.layout_file import get_library
+from utils.commands import PreviousAppCommand, SwitchAppCommand
+
+
+class AppMenuApp(KeyApp):
+    """
+    An App with a key for each app registered in a directory.
+
+    The keys are built from the app manifest, so the app modules are only
+    imported when their key is pressed. Up to 12 apps are shown, sorted by
+    name. Pressing the encoder button switches back to the previous app.
+
+    To use this class, subclass AppMenuApp and set directory.
+
+    """
+
+    name = "Apps"
+
+    directory = "apps"
+
+    encoder_button = PreviousAppCommand()
+
+    def entries(self) -> List["ManifestEntry"]:
+        """Return the apps to show in the menu.
+
+        Returns:
+            List[ManifestEntry]: The apps registered in directory
+        """
+        return BaseApp.load_manifest(self.directory)
+
+    def get_layout(self) -> KeyLayout:
+        """Compile a layout with a key for each app in the manifest.
+
+        Returns:
+            KeyLayout: The key and encoder bindings for the menu
+        """
+        keys = [
+            Key(entry.name, entry.color, SwitchAppCommand(entry.lazy_app))
+            for entry in self.entries()[:12]
+        ]
+        keys.extend([None] * (12 - len(keys)))
+        return compile_layout(keys, self.encoder_button)
+
+
+class LayoutMenuApp(AppMenuApp):
+    """
+    An App with a key for each layout file in a directory.
+
+    The app for a layout is only built when its key is pressed.
+
+    To use this class, subclass LayoutMenuApp and set directory.
+
+    """
+
+    name = "Layouts"
+
+    directory = "layouts"
+
+    def entries(self) -> List["LayoutEntry"]:
+        """Return the layouts to show in the menu.
+
+        Returns:
+            List[LayoutEntry]: The layouts in directory
+        """
+        return get_library(self.directory).load()
@@ -9,13 +9,21 @@ is released.
 
 import time
 
+try:
+    from typing import Callable, Iterable, Optional, Tuple, Union
+except ImportError:
+    pass
+
 # Expose these libraries to those that use commands
 from adafruit_hid.consumer_control_code import ConsumerControlCode
 from adafruit_hid.keycode import Keycode  # REQUIRED if using Keycode.* values
 from adafruit_hid.mouse import Mouse
 
-from utils.apps.base import BaseApp
-from utils.constants import OS_SETTING, PREVIOUS_APP_SETTING
+from utils.apps.base import BaseApp, LazyApp
+from utils.constants import OS_SETTING
+from utils.interning import intern
+from utils.manifest import LOAD_ERRORS
+from utils.settings import BaseSettings
 
 
 class Command:
@@ -26,8 +34,27 @@ class Command:
     When a key is pressed, the execute method is called. When it is released,
     the undo method is called.
 
+    Set interned to True on commands which keep no state between execute and
+    undo, and which many apps build with the same arguments. Creating one with
+    the same arguments as an existing one then returns the existing command,
+    so apps share identical commands.
+
     """
 
+    __slots__ = ()
+
+    interned = False
+    # Whether equal calls share one instance, see utils.interning
+
+    repeats = False
+    # Whether a key bound to the command repeats it while held down, unless
+    # the Key sets repeat itself
+
+    def __new__(cls, *args, **kwargs):
+        if cls.interned:
+            return intern(cls, args, kwargs)
+        return object.__new__(cls)
+
     def execute(self, app: BaseApp):
         """Execute the command.
 
@@ -46,6 +73,29 @@ class Command:
         """
         pass
 
+    def resolve(self, app: BaseApp) -> Optional["Command"]:
+        """Return the command that execute would run for the current settings.
+
+        Keys keep the resolved command while they are held, so the release
+        undoes the command that was executed even if a setting changes.
+
+        Args:
+            app (BaseApp): The running app
+
+        Returns:
+            Optional[Command]: The command itself, unless it depends on a
+                setting
+        """
+        return self
+
+    def subcommands(self) -> Iterable["Command"]:
+        """Return the commands this command may run.
+
+        Returns:
+            Iterable[Command]: The nested commands, if any
+        """
+        return ()
+
     def __str__(self):
         return self.__class__.__name__ + "()"
 
@@ -53,6 +103,8 @@ class Command:
 class Sequence(Command):
     """Command that defines a sequence of subcommands."""
 
+    __slots__ = ("sequence",)
+
     def __init__(self, *sequence: Command):
         """Initialize the Sequence command.
 
@@ -72,6 +124,10 @@ class Sequence(Command):
         for command in self.sequence:
             command.undo(app)
 
+    def subcommands(self) -> Iterable[Command]:
+        """Return the commands in the sequence."""
+        return self.sequence
+
     def __str__(self):
         return "{0}({1})".format(
             self.__class__.__name__, ", ".join(str(com) for com in self.sequence)
@@ -81,6 +137,9 @@ class Sequence(Command):
 class Press(Command):
     """Press the given keycode. Release it to undo."""
 
+    __slots__ = ("keycodes",)
+    interned = True
+
     def __init__(self, *keycodes: int):
         """Initialize the Press command.
 
@@ -92,13 +151,11 @@ class Press(Command):
 
     def execute(self, app: BaseApp):
         """Send a keyboard press of the given keycodes."""
-        for keycode in self.keycodes:
-            app.macropad.keyboard.press(keycode)
+        app.app_pad.hid.press(*self.keycodes)
 
     def undo(self, app: BaseApp):
         """Send a keyboard release of the given keycodes."""
-        for keycode in reversed(self.keycodes):
-            app.macropad.keyboard.release(keycode)
+        app.app_pad.hid.release(*self.keycodes)
 
     def __str__(self):
         return "{0}({1})".format(
@@ -110,6 +167,8 @@ class Press(Command):
 class Release(Command):
     """Release the given keycode."""
 
+    __slots__ = ("keycodes",)
+
     def __init__(self, *keycodes: int):
         """Initialize the Release command.
 
@@ -121,8 +180,7 @@ class Release(Command):
 
     def execute(self, app: BaseApp):
         """Send a keyboard release of the given keycode."""
-        for keycode in self.keycodes:
-            app.macropad.keyboard.release(keycode)
+        app.app_pad.hid.release(*self.keycodes)
 
     def __str__(self):
         return "{0}({1})".format(
@@ -133,6 +191,8 @@ class Release(Command):
 class Wait(Command):
     """Wait for a specified time."""
 
+    __slots__ = ("time",)
+
     def __init__(self, time: float):
         """Initialize the Wait command.
 
@@ -153,6 +213,8 @@ class Wait(Command):
 class Text(Command):
     """Type the specified text with the keyboard."""
 
+    __slots__ = ("text",)
+
     def __init__(self, text: str):
         """Initialize the Text command
 
@@ -164,7 +226,7 @@ class Text(Command):
 
     def execute(self, app: BaseApp):
         """Type the specified text with the keyboard."""
-        app.macropad.keyboard_layout.write(self.text)
+        app.app_pad.hid.write(self.text)
 
     def __str__(self):
         return "{0}({1})".format(self.__class__.__name__, self.text)
@@ -173,6 +235,9 @@ class Text(Command):
 class Media(Command):
     """Send the specified Media Control key."""
 
+    __slots__ = ("command",)
+    interned = True
+
     def __init__(self, command: int):
         """Initialize the Media Command.
 
@@ -184,12 +249,11 @@ class Media(Command):
 
     def execute(self, app: BaseApp):
         """Send the specified ConsumerControlCode value."""
-        app.macropad.consumer_control.release()
-        app.macropad.consumer_control.press(self.command)
+        app.app_pad.hid.consumer_press(self.command)
 
     def undo(self, app: BaseApp):
         """Release the consumer control keys."""
-        app.macropad.consumer_control.release()
+        app.app_pad.hid.consumer_release()
 
     def __str__(self):
         return "{0}({1})".format(self.__class__.__name__, self.command)
@@ -198,6 +262,8 @@ class Media(Command):
 class MouseClick(Command):
     """Click the specified mouse button."""
 
+    __slots__ = ("button",)
+
     def __init__(self, button: int):
         """Initialize the MouseClick command.
 
@@ -209,11 +275,11 @@ class MouseClick(Command):
 
     def execute(self, app: BaseApp):
         """Click the specified button."""
-        app.macropad.mouse.press(self.button)
+        app.app_pad.hid.mouse_press(self.button)
 
     def undo(self, app: BaseApp):
         """Release the specified button."""
-        app.macropad.mouse.release(self.button)
+        app.app_pad.hid.mouse_release(self.button)
 
     def __str__(self):
         return "{0}({1})".format(self.__class__.__name__, self.button)
@@ -222,6 +288,9 @@ class MouseClick(Command):
 class MouseMove(Command):
     """Move the mouse the specified delta in the x and y directions."""
 
+    __slots__ = ("x", "y")
+    repeats = True
+
     def __init__(self, x: int = 0, y: int = 0):
         """Initialize the MouseMove command.
 
@@ -237,7 +306,7 @@ class MouseMove(Command):
 
     def execute(self, app: BaseApp):
         """Move the mouse by the specified amount."""
-        app.macropad.mouse.move(self.x, self.y)
+        app.app_pad.hid.mouse_move(self.x, self.y)
 
     def __str__(self):
         return "{0}(x={1}, y={2})".format(self.__class__.__name__, self.x, self.y)
@@ -246,6 +315,9 @@ class MouseMove(Command):
 class Scroll(Command):
     """Scroll with the mouse wheel by the specified amount."""
 
+    __slots__ = ("lines",)
+    repeats = True
+
     def __init__(self, lines: int):
         """Initialize the Scroll command.
 
@@ -257,7 +329,7 @@ class Scroll(Command):
 
     def execute(self, app: BaseApp):
         """Scroll by the specified amount."""
-        app.macropad.mouse.move(0, 0, self.lines)
+        app.app_pad.hid.mouse_move(0, 0, self.lines)
 
     def __str__(self):
         return "{0}({1})".format(self.__class__.__name__, self.lines)
@@ -266,6 +338,8 @@ class Scroll(Command):
 class Tone(Command):
     """Play the specified tone through the built-in speaker."""
 
+    __slots__ = ("tone",)
+
     def __init__(self, tone: int):
         """Initialize the Tone command.
 
@@ -277,12 +351,11 @@ class Tone(Command):
 
     def execute(self, app: BaseApp):
         """Play the specified tone, stopping previous tones."""
-        app.macropad.stop_tone()
-        app.macropad.start_tone(self.tone)
+        app.app_pad.hid.start_tone(self.tone)
 
     def undo(self, app: BaseApp):
         """Stop any playing tones."""
-        app.macropad.stop_tone()
+        app.app_pad.hid.stop_tone()
 
     def __str__(self):
         return "{0}({1})".format(self.__class__.__name__, self.tone)
@@ -291,6 +364,8 @@ class Tone(Command):
 class PlayFile(Command):
     """Play a file through the built-in speaker."""
 
+    __slots__ = ("file_",)
+
     def __init__(self, file_: str):
         """Initialize the PlayFile command.
 
@@ -317,46 +392,104 @@ class AppSwitchException(Exception):
 
 
 class SwitchAppCommand(Command):
-    """A command to switch to a new App."""
+    """A command to switch to a new App.
 
-    def __init__(self, app: BaseApp):
+    The target may be an App instance, a LazyApp, or a factory such as an App
+    class. Factories are wrapped in a LazyApp, so the App is only constructed
+    the first time the command runs.
+
+    """
+
+    __slots__ = ("lazy_app",)
+
+    def __init__(
+        self,
+        app: Union[BaseApp, LazyApp, Callable[..., BaseApp]],
+        settings: Optional[BaseSettings] = None,
+    ):
+        """Initialize the SwitchAppCommand.
+
+        Args:
+            app (Union[BaseApp, LazyApp, Callable[..., BaseApp]]): The App to
+                switch to, or a LazyApp or factory used to construct it.
+            settings (Optional[BaseSettings], optional): The settings used to
+                construct the App when a factory is passed. If None, the
+                settings of the App running the command are used.
+                Defaults to None.
+        """
         super().__init__()
-        self.app = app
+        if isinstance(app, BaseApp):
+            app = LazyApp.from_app(app)
+        elif not isinstance(app, LazyApp):
+            app = LazyApp(app, settings)
+        self.lazy_app = app
+
+    @property
+    def app(self) -> Optional[BaseApp]:
+        """Return the target App if it has been constructed."""
+        return self.lazy_app.app
 
     def execute(self, app: BaseApp):
         """Switch to the new app.
 
-        Add the current app to the stack stored in PREVIOUS_APP_SETTING.
+        Construct the new app if necessary, then record the switch in the
+        AppPad navigation history. If the new app can't be built, the error
+        is reported and the current app stays focused.
 
         Args:
             app (BaseApp): The current app
         """
         try:
-            app_stack = self.app.settings[PREVIOUS_APP_SETTING]
-        except KeyError:
-            app_stack = []
-            self.app.settings[PREVIOUS_APP_SETTING] = app_stack
-        app_stack.append(app)
-        raise AppSwitchException(self.app)
+            new_app = self.lazy_app.get(app.app_pad, app.settings)
+        except LOAD_ERRORS as err:
+            print("Unable to open %s: %s" % (self.lazy_app, err))
+            return
+        app.app_pad.history.switch(LazyApp.from_app(app), self.lazy_app)
+        raise AppSwitchException(new_app)
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.lazy_app)
 
 
 class PreviousAppCommand(Command):
     """A command to switch back to the previous app."""
 
+    __slots__ = ()
+    interned = True
+
     def execute(self, app: BaseApp):
-        """Switch back to the last App in the App stack.
+        """Switch back to the last App in the navigation history.
 
-        Pop the last App from the stack stored in PREVIOUS_APP_SETTING and
-        switch back to that app.
+        Pop the last App from the AppPad navigation history and switch back
+        to that app. The App is rebuilt if it was released from the app
+        cache. If the history is empty, nothing happens.
 
         Args:
             app (BaseApp): The current app
 
         """
-        app_stack = app.settings.get(PREVIOUS_APP_SETTING, [])
-        previous_app = app_stack.pop()
+        previous_app = app.app_pad.history.pop()
         if previous_app is not None:
-            raise AppSwitchException(previous_app)
+            raise AppSwitchException(previous_app.get(app.app_pad, app.settings))
+
+
+class LeaderCommand(Command):
+    """A command which starts a leader sequence in a KeyApp.
+
+    The next keys pressed are matched against the sequences of the app.
+
+    """
+
+    __slots__ = ()
+
+    def execute(self, app: BaseApp):
+        """Start matching a sequence from the next key press.
+
+        Args:
+            app (BaseApp): The current app, a KeyApp
+
+        """
+        app.start_leader()
 
 
 class SettingsDependentCommand(Command):
@@ -365,6 +498,8 @@ class SettingsDependentCommand(Command):
 
     """
 
+    __slots__ = ("setting", "default_command", "override_commands")
+
     def __init__(
         self, setting: str, default_command: Command, **override_commands: Command
     ):
@@ -382,12 +517,46 @@ class SettingsDependentCommand(Command):
         """
         self.setting = setting
         self.default_command = default_command
-        self.override_commands = override_commands
+        # A few (value, command) pairs take less memory than a dict
+        self.override_commands: Tuple[Tuple[str, Command], ...] = tuple(
+            override_commands.items()
+        )
+
+    def command(self, app: BaseApp) -> Optional[Command]:
+        """Return the command for the current value of the setting.
+
+        Args:
+            app (BaseApp): The current app
+
+        Returns:
+            Optional[Command]: The override command for the value of the
+                setting, or default_command
+        """
+        value = app.settings.get(self.setting, None)
+        for override_value, command in self.override_commands:
+            if override_value == value:
+                return command
+        return self.default_command
+
+    def resolve(self, app: BaseApp) -> Optional[Command]:
+        """Return the command for the current value of the setting, resolved
+        in turn if it depends on a setting too.
+
+        Args:
+            app (BaseApp): The current app
+
+        Returns:
+            Optional[Command]: The command that execute would run
+        """
+        command = self.command(app)
+        if command is None:
+            return None
+        return command.resolve(app)
 
     def execute(self, app: BaseApp):
         """Execute the Command.
 
-        If the specified setting has the value of one of the keys in
+        If the specified setting has the value of one of the overrides in
         self.override_commands, the corresponding command is run. Otherwise the
         default_command is run.
 
@@ -395,36 +564,34 @@ class SettingsDependentCommand(Command):
             app (BaseApp): The current app
 
         """
-        try:
-            setting = app.settings[self.setting]
-            command = self.override_commands[setting]
-        except Exception:
-            command = self.default_command
-
+        command = self.command(app)
         if command is not None:
             command.execute(app)
 
     def undo(self, app: BaseApp):
         """Undo the Command.
 
-        If the specified setting has the value of one of the keys in
-        self.override_commands, the corresponding command is run. Otherwise the
-        default_command is run.
+        The command for the current value of the setting is undone. To undo
+        the command that was executed after the setting changed, keep the
+        command returned by resolve and undo that instead.
 
         Args:
             app (BaseApp): The current app
 
         """
-        try:
-            setting = app.settings[self.setting]
-            command = self.override_commands[setting]
-        except Exception:
-            command = self.default_command
-
+        command = self.command(app)
         if command is not None:
             command.undo(app)
 
+    def subcommands(self) -> Iterable[Command]:
+        """Return the default command and the override commands."""
+        return (self.default_command,) + tuple(
+            command for _, command in self.override_commands
+        )
+
 
 class MacroCommand(SettingsDependentCommand):
+    __slots__ = ()
+
     def __init__(self, default_command: Command, **override_commands: Command):
         super().__init__(OS_SETTING, default_command, **override_commands)
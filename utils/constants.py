@@ -9,7 +9,8 @@ DISPLAY_HEIGHT = 64
 
 # Settings
 
-# The setting name for the previous app setting
+# The setting name for the previous app setting. The navigation history now
+# lives on the AppPad; this is kept for user modules that still set it.
 PREVIOUS_APP_SETTING = "previous_app"
 
 # The setting name and options for the OS setting
@@ -26,6 +27,15 @@ ONE_MINUTE = 60
 # Timer ID for the disabled pixels timer
 TIMER_DISABLE_PIXELS = "disable pixels timer"
 
+# Timer ID for the timer which saves changed settings
+TIMER_SAVE_SETTINGS = "save settings timer"
+
+# Timer ID for the timer which takes periodic memory snapshots
+TIMER_MEMORY_SNAPSHOT = "memory snapshot timer"
+
+# Timer ID for the timer which releases keys held down for too long
+TIMER_HID_WATCHDOG = "hid watchdog timer"
+
 # Defines color names for the color scheme for the Macropad. You can use these
 # color names to refer to colors defined in the default color scheme defined
 # in settings.py.
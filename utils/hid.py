@@ -0,0 +1,287 @@
+"""
+Defines a mirror of the keys, buttons and tone the macropad holds down.
+
+Every command sends its HID reports through the HidState on the AppPad, which
+remembers what it has pressed. Releases are only sent for what is actually
+down, so switching apps while nothing is held sends no reports at all.
+
+A key can stay pressed if a command is interrupted between its press and its
+release, for example when a Sequence switches apps part way through. Switching
+apps releases everything the mirror holds, and a watchdog timer releases
+anything held longer than STUCK_TIMEOUT in case no switch follows.
+
+Each press also records the macropad keys which were down when it was made,
+from AppPad.keys_down. A press is only stuck once none of those keys is still
+down, so a key bound to Press(SHIFT) stays pressed for as long as it is held.
+"""
+
+import time
+
+try:
+    from typing import Dict
+except ImportError:
+    pass
+
+from utils.constants import TIMER_HID_WATCHDOG
+
+
+class HidState:
+    """Sends HID reports and mirrors the state they leave the host in."""
+
+    STUCK_TIMEOUT = 30.0
+    # The time in seconds after which anything still held is released
+
+    def __init__(self, app_pad: "AppPad", stuck_timeout: float = STUCK_TIMEOUT):
+        """Initialize the HidState.
+
+        Args:
+            app_pad (AppPad): The AppPad whose macropad and timers are used
+            stuck_timeout (float, optional): Seconds after which held keys,
+                buttons and consumer controls are released. If 0, they are
+                only released when switching apps. Defaults to STUCK_TIMEOUT.
+        """
+        self.app_pad = app_pad
+        self.macropad = app_pad.macropad
+        self.stuck_timeout = stuck_timeout
+
+        # The time each pressed keycode was pressed, by keycode
+        self.keys: Dict[int, float] = {}
+        # The pressed consumer control code, or 0, and when it was pressed
+        self.consumer = 0
+        self._consumer_time = 0.0
+        # A bitmask of the pressed mouse buttons, and when the first was pressed
+        self.mouse_buttons = 0
+        self._mouse_time = 0.0
+        # The AppPad.keys_down of each press, by keycode, and of the consumer
+        # control code and mouse buttons
+        self._key_owners: Dict[int, int] = {}
+        self._consumer_owners = 0
+        self._mouse_owners = 0
+        self.tone = False
+
+        self.reports = 0
+        self.skipped = 0
+        self.recovered = 0
+
+    @property
+    def pressed(self) -> bool:
+        """Return True if any key, consumer control or mouse button is held."""
+        return bool(self.keys or self.consumer or self.mouse_buttons)
+
+    def press(self, *keycodes: int):
+        """Press keycodes in a single keyboard report.
+
+        Args:
+            keycodes (Tuple[int, ...]): The keycodes to press
+        """
+        if not keycodes:
+            return
+        was_pressed = self.pressed
+        now = time.monotonic()
+        owners = self.app_pad.keys_down
+        keys = self.keys
+        key_owners = self._key_owners
+        for keycode in keycodes:
+            keys[keycode] = now
+            key_owners[keycode] = owners
+        self.macropad.keyboard.press(*keycodes)
+        self.reports += 1
+        if not was_pressed:
+            self._arm_watchdog()
+
+    def release(self, *keycodes: int):
+        """Release the keycodes which are pressed, in a single report.
+
+        Args:
+            keycodes (Tuple[int, ...]): The keycodes to release
+        """
+        keys = self.keys
+        held = [keycode for keycode in keycodes if keycode in keys]
+        if not held:
+            self.skipped += 1
+            return
+        key_owners = self._key_owners
+        for keycode in held:
+            del keys[keycode]
+            del key_owners[keycode]
+        self.macropad.keyboard.release(*held)
+        self.reports += 1
+
+    def write(self, text: str):
+        """Type text with the keyboard layout.
+
+        Args:
+            text (str): The text to type
+        """
+        self.macropad.keyboard_layout.write(text)
+
+    def consumer_press(self, code: int):
+        """Press a consumer control code, releasing the one held before.
+
+        Args:
+            code (int): A ConsumerControlCode value
+        """
+        was_pressed = self.pressed
+        self.consumer_release()
+        self.macropad.consumer_control.press(code)
+        self.reports += 1
+        self.consumer = code
+        self._consumer_time = time.monotonic()
+        self._consumer_owners = self.app_pad.keys_down
+        if not was_pressed:
+            self._arm_watchdog()
+
+    def consumer_release(self):
+        """Release the consumer control code, if one is held."""
+        if not self.consumer:
+            self.skipped += 1
+            return
+        self.macropad.consumer_control.release()
+        self.reports += 1
+        self.consumer = 0
+
+    def mouse_press(self, buttons: int):
+        """Press mouse buttons.
+
+        Args:
+            buttons (int): A bitmask of Mouse button constants
+        """
+        was_pressed = self.pressed
+        self.macropad.mouse.press(buttons)
+        self.reports += 1
+        if not self.mouse_buttons:
+            self._mouse_time = time.monotonic()
+            self._mouse_owners = 0
+        self._mouse_owners |= self.app_pad.keys_down
+        self.mouse_buttons |= buttons
+        if not was_pressed:
+            self._arm_watchdog()
+
+    def mouse_release(self, buttons: int):
+        """Release the mouse buttons which are pressed.
+
+        Args:
+            buttons (int): A bitmask of Mouse button constants
+        """
+        held = self.mouse_buttons & buttons
+        if not held:
+            self.skipped += 1
+            return
+        self.macropad.mouse.release(held)
+        self.reports += 1
+        self.mouse_buttons &= ~held
+
+    def mouse_move(self, x: int = 0, y: int = 0, wheel: int = 0):
+        """Move the mouse and scroll the wheel.
+
+        Args:
+            x (int, optional): The distance to move right. Defaults to 0.
+            y (int, optional): The distance to move down. Defaults to 0.
+            wheel (int, optional): The lines to scroll. Defaults to 0.
+        """
+        self.macropad.mouse.move(x, y, wheel)
+        self.reports += 1
+
+    def start_tone(self, tone: int):
+        """Play a tone, stopping the one playing before.
+
+        Args:
+            tone (int): The frequency of the tone in Hz
+        """
+        self.stop_tone()
+        self.macropad.start_tone(tone)
+        self.tone = True
+
+    def stop_tone(self):
+        """Stop the tone, if one is playing."""
+        if self.tone:
+            self.macropad.stop_tone()
+            self.tone = False
+
+    def release_all(self) -> bool:
+        """Release everything held and stop the tone.
+
+        Only the devices with something held are sent a report.
+
+        Returns:
+            bool: True if anything was released
+        """
+        released = self.pressed
+        if self.keys:
+            self.keys.clear()
+            self._key_owners.clear()
+            self.macropad.keyboard.release_all()
+            self.reports += 1
+        if self.consumer:
+            self.consumer_release()
+        if self.mouse_buttons:
+            self.macropad.mouse.release_all()
+            self.reports += 1
+            self.mouse_buttons = 0
+        if not released:
+            self.skipped += 1
+        self.stop_tone()
+        self.app_pad.delete_timer(TIMER_HID_WATCHDOG)
+        return released
+
+    def report(self):
+        """Print the reports sent and avoided, and the stuck keys recovered."""
+        print(
+            "HID: {0} reports, {1} skipped, {2} stuck releases".format(
+                self.reports, self.skipped, self.recovered
+            )
+        )
+
+    def _arm_watchdog(self, delay: float = 0.0):
+        if self.stuck_timeout:
+            self.app_pad.add_timer(
+                TIMER_HID_WATCHDOG,
+                delay or self.stuck_timeout,
+                self._release_stuck,
+                quiet=True,
+            )
+
+    def _release_stuck(self):
+        # Release whatever has been held past the timeout, then wait for the
+        # next oldest press to reach it. A press whose macropad keys are
+        # still down is held on purpose, so its timeout starts again instead
+        now = time.monotonic()
+        stuck_before = now - self.stuck_timeout
+        down = self.app_pad.keys_down
+
+        keys = self.keys
+        key_owners = self._key_owners
+        stuck = []
+        for keycode in list(keys):
+            if key_owners[keycode] & down:
+                keys[keycode] = now
+            elif keys[keycode] <= stuck_before:
+                stuck.append(keycode)
+        if stuck:
+            print("HID: releasing stuck keys %s" % (stuck,))
+            self.release(*stuck)
+            self.recovered += 1
+
+        if self.consumer:
+            if self._consumer_owners & down:
+                self._consumer_time = now
+            elif self._consumer_time <= stuck_before:
+                print("HID: releasing stuck consumer control %s" % self.consumer)
+                self.consumer_release()
+                self.recovered += 1
+
+        if self.mouse_buttons:
+            if self._mouse_owners & down:
+                self._mouse_time = now
+            elif self._mouse_time <= stuck_before:
+                print("HID: releasing stuck mouse buttons %s" % self.mouse_buttons)
+                self.mouse_release(self.mouse_buttons)
+                self.recovered += 1
+
+        if self.pressed:
+            oldest = min(keys.values()) if keys else now
+            if self.consumer:
+                oldest = min(oldest, self._consumer_time)
+            if self.mouse_buttons:
+                oldest = min(oldest, self._mouse_time)
+            self._arm_watchdog(max(oldest - stuck_before, 0.01))
@@ -0,0 +1,134 @@
+"""
+Shares identical Command and Key objects between apps.
+
+Many apps build the same objects, such as PreviousAppCommand(), Press(ENTER)
+or Media(ConsumerControlCode.MUTE). Classes with interned = True create their
+instances through intern, which returns the existing instance when the class
+is called again with equal arguments. Only classes whose instances never
+change after __init__ should be interned, since every user of the arguments
+gets the same object.
+
+Each interned instance costs an entry in the cache, so only the classes
+which are often built with the same arguments are interned. Run
+benchmarks.interning after adding apps to check which classes still fold.
+
+Calls with unhashable arguments, such as a dict, always create a new
+instance. The cache is only needed while apps are being imported, so code.py
+clears it once the apps are imported, which also ends interning. Objects that
+were folded stay shared, and later calls create plain instances without
+growing the cache again.
+"""
+
+from collections import namedtuple
+
+try:
+    from typing import Any, Dict, Iterator, Tuple
+except ImportError:
+    pass
+
+# Interning statistics for a class: the number of distinct instances created,
+# and the number of calls that returned an existing instance instead
+InternStats = namedtuple("InternStats", ("unique", "folded"))
+
+# Set to False to create a new instance for every call
+enabled = True
+
+# Interned instances for each class, keyed by arguments
+_instances: Dict[type, Dict[tuple, Any]] = {}
+
+# Marks a key which includes keyword arguments
+_KEYWORDS = object()
+
+# The number of instances created, by class
+_unique: Dict[type, int] = {}
+
+# The number of calls that returned an existing instance, by class
+_folded: Dict[type, int] = {}
+
+
+def intern(cls: type, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+    """Return the instance of cls for the arguments, creating it if needed.
+
+    Call this from __new__. The returned instance is passed to __init__ as
+    usual, which sets the same attributes again.
+
+    Args:
+        cls (type): The class being instantiated
+        args (Tuple): The positional arguments
+        kwargs (Dict[str, Any]): The keyword arguments
+
+    Returns:
+        Any: The interned instance, or a new one if the arguments aren't
+            hashable
+    """
+    if not enabled:
+        return object.__new__(cls)
+
+    instances = _instances.get(cls)
+    if instances is None:
+        instances = _instances[cls] = {}
+
+    key = (_KEYWORDS, args, tuple(sorted(kwargs.items()))) if kwargs else args
+    try:
+        instance = instances.get(key)
+    except TypeError:
+        return object.__new__(cls)
+
+    if instance is None:
+        instance = object.__new__(cls)
+        instances[key] = instance
+        _unique[cls] = _unique.get(cls, 0) + 1
+    else:
+        _folded[cls] = _folded.get(cls, 0) + 1
+    return instance
+
+
+def stats() -> Dict[type, InternStats]:
+    """Return the interning statistics for each class.
+
+    Returns:
+        Dict[type, InternStats]: The statistics, by class
+    """
+    return {
+        cls: InternStats(count, _folded.get(cls, 0)) for cls, count in _unique.items()
+    }
+
+
+def interned_calls(cls: type) -> Iterator[Tuple[Tuple, Dict[str, Any]]]:
+    """Yield the arguments of each interned instance of a class.
+
+    Args:
+        cls (type): An interned class
+
+    Yields:
+        Tuple[Tuple, Dict[str, Any]]: The positional and keyword arguments
+    """
+    for key in _instances.get(cls, ()):
+        if key and key[0] is _KEYWORDS:
+            yield key[1], dict(key[2])
+        else:
+            yield key, {}
+
+
+def report():
+    """Print the number of instances and folded duplicates for each class."""
+    total_unique = total_folded = 0
+    print("{0:<24} {1:>8} {2:>8}".format("Class", "Unique", "Folded"))
+    for cls, (unique, folded) in sorted(
+        stats().items(), key=lambda item: item[0].__name__
+    ):
+        print("{0:<24} {1:>8} {2:>8}".format(cls.__name__, unique, folded))
+        total_unique += unique
+        total_folded += folded
+    print("{0:<24} {1:>8} {2:>8}".format("Total", total_unique, total_folded))
+
+
+def clear():
+    """Forget the interned instances and stop interning, keeping the statistics.
+
+    Objects that are still referenced stay shared. Later calls create a new
+    instance each time, so the cache doesn't grow again.
+    """
+    global enabled
+    _instances.clear()
+    enabled = False
@@ -0,0 +1,481 @@
+"""
+Defines a compact bytecode for macros and an interpreter that runs it.
+
+A Sequence of Press, Release, Wait, Text, Media and mouse commands is an
+object graph that stays in RAM. compile_command turns such a tree into two
+small byte strings: one run when the key is pressed and one run when it is
+released. A MacroProgram runs them as a Command.
+
+Programs can also be saved to a macro bank file with save_bank. A MacroBank
+only keeps the index of the file in RAM, and its FlashMacro commands read
+their bytecode from flash each time they run.
+
+Each instruction is an opcode byte followed by its operands. Counts and
+keycodes are bytes, and other numbers are 16 bit little-endian values:
+unsigned for delays and media codes, signed for mouse moves and scrolling.
+
+    PRESS n k1..kn          Press n keycodes
+    RELEASE n k1..kn        Release n keycodes
+    CHORD n k1..kn          Press n keycodes, then release them
+    DELAY ms                Wait ms milliseconds, up to 65535
+    TEXT n b1..bn           Type n bytes of UTF-8 text
+    MEDIA code              Press a ConsumerControlCode
+    MEDIA_RELEASE           Release the consumer control keys
+    MOUSE_MOVE x y          Move the mouse by signed x and y
+    MOUSE_PRESS button      Press mouse buttons
+    MOUSE_RELEASE button    Release mouse buttons
+    SCROLL lines            Scroll the mouse wheel by signed lines
+    END                     Stop
+"""
+
+import time
+
+try:
+    from typing import Dict, Iterable, List, Tuple
+except ImportError:
+    pass
+
+from utils.commands import (
+    Command,
+    Media,
+    MouseClick,
+    MouseMove,
+    Press,
+    Release,
+    Scroll,
+    Sequence,
+    Text,
+    Wait,
+)
+
+END = 0
+PRESS = 1
+RELEASE = 2
+CHORD = 3
+DELAY = 4
+TEXT = 5
+MEDIA = 6
+MEDIA_RELEASE = 7
+MOUSE_MOVE = 8
+MOUSE_PRESS = 9
+MOUSE_RELEASE = 10
+SCROLL = 11
+
+# A program that does nothing
+EMPTY_PROGRAM = bytes((END,))
+
+BANK_MAGIC = b"MVM1"
+
+
+class MacroCompileError(ValueError):
+    """Raised when a Command can't be compiled to bytecode."""
+
+
+def _uint16(value: int) -> bytes:
+    value = int(value)
+    if not 0 <= value <= 0xFFFF:
+        raise MacroCompileError("Value out of range 0..65535: %s" % value)
+    return bytes((value & 0xFF, value >> 8))
+
+
+def _int16(value: int) -> bytes:
+    value = int(value)
+    if not -0x8000 <= value <= 0x7FFF:
+        raise MacroCompileError("Value out of range -32768..32767: %s" % value)
+    return bytes((value & 0xFF, (value >> 8) & 0xFF))
+
+
+def _read_uint16(code, index: int) -> int:
+    return code[index] | (code[index + 1] << 8)
+
+
+def _read_int16(code, index: int) -> int:
+    value = code[index] | (code[index + 1] << 8)
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def _keys(opcode: int, keycodes: Iterable[int]) -> bytes:
+    keycodes = bytes(keycodes)
+    return bytes((opcode, len(keycodes))) + keycodes
+
+
+class Assembler:
+    """Builds the bytecode of a program one instruction at a time."""
+
+    def __init__(self):
+        self.code = bytearray()
+
+    def press(self, *keycodes: int) -> "Assembler":
+        self.code += _keys(PRESS, keycodes)
+        return self
+
+    def release(self, *keycodes: int) -> "Assembler":
+        self.code += _keys(RELEASE, keycodes)
+        return self
+
+    def chord(self, *keycodes: int) -> "Assembler":
+        self.code += _keys(CHORD, keycodes)
+        return self
+
+    def delay(self, seconds: float) -> "Assembler":
+        milliseconds = int(seconds * 1000)
+        while milliseconds > 0:
+            step = min(milliseconds, 0xFFFF)
+            self.code += bytes((DELAY,)) + _uint16(step)
+            milliseconds -= step
+        return self
+
+    def text(self, text: str) -> "Assembler":
+        encoded = text.encode("utf-8")
+        for start in range(0, len(encoded), 255):
+            chunk = encoded[start : start + 255]
+            self.code += bytes((TEXT, len(chunk))) + chunk
+        return self
+
+    def media(self, code: int) -> "Assembler":
+        self.code += bytes((MEDIA,)) + _uint16(code)
+        return self
+
+    def media_release(self) -> "Assembler":
+        self.code.append(MEDIA_RELEASE)
+        return self
+
+    def mouse_move(self, x: int, y: int) -> "Assembler":
+        self.code += bytes((MOUSE_MOVE,)) + _int16(x) + _int16(y)
+        return self
+
+    def mouse_press(self, button: int) -> "Assembler":
+        self.code += bytes((MOUSE_PRESS, button))
+        return self
+
+    def mouse_release(self, button: int) -> "Assembler":
+        self.code += bytes((MOUSE_RELEASE, button))
+        return self
+
+    def scroll(self, lines: int) -> "Assembler":
+        self.code += bytes((SCROLL,)) + _int16(lines)
+        return self
+
+    def build(self) -> bytes:
+        """Return the bytecode, terminated with END."""
+        return bytes(self.code) + bytes((END,))
+
+
+def _compile(command: Command, execute: Assembler, undo: List[Tuple]):
+    """Add command to the execute program and collect its undo steps.
+
+    Undo steps are collected in order and assembled once the whole tree has
+    been compiled, matching the order Sequence.undo runs them in.
+    """
+    if isinstance(command, Sequence):
+        for subcommand in command.sequence:
+            _compile(subcommand, execute, undo)
+    elif isinstance(command, Press):
+        execute.press(*command.keycodes)
+        undo.append(("release", tuple(reversed(command.keycodes))))
+    elif isinstance(command, Release):
+        execute.release(*command.keycodes)
+    elif isinstance(command, Wait):
+        execute.delay(command.time)
+    elif isinstance(command, Text):
+        execute.text(command.text)
+    elif isinstance(command, Media):
+        execute.media_release().media(command.command)
+        undo.append(("media_release", ()))
+    elif isinstance(command, MouseClick):
+        execute.mouse_press(command.button)
+        undo.append(("mouse_release", (command.button,)))
+    elif isinstance(command, MouseMove):
+        execute.mouse_move(command.x, command.y)
+    elif isinstance(command, Scroll):
+        execute.scroll(command.lines)
+    elif isinstance(command, MacroProgram):
+        raise MacroCompileError("%s is already compiled" % command)
+    else:
+        raise MacroCompileError("Can't compile %s" % command)
+
+
+def compile_command(command: Command) -> "MacroProgram":
+    """Compile a tree of basic commands into a MacroProgram.
+
+    Sequence, Press, Release, Wait, Text, Media, MouseClick, MouseMove and
+    Scroll commands can be compiled. A Press immediately followed by a
+    Release of the same keycodes in reverse order is compiled into a single
+    CHORD.
+
+    Args:
+        command (Command): The command to compile
+
+    Raises:
+        MacroCompileError: If the tree contains any other command
+
+    Returns:
+        MacroProgram: The compiled command
+    """
+    execute = Assembler()
+    undo_steps: List[Tuple] = []
+    _compile(command, execute, undo_steps)
+
+    undo = Assembler()
+    for step, args in undo_steps:
+        getattr(undo, step)(*args)
+
+    return MacroProgram(_fold_chords(execute.build()), undo.build())
+
+
+def _fold_chords(code: bytes) -> bytes:
+    """Replace a PRESS followed by a RELEASE of its keys with a CHORD."""
+    folded = bytearray()
+    index = 0
+    while code[index] != END:
+        length = instruction_length(code, index)
+        instruction = code[index : index + length]
+        following = code[index + length : index + 2 * length]
+        if (
+            code[index] == PRESS
+            and len(following) == length
+            and following[:2] == bytes((RELEASE, instruction[1]))
+            and following[2:] == bytes(reversed(instruction[2:]))
+        ):
+            folded += bytes((CHORD,)) + instruction[1:]
+            index += 2 * length
+            continue
+        folded += instruction
+        index += length
+    folded.append(END)
+    return bytes(folded)
+
+
+def instruction_length(code, index: int) -> int:
+    """Return the length in bytes of the instruction at index.
+
+    Args:
+        code (bytes): The bytecode
+        index (int): The index of an opcode
+
+    Returns:
+        int: The length of the instruction, including the opcode
+    """
+    opcode = code[index]
+    if opcode in (PRESS, RELEASE, CHORD, TEXT):
+        return 2 + code[index + 1]
+    if opcode in (DELAY, MEDIA, SCROLL):
+        return 3
+    if opcode == MOUSE_MOVE:
+        return 5
+    if opcode in (MOUSE_PRESS, MOUSE_RELEASE):
+        return 2
+    return 1
+
+
+def run(code, app: "BaseApp"):
+    """Run bytecode on the macropad of an app.
+
+    Args:
+        code (bytes): The bytecode to run
+        app (BaseApp): The running app
+    """
+    hid = app.app_pad.hid
+    index = 0
+    while True:
+        opcode = code[index]
+        if opcode == PRESS:
+            count = code[index + 1]
+            hid.press(*code[index + 2 : index + 2 + count])
+            index += 2 + count
+        elif opcode == RELEASE:
+            count = code[index + 1]
+            hid.release(*code[index + 2 : index + 2 + count])
+            index += 2 + count
+        elif opcode == CHORD:
+            count = code[index + 1]
+            keycodes = code[index + 2 : index + 2 + count]
+            hid.press(*keycodes)
+            hid.release(*keycodes)
+            index += 2 + count
+        elif opcode == END:
+            return
+        elif opcode == DELAY:
+            time.sleep(_read_uint16(code, index + 1) / 1000)
+            index += 3
+        elif opcode == TEXT:
+            count = code[index + 1]
+            text = bytes(code[index + 2 : index + 2 + count]).decode("utf-8")
+            hid.write(text)
+            index += 2 + count
+        elif opcode == MEDIA:
+            hid.consumer_press(_read_uint16(code, index + 1))
+            index += 3
+        elif opcode == MEDIA_RELEASE:
+            hid.consumer_release()
+            index += 1
+        elif opcode == MOUSE_MOVE:
+            hid.mouse_move(_read_int16(code, index + 1), _read_int16(code, index + 3))
+            index += 5
+        elif opcode == MOUSE_PRESS:
+            hid.mouse_press(code[index + 1])
+            index += 2
+        elif opcode == MOUSE_RELEASE:
+            hid.mouse_release(code[index + 1])
+            index += 2
+        elif opcode == SCROLL:
+            hid.mouse_move(0, 0, _read_int16(code, index + 1))
+            index += 3
+        else:
+            raise ValueError("Invalid opcode %s at %s" % (opcode, index))
+
+
+class MacroProgram(Command):
+    """A Command that runs compiled bytecode."""
+
+    __slots__ = ("execute_code", "undo_code", "label")
+
+    def __init__(
+        self, execute_code: bytes, undo_code: bytes = EMPTY_PROGRAM, label: str = ""
+    ):
+        """Initialize the MacroProgram.
+
+        Args:
+            execute_code (bytes): The bytecode to run when the key is pressed
+            undo_code (bytes, optional): The bytecode to run when the key is
+                released. Defaults to an empty program.
+            label (str, optional): A description used by __str__.
+                Defaults to "".
+        """
+        super().__init__()
+        self.execute_code = execute_code
+        self.undo_code = undo_code
+        self.label = label
+
+    def execute(self, app: "BaseApp"):
+        """Run the execute program."""
+        run(self.execute_code, app)
+
+    def undo(self, app: "BaseApp"):
+        """Run the undo program."""
+        run(self.undo_code, app)
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.label)
+
+
+def save_bank(path: str, programs: Dict[str, MacroProgram]):
+    """Write programs to a macro bank file.
+
+    The file holds BANK_MAGIC, the number of programs, an index of the name
+    and the offset and length of both programs of each macro, then the
+    bytecode. Offsets are 16 bit, so a bank holds up to 64 KB.
+
+    Args:
+        path (str): The path of the file to write
+        programs (Dict[str, MacroProgram]): The programs, by name
+    """
+    index = bytearray(BANK_MAGIC) + _uint16(len(programs))
+    entries = []
+    for name, program in programs.items():
+        encoded = name.encode("utf-8")
+        entries.append((encoded, program.execute_code, program.undo_code))
+        index += bytes((len(encoded),)) + encoded + bytes(8)
+
+    offset = len(index)
+    code = bytearray()
+    position = len(BANK_MAGIC) + 2
+    for encoded, execute_code, undo_code in entries:
+        position += 1 + len(encoded)
+        for program in (execute_code, undo_code):
+            index[position : position + 4] = _uint16(offset + len(code)) + _uint16(
+                len(program)
+            )
+            code += program
+            position += 4
+
+    with open(path, "wb") as file_:
+        file_.write(index)
+        file_.write(code)
+
+
+class MacroBank:
+    """A macro bank file whose programs stay on flash until they run."""
+
+    def __init__(self, path: str):
+        """Read the index of a macro bank file.
+
+        Args:
+            path (str): The path of the file written by save_bank
+
+        Raises:
+            ValueError: If the file isn't a macro bank
+        """
+        self.path = path
+        self.index: Dict[str, Tuple[int, int, int, int]] = {}
+        with open(path, "rb") as file_:
+            header = file_.read(len(BANK_MAGIC) + 2)
+            if header[: len(BANK_MAGIC)] != BANK_MAGIC:
+                raise ValueError("%s is not a macro bank" % path)
+            for _ in range(_read_uint16(header, len(BANK_MAGIC))):
+                name = file_.read(file_.read(1)[0]).decode("utf-8")
+                offsets = file_.read(8)
+                self.index[name] = tuple(
+                    _read_uint16(offsets, start) for start in (0, 2, 4, 6)
+                )
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def command(self, name: str) -> "FlashMacro":
+        """Return a Command that runs the named macro from flash.
+
+        Args:
+            name (str): The name of the macro
+
+        Returns:
+            FlashMacro: The command
+        """
+        if name not in self.index:
+            raise KeyError(name)
+        return FlashMacro(self, name)
+
+    def read(self, name: str, undo: bool = False) -> bytes:
+        """Read the bytecode of a macro.
+
+        Args:
+            name (str): The name of the macro
+            undo (bool, optional): Read the undo program instead of the
+                execute program. Defaults to False.
+
+        Returns:
+            bytes: The bytecode
+        """
+        offsets = self.index[name]
+        offset, length = offsets[2:] if undo else offsets[:2]
+        with open(self.path, "rb") as file_:
+            file_.seek(offset)
+            return file_.read(length)
+
+
+class FlashMacro(Command):
+    """A Command that reads its bytecode from a MacroBank each time it runs."""
+
+    __slots__ = ("bank", "name")
+
+    def __init__(self, bank: MacroBank, name: str):
+        """Initialize the FlashMacro.
+
+        Args:
+            bank (MacroBank): The bank containing the macro
+            name (str): The name of the macro
+        """
+        super().__init__()
+        self.bank = bank
+        self.name = name
+
+    def execute(self, app: "BaseApp"):
+        """Read and run the execute program."""
+        run(self.bank.read(self.name), app)
+
+    def undo(self, app: "BaseApp"):
+        """Read and run the undo program."""
+        run(self.bank.read(self.name, undo=True), app)
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.name)
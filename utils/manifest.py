@@ -0,0 +1,261 @@
+"""
+Defines an app manifest which indexes the apps in a directory without
+importing them.
+
+The manifest lists the module, class name, app name and color of every app
+registered with BaseApp.register_app. It is built by reading the source of
+each .py file, cached as JSON in the directory, and only rebuilt for files
+whose size or modification time changed. A module is imported the first time
+its app is constructed.
+"""
+
+import json
+import os
+
+try:
+    from typing import Dict, List, Tuple, Union
+except ImportError:
+    pass
+
+from utils import constants
+
+MANIFEST_FILE = ".app_manifest.json"
+MANIFEST_VERSION = 1
+
+# Entries are reused across loads so every menu shares one LazyApp per app
+_entries: Dict[Tuple[str, str], "ManifestEntry"] = {}
+
+# The errors raised while building an app from a module or layout file with a
+# mistake in it. Anything that builds apps on demand catches these, so a bad
+# file can't stop the macropad.
+LOAD_ERRORS = (
+    SyntaxError,
+    ImportError,
+    AttributeError,
+    KeyError,
+    NameError,
+    IndexError,
+    TypeError,
+    ValueError,
+)
+
+
+class ManifestEntry:
+    """An app listed in the manifest.
+
+    A ManifestEntry may be used as the factory for a LazyApp. Calling it
+    imports the module and constructs the app.
+
+    """
+
+    def __init__(
+        self, module: str, class_name: str, name: str, color: Union[int, str] = 0
+    ):
+        """Initialize the ManifestEntry.
+
+        Args:
+            module (str): The dotted path of the module defining the app
+            class_name (str): The name of the app class
+            name (str): The name of the app
+            color (int | str, optional): The color of the app. Defaults to 0.
+        """
+        self.module = module
+        self.class_name = class_name
+        self.name = name
+        self.color = color
+        self.__name__ = class_name
+        self._lazy_app = None
+
+    @property
+    def lazy_app(self) -> "LazyApp":
+        """Return the LazyApp shared by everything that opens this app."""
+        if self._lazy_app is None:
+            # Imported here since utils.apps.base imports this module
+            from utils.apps.base import LazyApp
+
+            self._lazy_app = LazyApp(self)
+        return self._lazy_app
+
+    def load(self) -> type:
+        """Import the module and return the app class.
+
+        Returns:
+            type: The app class
+        """
+        print("Importing %s" % self.module)
+        try:
+            module = __import__(self.module, None, None, [self.class_name])
+            return getattr(module, self.class_name)
+        except LOAD_ERRORS as err:
+            print("Error loading %s" % self.module)
+            print(err)
+            raise err
+
+    def __call__(self, app_pad: "AppPad", settings=None) -> "BaseApp":
+        return self.load()(app_pad, settings)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.module}.{self.class_name})"
+
+
+def get_entry(
+    module: str, class_name: str, name: str = None, color: Union[int, str] = 0
+) -> ManifestEntry:
+    """Return the shared ManifestEntry for an app class.
+
+    Args:
+        module (str): The dotted path of the module defining the app
+        class_name (str): The name of the app class
+        name (str, optional): The name of the app. Defaults to the class
+            name, or the name of an existing entry.
+        color (int | str, optional): The color of the app. Defaults to 0.
+
+    Returns:
+        ManifestEntry: The entry for the app
+    """
+    entry = _entries.get((module, class_name))
+    if entry is None:
+        entry = ManifestEntry(module, class_name, name or class_name, color)
+        _entries[(module, class_name)] = entry
+    elif name is not None:
+        entry.name = name
+        entry.color = color
+    return entry
+
+
+def _parse_value(text: str) -> Union[int, str]:
+    """Parse the literal or constant name assigned to a class attribute."""
+    text = text.split("#", 1)[0].strip()
+    if text[:1] in ("'", '"'):
+        return text[1:-1]
+    try:
+        return int(text, 0)
+    except ValueError:
+        return getattr(constants, text, text)
+
+
+def scan_source(path: str) -> List[Tuple[str, str, Union[int, str]]]:
+    """Find the registered apps defined in a source file without importing it.
+
+    Only classes decorated with register_app are listed. Their name and color
+    are read from simple class attribute assignments.
+
+    The source is read line by line rather than parsed, so some apps aren't
+    found:
+
+    - Classes registered by calling BaseApp.register_app(SomeApp) instead of
+      decorating them
+    - Classes which aren't at the top level of the module, for example inside
+      an if block
+
+    A name or color which isn't a literal or a name from utils.constants,
+    such as one inherited from a base class or built from an expression, is
+    not read. The class name and a color of 0 are used instead for an
+    inherited one, and the text of an expression is used as it is.
+
+    Args:
+        path (str): The path of the .py file
+
+    Returns:
+        List[Tuple[str, str, Union[int, str]]]: The class name, app name
+            and color of each app
+    """
+    apps = []
+    registered = False
+    current = None
+    with open(path, "r") as file_:
+        for line in file_:
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+
+            if not line[0].isspace():
+                current = None
+                if stripped.startswith("@"):
+                    registered = registered or "register_app" in stripped
+                    continue
+                if stripped.startswith("class ") and registered:
+                    class_name = stripped[6:].split("(")[0].split(":")[0].strip()
+                    current = [class_name, class_name, 0]
+                    apps.append(current)
+                registered = False
+                continue
+
+            if current is None or line[4:5].isspace():
+                continue
+
+            prefix, _, value = stripped.partition("=")
+            attribute = prefix.split(":")[0].strip()
+            if attribute == "name" and value:
+                current[1] = _parse_value(value)
+            elif attribute == "color" and value:
+                current[2] = _parse_value(value)
+
+    return [tuple(app) for app in apps]
+
+
+class AppManifest:
+    """The index of the apps defined in a directory."""
+
+    def __init__(self, directory: str):
+        """Initialize the AppManifest.
+
+        Args:
+            directory (str): The directory containing the app modules
+        """
+        self.directory = directory.rstrip("/")
+        self.path = self.directory + "/" + MANIFEST_FILE
+        self.package = self.directory.strip("/").replace("/", ".")
+
+    def load(self) -> List[ManifestEntry]:
+        """Return the entries for the directory, updating the cache if needed.
+
+        Returns:
+            List[ManifestEntry]: The apps in the directory, sorted by name
+        """
+        cached = self._read()
+        files = {}
+        changed = False
+
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.startswith(".") or not filename.endswith(".py"):
+                continue
+
+            path = self.directory + "/" + filename
+            stat = os.stat(path)
+            signature = [stat[6], stat[8]]
+            record = cached.get(filename)
+            if record is None or record["stat"] != signature:
+                print("Indexing %s" % path)
+                record = {"stat": signature, "apps": scan_source(path)}
+                changed = True
+            files[filename] = record
+
+        if changed or len(files) != len(cached):
+            self._write(files)
+
+        entries = []
+        for filename, record in files.items():
+            module = self.package + "." + filename[:-3]
+            for class_name, name, color in record["apps"]:
+                entries.append(get_entry(module, class_name, name, color))
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r") as file_:
+                manifest = json.load(file_)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("files", {})
+
+    def _write(self, files: Dict[str, dict]):
+        try:
+            with open(self.path, "w") as file_:
+                json.dump({"version": MANIFEST_VERSION, "files": files}, file_)
+        except OSError as err:
+            # The filesystem is read-only unless boot.py remounts it
+            print("Unable to cache app manifest: %s" % err)
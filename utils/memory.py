@@ -0,0 +1,351 @@
+"""
+Defines a monitor which tracks memory use across app switches.
+
+After a collection, a snapshot of gc.mem_free() and gc.mem_alloc() is taken
+periodically through an AppPad timer, and the AppPad's report is printed. The
+growth in allocated memory since the previous snapshot is attributed to the
+app focused when the snapshot is taken.
+
+Snapshots can also be taken each time an app is focused. Each collection
+pauses the app switch, so this is off unless focus_snapshots is set. The
+growth is then attributed to the app that was focused in between, including
+any apps it constructed, and the memory allocated on focus is compared with
+the last time the app was focused. Cycling through the same apps should come
+back to the same baseline once they are all cached. If the baseline grows on
+LEAK_CYCLES visits in a row without the app cache growing, a leak is
+suspected and reported on the serial console.
+"""
+
+import gc
+import time
+from collections import namedtuple
+
+try:
+    from typing import Callable, Dict, List, Optional, Tuple
+except ImportError:
+    pass
+
+from utils.constants import TIMER_MEMORY_SNAPSHOT
+
+# The memory in use at a point in time. reason is "focus" or "timer", and app
+# is the name of the focused app. timers and cached are the number of AppPad
+# timers and cached apps, which both hold memory.
+MemorySnapshot = namedtuple(
+    "MemorySnapshot",
+    ("time", "free", "allocated", "app", "reason", "timers", "cached"),
+)
+
+
+def read_memory() -> Tuple[int, int]:
+    """Collect garbage, then return the free and allocated memory in bytes.
+
+    Both are 0 if they can't be determined.
+    """
+    gc.collect()
+    try:
+        return gc.mem_free(), gc.mem_alloc()
+    except AttributeError:
+        return 0, 0
+
+
+class AppMemoryStats:
+    """The memory accounting for one app."""
+
+    def __init__(self):
+        self.visits = 0
+        # The net bytes allocated while the app was focused
+        self.allocated = 0
+        # The highest allocated memory seen while the app was focused
+        self.peak = 0
+        # The allocated memory and app cache size when the app was last focused
+        self.baseline: Optional[int] = None
+        self.baseline_cached = 0
+        # The number of visits in a row on which the baseline grew
+        self.growth_streak = 0
+        self.growth = 0
+        self.leak_suspected = False
+
+    def __repr__(self) -> str:
+        return "AppMemoryStats(visits={0}, allocated={1}, peak={2}, leak={3})".format(
+            self.visits, self.allocated, self.peak, self.leak_suspected
+        )
+
+
+class MemoryMonitor:
+    """Snapshots memory use and attributes it to the focused app."""
+
+    HISTORY_SIZE = 16
+    # The number of recent snapshots to keep
+
+    LEAK_CYCLES = 4
+    # The number of visits in a row with a growing baseline that suggests a leak
+
+    LEAK_MIN_GROWTH = 512
+    # The total growth in bytes over those visits that suggests a leak
+
+    def __init__(
+        self,
+        app_pad: "AppPad",
+        interval: float = 60.0,
+        read: Callable[[], Tuple[int, int]] = read_memory,
+        focus_snapshots: bool = False,
+    ):
+        """Initialize the MemoryMonitor.
+
+        Args:
+            app_pad (AppPad): The AppPad whose timers and report are used
+            interval (float, optional): Seconds between periodic snapshots.
+                If 0, there are no periodic snapshots. Defaults to 60.0.
+            read (Callable[[], Tuple[int, int]], optional): Returns the free
+                and allocated memory in bytes. Defaults to read_memory.
+            focus_snapshots (bool, optional): Also take a snapshot and check
+                for leaks each time an app is focused. Defaults to False.
+        """
+        self.app_pad = app_pad
+        self.interval = interval
+        self.read = read
+        self.focus_snapshots = focus_snapshots
+
+        self.snapshots: List[MemorySnapshot] = []
+        self.snapshot_count = 0
+        self.leak_count = 0
+        self._stats: Dict[str, AppMemoryStats] = {}
+        self._current: Optional[str] = None
+        self._timer_set = False
+
+    @property
+    def last(self) -> Optional[MemorySnapshot]:
+        """Return the most recent snapshot, or None before the first."""
+        return self.snapshots[-1] if self.snapshots else None
+
+    def stats(self) -> Dict[str, AppMemoryStats]:
+        """Return the memory accounting for each app, by app name."""
+        return self._stats
+
+    def app_stats(self, name: str) -> AppMemoryStats:
+        """Return the memory accounting for an app, creating it if needed.
+
+        Args:
+            name (str): The name of the app
+        """
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = AppMemoryStats()
+        return stats
+
+    def snapshot(self, reason: str) -> MemorySnapshot:
+        """Take a snapshot and attribute the growth to the focused app.
+
+        Args:
+            reason (str): Why the snapshot was taken
+
+        Returns:
+            MemorySnapshot: The new snapshot
+        """
+        free, allocated = self.read()
+        snapshot = MemorySnapshot(
+            time.monotonic(),
+            free,
+            allocated,
+            self._current,
+            reason,
+            self.app_pad.timer_count,
+            len(self.app_pad.app_cache),
+        )
+
+        previous = self.last
+        if previous is not None and self._current is not None:
+            stats = self.app_stats(self._current)
+            stats.allocated += allocated - previous.allocated
+            stats.peak = max(stats.peak, allocated)
+
+        self.snapshots.append(snapshot)
+        if len(self.snapshots) > self.HISTORY_SIZE:
+            self.snapshots.pop(0)
+        self.snapshot_count += 1
+        return snapshot
+
+    def focus(self, app: "BaseApp"):
+        """Record that app was focused.
+
+        With focus_snapshots, a snapshot is taken. The growth since the
+        previous snapshot is attributed to the app that was focused before,
+        and the new baseline is checked for a leak.
+
+        Args:
+            app (BaseApp): The app being focused
+        """
+        stats = self.app_stats(app.name)
+        stats.visits += 1
+
+        if self.focus_snapshots:
+            previous = self._current
+            snapshot = self.snapshot("focus")
+            stats.peak = max(stats.peak, snapshot.allocated)
+            self._check_baseline(app.name, stats, snapshot)
+            print(
+                "Memory: {0} free, {1} allocated, {2} timers, {3:+d} for {4}".format(
+                    snapshot.free,
+                    snapshot.allocated,
+                    snapshot.timers,
+                    self._delta(),
+                    previous,
+                )
+            )
+        self._current = app.name
+
+        if self.interval and not self._timer_set:
+            self._timer_set = True
+            self.app_pad.add_timer(
+                TIMER_MEMORY_SNAPSHOT, self.interval, self._periodic_snapshot
+            )
+
+    def report(self):
+        """Print the memory accounting for each app."""
+        print(
+            "{0:<20} {1:>6} {2:>10} {3:>10}  {4}".format(
+                "App", "Visits", "Allocated", "Peak", "Leak"
+            )
+        )
+        for name, stats in sorted(self._stats.items()):
+            print(
+                "{0:<20} {1:>6} {2:>10} {3:>10}  {4}".format(
+                    name,
+                    stats.visits,
+                    stats.allocated,
+                    stats.peak,
+                    "suspected" if stats.leak_suspected else "",
+                )
+            )
+
+    def _delta(self) -> int:
+        if len(self.snapshots) < 2:
+            return 0
+        return self.snapshots[-1].allocated - self.snapshots[-2].allocated
+
+    def _check_baseline(self, name: str, stats: AppMemoryStats, snapshot):
+        baseline = stats.baseline
+        stats.baseline = snapshot.allocated
+        cached = stats.baseline_cached
+        stats.baseline_cached = snapshot.cached
+        if baseline is None:
+            return
+
+        # Constructing another app raises the baseline legitimately
+        if snapshot.allocated > baseline and snapshot.cached <= cached:
+            stats.growth_streak += 1
+            stats.growth += snapshot.allocated - baseline
+        else:
+            stats.growth_streak = 0
+            stats.growth = 0
+
+        if (
+            stats.growth_streak >= self.LEAK_CYCLES
+            and stats.growth >= self.LEAK_MIN_GROWTH
+            and not stats.leak_suspected
+        ):
+            stats.leak_suspected = True
+            self.leak_count += 1
+            print(
+                "Memory: possible leak, {0} grew {1} bytes over {2} visits".format(
+                    name, stats.growth, stats.growth_streak
+                )
+            )
+
+    def _periodic_snapshot(self):
+        snapshot = self.snapshot("timer")
+        print(
+            "Memory: {0} free, {1} allocated, {2} timers".format(
+                snapshot.free, snapshot.allocated, snapshot.timers
+            )
+        )
+        self.app_pad.report()
+        self.app_pad.add_timer(
+            TIMER_MEMORY_SNAPSHOT, self.interval, self._periodic_snapshot
+        )
+
+
+class IdleCollector:
+    """Collects garbage while the macropad is idle.
+
+    CircuitPython collects garbage when an allocation fails, which can pause
+    a macro between a press and a release. Collecting at the end of an idle
+    window, once the other idle tasks are done, makes that less likely. The
+    collection is skipped while plenty of memory is free, and put off while
+    a timer is due before it would finish.
+
+    """
+
+    IDLE_TASK_ID = "_COLLECT_GARBAGE"
+    # The ID of the idle task that collects garbage
+
+    def __init__(self, app_pad: "AppPad", min_free_memory: int = 0):
+        """Initialize the IdleCollector and register its idle task.
+
+        Args:
+            app_pad (AppPad): The AppPad whose idle time is used
+            min_free_memory (int, optional): Only collect while fewer than
+                this many bytes are free. If 0, collect in every idle window.
+                Defaults to 0.
+        """
+        self.app_pad = app_pad
+        self.min_free_memory = min_free_memory
+
+        self.collections = 0
+        self.skipped = 0
+        self.total_pause_ns = 0
+        self.max_pause_ns = 0
+        self.last_pause_ns = 0
+        self.freed = 0
+
+        app_pad.add_idle_task(self.IDLE_TASK_ID, self.collect)
+
+    def collect(self) -> bool:
+        """Collect garbage if it is needed and nothing else is due.
+
+        Returns:
+            bool: True to try again later in the idle window
+        """
+        app_pad = self.app_pad
+        if app_pad.idle_tasks_pending:
+            # Let the other idle tasks finish allocating first
+            return True
+
+        due = app_pad.time_to_next_timer()
+        if due is not None and due * 1000000000 < self.last_pause_ns:
+            return True
+
+        try:
+            free = gc.mem_free()
+        except AttributeError:
+            free = None
+        if free is not None and free >= self.min_free_memory > 0:
+            self.skipped += 1
+            return False
+
+        start = time.monotonic_ns()
+        gc.collect()
+        pause = time.monotonic_ns() - start
+
+        self.collections += 1
+        self.total_pause_ns += pause
+        self.max_pause_ns = max(self.max_pause_ns, pause)
+        self.last_pause_ns = pause
+        if free is not None:
+            self.freed += gc.mem_free() - free
+        return False
+
+    def report(self):
+        """Print the collections and the pauses they kept out of input."""
+        average = self.total_pause_ns // self.collections if self.collections else 0
+        print(
+            "Idle GC: {0} collections, {1} skipped, {2:.1f} ms average, "
+            "{3:.1f} ms max, {4:.1f} ms total, {5} bytes freed".format(
+                self.collections,
+                self.skipped,
+                average / 1000000,
+                self.max_pause_ns / 1000000,
+                self.total_pause_ns / 1000000,
+                self.freed,
+            )
+        )
@@ -0,0 +1,316 @@
+"""
+Defines the navigation history used to switch back to previous apps, an LRU
+cache which limits how many constructed apps are kept alive, and a prefetcher
+which builds the apps you are likely to open next while the macropad is idle.
+
+All of these work with LazyApp references rather than App instances, so an
+App that has been evicted from the cache can be rebuilt when it is revisited.
+"""
+
+import gc
+
+try:
+    from typing import Dict, List, Optional
+except ImportError:
+    pass
+
+from utils.manifest import LOAD_ERRORS
+
+
+def mem_free() -> Optional[int]:
+    """Return the free memory in bytes, or None if it can't be determined."""
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return None
+
+
+class AppCache:
+    """
+    A least-recently-used cache of constructed apps.
+
+    Whenever an App is used, its LazyApp is touched, moving it to the end of
+    the cache. When the cache holds more than max_size apps, or free memory
+    drops below min_free_memory, the least recently used apps are released so
+    the garbage collector can reclaim them. Apps which can't be rebuilt are
+    tracked but never released.
+
+    """
+
+    def __init__(self, max_size: int = 6, min_free_memory: int = 0):
+        """Initialize the AppCache.
+
+        Args:
+            max_size (int, optional): The number of apps to keep constructed.
+                Defaults to 6.
+            min_free_memory (int, optional): Release apps while free memory
+                is below this many bytes. Defaults to 0.
+        """
+        self.max_size = max_size
+        self.min_free_memory = min_free_memory
+        self._entries: List["LazyApp"] = []
+
+    def __contains__(self, lazy_app: "LazyApp") -> bool:
+        return lazy_app in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def touch(self, lazy_app: "LazyApp"):
+        """Mark lazy_app as the most recently used app.
+
+        Then release cold apps if the cache is over its limits.
+
+        Args:
+            lazy_app (LazyApp): The LazyApp that was used
+        """
+        entries = self._entries
+        if entries and entries[-1] is lazy_app:
+            return
+
+        if lazy_app in entries:
+            entries.remove(lazy_app)
+        entries.append(lazy_app)
+        self.trim()
+
+    def add_cold(self, lazy_app: "LazyApp"):
+        """Track lazy_app as the least recently used app.
+
+        Used for apps that were constructed ahead of time, so they are the
+        first to be released if they are never used.
+
+        Args:
+            lazy_app (LazyApp): The LazyApp that was constructed
+        """
+        if lazy_app not in self._entries:
+            self._entries.insert(0, lazy_app)
+            self.trim()
+
+    def has_room(self, min_free_memory: int = 0) -> bool:
+        """Return True if another app fits without releasing any others.
+
+        Args:
+            min_free_memory (int, optional): Free memory in bytes required in
+                addition to the cache limits. Defaults to 0.
+        """
+        if len(self._entries) >= self.max_size:
+            return False
+        free = mem_free()
+        if free is None:
+            return True
+        return free >= max(min_free_memory, self.min_free_memory)
+
+    def trim(self):
+        """Release the least recently used apps until within the limits.
+
+        The most recently used app is never released.
+        """
+        released = False
+        while self._over_limit():
+            lazy_app = self._coldest()
+            if lazy_app is None:
+                break
+            self.evict(lazy_app)
+            released = True
+            gc.collect()
+
+        if released:
+            print("App cache: %s apps constructed" % len(self._entries))
+
+    def evict(self, lazy_app: "LazyApp"):
+        """Release the App held by lazy_app and stop tracking it.
+
+        Args:
+            lazy_app (LazyApp): The LazyApp to release
+        """
+        print("App cache: releasing %s" % lazy_app)
+        self._entries.remove(lazy_app)
+        lazy_app.release()
+
+    def _over_limit(self) -> bool:
+        if len(self._entries) > self.max_size:
+            return True
+        if self.min_free_memory:
+            free = mem_free()
+            return free is not None and free < self.min_free_memory
+        return False
+
+    def _coldest(self) -> Optional["LazyApp"]:
+        for lazy_app in self._entries[:-1]:
+            if lazy_app.rebuildable:
+                return lazy_app
+        return None
+
+
+class NavigationHistory:
+    """
+    A bounded stack of the apps that were switched away from.
+
+    Switching to an app pushes the current app onto the stack, and switching
+    back pops it. If the target app is already in the history, the history is
+    cut back to it instead, so bouncing between apps doesn't grow the stack.
+    Once the stack holds max_depth apps, the oldest entry is dropped.
+
+    Every switch is also counted, so the history can report which apps are
+    usually opened from a given app.
+
+    """
+
+    def __init__(self, max_depth: int = 10):
+        """Initialize the NavigationHistory.
+
+        Args:
+            max_depth (int, optional): The maximum number of apps to
+                remember. Defaults to 10.
+        """
+        self.max_depth = max_depth
+        self._stack: List["LazyApp"] = []
+        self._transitions: Dict["LazyApp", Dict["LazyApp", int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._stack)
+
+    def __iter__(self):
+        return iter(self._stack)
+
+    def switch(self, current: "LazyApp", target: "LazyApp"):
+        """Record switching from the current app to the target app.
+
+        Args:
+            current (LazyApp): The app being switched away from
+            target (LazyApp): The app being switched to
+        """
+        counts = self._transitions.setdefault(current, {})
+        counts[target] = counts.get(target, 0) + 1
+
+        stack = self._stack
+        if target in stack:
+            del stack[stack.index(target) :]
+            return
+
+        stack.append(current)
+        if len(stack) > self.max_depth:
+            del stack[: len(stack) - self.max_depth]
+
+    def pop(self) -> Optional["LazyApp"]:
+        """Remove and return the most recent app, or None if empty."""
+        if self._stack:
+            return self._stack.pop()
+        return None
+
+    def clear(self):
+        """Forget every app in the history."""
+        self._stack = []
+
+    def transition_counts(self, current: "LazyApp") -> Dict["LazyApp", int]:
+        """Return how often each app was opened from the current app.
+
+        Args:
+            current (LazyApp): The app to return the counts for
+
+        Returns:
+            Dict[LazyApp, int]: A mapping of target apps to switch counts
+        """
+        return self._transitions.get(current, {})
+
+
+class Prefetcher:
+    """
+    Constructs and prepares the apps the focused app can switch to while the
+    macropad is idle.
+
+    Candidates are ranked by how often the navigation history has seen them
+    opened from the focused app, then by the order of their keys. At most
+    max_apps are built per focus, and only while the app cache has room, so
+    prefetching never forces another app out of the cache.
+
+    """
+
+    IDLE_TASK_ID = "_PREFETCH_APPS"
+    # The ID of the idle task that builds the apps
+
+    def __init__(self, app_pad: "AppPad", max_apps: int = 2, min_free_memory=0):
+        """Initialize the Prefetcher.
+
+        Args:
+            app_pad (AppPad): The AppPad whose idle time, history and cache
+                are used
+            max_apps (int, optional): The maximum number of apps to build for
+                each focused app. Defaults to 2.
+            min_free_memory (int, optional): Only prefetch while at least this
+                many bytes are free. Defaults to 0.
+        """
+        self.app_pad = app_pad
+        self.max_apps = max_apps
+        self.min_free_memory = min_free_memory
+        self._app: Optional["BaseApp"] = None
+        self._candidates: Optional[List["LazyApp"]] = None
+        self._built = 0
+
+    def schedule(self, app: "BaseApp"):
+        """Prefetch the likely targets of app during the next idle window.
+
+        Args:
+            app (BaseApp): The app that was focused
+        """
+        self._app = app
+        self._candidates = None
+        self._built = 0
+        if self.max_apps:
+            self.app_pad.add_idle_task(self.IDLE_TASK_ID, self.prefetch_next)
+
+    def rank(self, app: "BaseApp") -> List["LazyApp"]:
+        """Return the switch targets of app, most likely first.
+
+        Args:
+            app (BaseApp): The focused app
+
+        Returns:
+            List[LazyApp]: The apps app can switch to
+        """
+        counts = self.app_pad.history.transition_counts(app.lazy_app)
+        ranked = [
+            (-counts.get(target, 0), index, target)
+            for index, target in enumerate(app.switch_targets())
+        ]
+        ranked.sort(key=lambda item: item[:2])
+        return [item[2] for item in ranked]
+
+    def prefetch_next(self) -> bool:
+        """Build the next candidate app.
+
+        Does one step of work each call so input stays responsive.
+
+        Returns:
+            bool: True if there is more work to do
+        """
+        app = self._app
+        if app is None:
+            return False
+
+        if self._candidates is None:
+            self._candidates = self.rank(app)
+            return True
+
+        while self._candidates and self._candidates[0].loaded:
+            self._candidates.pop(0)
+
+        if (
+            not self._candidates
+            or self._built >= self.max_apps
+            or not self.app_pad.app_cache.has_room(self.min_free_memory)
+        ):
+            self._app = None
+            self._candidates = None
+            return False
+
+        lazy_app = self._candidates.pop(0)
+        print("Prefetching %s" % lazy_app)
+        try:
+            lazy_app.prefetch(self.app_pad, app.settings)
+        except LOAD_ERRORS as err:
+            # Leave the error to be shown if the app is opened
+            print("Unable to prefetch %s: %s" % (lazy_app, err))
+            return True
+        self._built += 1
+        return True
@@ -0,0 +1,352 @@
+"""
+Defines a store which saves settings across reboots.
+
+Settings listed in persistent_settings are serialized into a small binary
+record and written to non-volatile memory. Records are written to a ring of
+fixed-size slots, each one after the last, so the writes are spread across
+the region instead of wearing out one spot. On boot, the whole region is
+read at once and the valid record with the highest sequence number wins. A
+record that was only partly written fails its checksum, so the previous one
+is used instead.
+
+Changes are not written immediately. Each change restarts an AppPad timer,
+and the settings are written once the timer runs out, so a burst of changes
+costs a single write.
+
+Each record is a header followed by the payload:
+
+    magic (2 bytes)  sequence (uint32)  length (uint16)  checksum (uint16)
+
+The payload is the number of settings, then the name and a tagged value for
+each setting. None, bools, ints, floats and strings are supported.
+"""
+
+import struct
+
+try:
+    from typing import Any, Dict, Optional
+except ImportError:
+    pass
+
+from utils.constants import TIMER_SAVE_SETTINGS
+
+MAGIC = b"\xa5\x5a"
+HEADER_FORMAT = "<2sIHH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+
+
+def checksum(data) -> int:
+    """Return the Fletcher-16 checksum of data."""
+    low = high = 0
+    for byte in data:
+        low = (low + byte) % 255
+        high = (high + low) % 255
+    return (high << 8) | low
+
+
+def _encode_str(text: str) -> bytes:
+    encoded = text.encode("utf-8")
+    if len(encoded) > 255:
+        raise ValueError("%s is too long to persist" % text)
+    return bytes((len(encoded),)) + encoded
+
+
+def encode_settings(values: Dict[str, Any]) -> bytes:
+    """Serialize setting values into a payload.
+
+    Args:
+        values (Dict[str, Any]): The values to serialize, by setting name
+
+    Raises:
+        TypeError: If a value can't be serialized
+
+    Returns:
+        bytes: The payload
+    """
+    payload = bytearray((len(values),))
+    for name, value in values.items():
+        payload += _encode_str(name)
+        if value is None:
+            payload.append(_NONE)
+        elif value is True or value is False:
+            payload.append(_TRUE if value else _FALSE)
+        elif isinstance(value, int):
+            payload += struct.pack("<Bi", _INT, value)
+        elif isinstance(value, float):
+            payload += struct.pack("<Bf", _FLOAT, value)
+        elif isinstance(value, str):
+            payload.append(_STR)
+            payload += _encode_str(value)
+        else:
+            raise TypeError("Can't persist %s = %r" % (name, value))
+    return bytes(payload)
+
+
+def decode_settings(payload) -> Dict[str, Any]:
+    """Deserialize a payload written by encode_settings.
+
+    Args:
+        payload (bytes): The payload
+
+    Returns:
+        Dict[str, Any]: The values, by setting name
+    """
+    values = {}
+    index = 1
+    for _ in range(payload[0]):
+        length = payload[index]
+        name = bytes(payload[index + 1 : index + 1 + length]).decode("utf-8")
+        index += 1 + length
+        tag = payload[index]
+        index += 1
+        if tag == _NONE:
+            value = None
+        elif tag in (_TRUE, _FALSE):
+            value = tag == _TRUE
+        elif tag == _INT:
+            value = struct.unpack_from("<i", payload, index)[0]
+            index += 4
+        elif tag == _FLOAT:
+            value = struct.unpack_from("<f", payload, index)[0]
+            index += 4
+        elif tag == _STR:
+            length = payload[index]
+            value = bytes(payload[index + 1 : index + 1 + length]).decode("utf-8")
+            index += 1 + length
+        else:
+            raise ValueError("Unknown value tag %s" % tag)
+        values[name] = value
+    return values
+
+
+class FileNVM:
+    """A file which behaves like microcontroller.nvm.
+
+    Used on boards without NVM, or to try out the store on a computer.
+
+    """
+
+    def __init__(self, path: str, size: int = 4096):
+        """Initialize the FileNVM, creating the file if needed.
+
+        Args:
+            path (str): The path of the backing file
+            size (int, optional): The size of the memory in bytes.
+                Defaults to 4096.
+        """
+        self.path = path
+        self.size = size
+        try:
+            with open(path, "rb") as file_:
+                existing = file_.read()
+        except OSError:
+            existing = b""
+        if len(existing) < size:
+            with open(path, "wb") as file_:
+                file_.write(existing + b"\xff" * (size - len(existing)))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index):
+        with open(self.path, "rb") as file_:
+            if isinstance(index, slice):
+                start, stop, _ = index.indices(self.size)
+                file_.seek(start)
+                return file_.read(max(0, stop - start))
+            file_.seek(index)
+            return file_.read(1)[0]
+
+    def __setitem__(self, index, value):
+        if not isinstance(index, slice):
+            index, value = slice(index, index + 1), bytes((value,))
+        start, stop, _ = index.indices(self.size)
+        if stop - start != len(value):
+            raise ValueError("NVM slices can't change size")
+        with open(self.path, "r+b") as file_:
+            file_.seek(start)
+            file_.write(value)
+
+
+def default_nvm():
+    """Return microcontroller.nvm, or None if the board has no NVM."""
+    try:
+        import microcontroller
+    except ImportError:
+        return None
+    return getattr(microcontroller, "nvm", None)
+
+
+class SettingsStore:
+    """Saves settings to a ring of record slots in non-volatile memory."""
+
+    WRITE_DELAY = 2.0
+    # Seconds without changes before the settings are written
+
+    def __init__(
+        self, nvm=None, offset: int = 0, size: int = 1024, slot_size: int = 128
+    ):
+        """Initialize the SettingsStore.
+
+        Args:
+            nvm (optional): A bytearray-like object, such as
+                microcontroller.nvm or a FileNVM. Defaults to
+                microcontroller.nvm if the board has it.
+            offset (int, optional): The start of the region in nvm.
+                Defaults to 0.
+            size (int, optional): The size of the region in bytes.
+                Defaults to 1024.
+            slot_size (int, optional): The size of each record slot in bytes.
+                Defaults to 128.
+        """
+        self.nvm = default_nvm() if nvm is None else nvm
+        self.offset = offset
+        self.slot_size = slot_size
+        self.slots = 0
+        if self.nvm is not None:
+            size = min(size, len(self.nvm) - offset)
+            self.slots = size // slot_size
+
+        self._sequence = 0
+        self._slot = -1
+        self._last_payload: Optional[bytes] = None
+        self._settings = None
+        self._app_pad = None
+
+    @property
+    def available(self) -> bool:
+        """Return True if there is somewhere to save the settings."""
+        return self.slots > 0
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        """Read the most recent valid record in a single read.
+
+        Returns:
+            Optional[Dict[str, Any]]: The saved values, or None if nothing
+                has been saved
+        """
+        if not self.available:
+            return None
+
+        region = bytes(
+            self.nvm[self.offset : self.offset + self.slots * self.slot_size]
+        )
+        best = None
+        for slot in range(self.slots):
+            start = slot * self.slot_size
+            magic, sequence, length, check = struct.unpack_from(
+                HEADER_FORMAT, region, start
+            )
+            if magic != MAGIC or length > self.slot_size - HEADER_SIZE:
+                continue
+            payload = region[start + HEADER_SIZE : start + HEADER_SIZE + length]
+            if checksum(payload) != check:
+                continue
+            if best is None or sequence > best[0]:
+                best = (sequence, slot, payload)
+
+        if best is None:
+            return None
+        self._sequence, self._slot, self._last_payload = best
+        return decode_settings(self._last_payload)
+
+    def write(self, values: Dict[str, Any]) -> bool:
+        """Write values to the slot after the most recent record.
+
+        Nothing is written if the values haven't changed.
+
+        Args:
+            values (Dict[str, Any]): The values to save, by setting name
+
+        Raises:
+            ValueError: If the record doesn't fit in a slot
+
+        Returns:
+            bool: True if a record was written
+        """
+        if not self.available:
+            return False
+
+        payload = encode_settings(values)
+        if payload == self._last_payload:
+            return False
+        if len(payload) > self.slot_size - HEADER_SIZE:
+            raise ValueError("Settings don't fit in a %s byte slot" % self.slot_size)
+
+        self._sequence += 1
+        self._slot = (self._slot + 1) % self.slots
+        record = (
+            struct.pack(
+                HEADER_FORMAT, MAGIC, self._sequence, len(payload), checksum(payload)
+            )
+            + payload
+        )
+        start = self.offset + self._slot * self.slot_size
+        self.nvm[start : start + len(record)] = record
+        self._last_payload = payload
+        print("Saved settings to slot %s" % self._slot)
+        return True
+
+    def load(self, settings: "BaseSettings"):
+        """Restore the persistent settings saved by an earlier boot.
+
+        A saved value which is no longer valid for its setting, for example
+        a choice which was removed, is skipped and the setting keeps its
+        default.
+
+        Args:
+            settings (BaseSettings): The settings to update
+        """
+        values = self.read()
+        if not values:
+            return
+        for name in settings.persistent_settings:
+            if name in values:
+                try:
+                    settings[name] = values[name]
+                except (ValueError, TypeError) as err:
+                    print("Ignoring saved setting %s: %s" % (name, err))
+
+    def attach(self, app_pad: "AppPad", settings: "BaseSettings"):
+        """Save the persistent settings whenever they change.
+
+        Each change restarts a timer on app_pad, so a burst of changes is
+        written once.
+
+        Args:
+            app_pad (AppPad): The AppPad whose timers are used
+            settings (BaseSettings): The settings to save
+        """
+        self._app_pad = app_pad
+        self._settings = settings
+        for name in settings.persistent_settings:
+            settings.subscribe(name, self._setting_changed)
+
+    def persist(self, app_pad: "AppPad", settings: "BaseSettings"):
+        """Restore the persistent settings, then save them when they change.
+
+        Args:
+            app_pad (AppPad): The AppPad whose timers are used
+            settings (BaseSettings): The settings to restore and save
+        """
+        if not self.available:
+            print("No NVM available, settings won't be saved")
+            return
+        self.load(settings)
+        self.attach(app_pad, settings)
+
+    def save(self):
+        """Write the persistent settings now."""
+        settings = self._settings
+        if settings is not None:
+            self.write({name: settings[name] for name in settings.persistent_settings})
+
+    def _setting_changed(self, setting: str, value: Any):
+        self._app_pad.add_timer(TIMER_SAVE_SETTINGS, self.WRITE_DELAY, self.save)
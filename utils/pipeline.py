@@ -0,0 +1,952 @@
+"""
+Defines the stages of the event pipeline between the AppPad and an app.
+
+Each stage takes the events coming from the AppPad and may pass them on,
+drop them, delay them, merge them or add new ones. An app chooses its stages
+with BaseApp.pipeline_stages. When the app is focused, the stages are bound
+one after the other into a single chain of functions ending in
+BaseApp.process_event, so a stage the app doesn't use costs nothing per
+event.
+
+Stages which hold events back use AppPad timers, and pass the events on from
+the timer callback. Those events continue from the next stage, so they
+aren't processed twice. The timers are set on most key presses, so they are
+quiet and don't print to the serial console.
+"""
+
+import time
+from collections import namedtuple
+
+try:
+    from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+except ImportError:
+    pass
+
+from utils.app_pad import (
+    CHORD_EVENT,
+    DOUBLE_TAP_EVENT,
+    ENCODER_EVENT,
+    EVENT_TYPES,
+    HOLD_EVENT,
+    KEY_EVENT,
+    REPEAT_EVENT,
+    SEQUENCE_EVENT,
+    ChordEvent,
+    DoubleTapEvent,
+    EncoderEvent,
+    HoldEvent,
+    KeyEvent,
+    RepeatEvent,
+    SequenceEvent,
+)
+
+
+class DoubleTapBuffer:
+    """
+    A class to manage an event buffer for tracking double-tap events.
+
+    When creating the class, you pass it a list of key numbers it should track
+    for double-taps. This avoids detecting double-taps for keys with no
+    double-tap command.
+
+    The class defines a buffer_event method to add events to the buffer. It
+    also defines a drain_buffer event to pull items from the buffer.
+
+    When buffering an event, if the event does not match the pattern of a
+    double-tap, or if a double-tap was detected, an exception is raised
+    containing the events from the buffer that should be passed on to the app.
+
+    """
+
+    class DrainBufferException(Exception):
+        """
+        A base exception class that includes a list of buffered events to pass
+        back to the app.
+        """
+
+        def __init__(self, buffered_events: Iterable[KeyEvent]) -> None:
+            super().__init__()
+            self.buffered_events = list(buffered_events)
+
+    class UntrackedIndex(DrainBufferException):
+        """
+        Exception raised when attempting to buffer an event for an untracked
+        key.
+        """
+
+    class DifferentIndexInBuffer(DrainBufferException):
+        """
+        Exception raised when attempting to buffer an event for a tracked key
+        when there are already events in the buffer for another tracked key.
+        """
+
+    class UnexpectedState(DrainBufferException):
+        """
+        Exception raised when attempting to buffer an event for a tracked key
+        when the pressed state of the key does not match the expected state.
+        """
+
+    class DoubleTapDetected(Exception):
+        """
+        Exception raised when attempting to buffer an event and that event
+        completes a double tap.
+        """
+
+    def __init__(self, tracked_indices: Iterable[int]) -> None:
+        self._tracked_indices = set(tracked_indices)
+        self._buffered_events: List[KeyEvent] = []
+
+    def buffer_event(self, event: KeyEvent):
+        """Add an event to the buffer.
+
+        Args:
+            event (KeyEvent): The event to add to the buffer
+
+        Raises:
+            self.UntrackedIndex: Raised when the event you buffer is not
+                tracked by this Buffer instance. Includes any items in the
+                buffer that should be passed to the app.
+            self.DifferentIndexInBuffer: Raised when there are items in the
+                buffer with a different key number. The buffer is first
+                drained. Then the new event is added to the buffer, and the
+                previous events are returned in this exception.
+            self.DoubleTapDetected: Raised when the events in the buffer match
+                a double-tap state. No event is included in this exception.
+            self.UnexpectedState: Raised when the events in the buffer don't
+                follow the expected Press, Release, Press, Release pattern.
+                The events in the buffer are returned.
+        """
+        if event.number not in self._tracked_indices:
+            raise self.UntrackedIndex(self.drain_buffer())
+
+        if not self._buffered_events:
+            self._buffered_events.append(event)
+            return
+
+        if any(
+            buffered_event.number != event.number
+            for buffered_event in self._buffered_events
+        ):
+            buffered_events = self.drain_buffer()
+            self._buffered_events.append(event)
+            raise self.DifferentIndexInBuffer(buffered_events)
+
+        buffered_states = tuple(
+            buffered_event.pressed for buffered_event in self._buffered_events
+        )
+        if buffered_states == (True, False, True) and not event.pressed:
+            raise self.DoubleTapDetected()
+        elif buffered_states == (True, False) and event.pressed:
+            self._buffered_events.append(event)
+        elif buffered_states == (True,) and not event.pressed:
+            self._buffered_events.append(event)
+        else:
+            raise self.UnexpectedState(self.drain_buffer())
+
+    def drain_buffer(self) -> Iterable[KeyEvent]:
+        """Empty the buffer of events.
+
+        Since we are detecting double-taps, when we drain the buffer we only
+        want to return at most a press and release event. So if there are more
+        than two events in the buffer, we truncate the list.
+
+        Returns:
+            Iterable[KeyEvent]: The events which should be passed on to the app.
+        """
+        result = self._buffered_events
+        if len(result) > 2:
+            result = result[:2]
+
+        self._buffered_events = []
+
+        return result
+
+
+class Stage:
+    """A step in the event pipeline.
+
+    Subclasses implement bind, which returns the function that processes
+    each event. A stage that stays in the pipeline when the app compiles it
+    again is bound again, and should keep any state it needs.
+
+    """
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        """Bind the stage to an app and to the next stage.
+
+        Args:
+            app (BaseApp): The app the pipeline delivers events to
+            next_ (Callable): The next stage, taking an event
+
+        Returns:
+            Callable: A function taking an event, which passes any resulting
+                events to next_
+        """
+        raise NotImplementedError("Stage must be implemented")
+
+    def unbind(self):
+        """Drop any events still held, and cancel any timers."""
+        pass
+
+
+def compile_pipeline(
+    app: "BaseApp", stages: Iterable[Stage], sink: Callable
+) -> Callable:
+    """Bind stages into a single chain ending in sink.
+
+    Args:
+        app (BaseApp): The app the events are delivered to
+        stages (Iterable[Stage]): The stages, in the order events pass through
+        sink (Callable): The final function taking each event
+
+    Returns:
+        Callable: The function taking each event from the AppPad
+    """
+    head = sink
+    for stage in reversed(tuple(stages)):
+        head = stage.bind(app, head)
+    return head
+
+
+class LoggingStage(Stage):
+    """Print each event on the serial console."""
+
+    def __init__(self, prefix: str = "Event"):
+        """Initialize the LoggingStage.
+
+        Args:
+            prefix (str, optional): Printed before each event.
+                Defaults to "Event".
+        """
+        self.prefix = prefix
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        prefix = self.prefix
+
+        def log(event):
+            print(prefix, event)
+            next_(event)
+
+        return log
+
+
+class ActivityStage(Stage):
+    """Call a function with each event before it is handled.
+
+    If the function returns True, the event is consumed. KeyApp uses this to
+    wake up when the pixels are disabled.
+
+    """
+
+    def __init__(self, callback: Callable[[tuple], bool]):
+        """Initialize the ActivityStage.
+
+        Args:
+            callback (Callable[[tuple], bool]): Called with each event. Return
+                True to stop the event.
+        """
+        self.callback = callback
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        callback = self.callback
+
+        def track(event):
+            if not callback(event):
+                next_(event)
+
+        return track
+
+
+class RateLimitStage(Stage):
+    """Drop events of some types that follow too closely on the last one."""
+
+    def __init__(self, min_interval: float, event_types: Tuple[int, ...]):
+        """Initialize the RateLimitStage.
+
+        Args:
+            min_interval (float): The minimum time in seconds between events
+            event_types (Tuple[int, ...]): The type tags of the events to
+                limit. Other events always pass.
+        """
+        self.min_interval_ns = int(min_interval * 1000000000)
+        self.event_types = event_types
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        min_interval_ns = self.min_interval_ns
+        limited = [type_ in self.event_types for type_ in range(EVENT_TYPES)]
+        last = [0] * EVENT_TYPES
+
+        def limit(event):
+            type_ = event[0]
+            if limited[type_]:
+                now = time.monotonic_ns()
+                if now - last[type_] < min_interval_ns:
+                    return
+                last[type_] = now
+            next_(event)
+
+        return limit
+
+
+class EncoderCoalescingStage(Stage):
+    """Merge encoder events arriving close together into one event.
+
+    The merged event spans from the first previous_position to the last
+    position, so an app that handles every step of the rotation sees the same
+    steps with less work. Any other event first passes on the pending
+    rotation, so the order of events is kept.
+
+    """
+
+    TIMER_ID = "_FLUSH_ENCODER_EVENTS"
+    # The ID of the timer that passes on the merged event
+
+    def __init__(self, window: float = 0.05):
+        """Initialize the EncoderCoalescingStage.
+
+        Args:
+            window (float, optional): How long in seconds to wait for more
+                rotation after the first event. Defaults to 0.05.
+        """
+        self.window = window
+        self._app_pad = None
+        self._pending: Optional[EncoderEvent] = None
+        self._next: Optional[Callable] = None
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        self._app_pad = app.app_pad
+        self._next = next_
+
+        def coalesce(event):
+            pending = self._pending
+            if event[0] == ENCODER_EVENT:
+                if pending is None:
+                    self._pending = event
+                    self._app_pad.add_timer(
+                        self.TIMER_ID, self.window, self.flush, quiet=True
+                    )
+                else:
+                    self._pending = EncoderEvent(
+                        ENCODER_EVENT, event.position, pending.previous_position
+                    )
+                return
+
+            if pending is not None:
+                self._app_pad.delete_timer(self.TIMER_ID)
+                self.flush()
+            next_(event)
+
+        return coalesce
+
+    def flush(self):
+        """Pass on the merged rotation, if any."""
+        pending = self._pending
+        self._pending = None
+        if pending is not None and pending.position != pending.previous_position:
+            self._next(pending)
+
+    def unbind(self):
+        self._pending = None
+        if self._app_pad is not None:
+            self._app_pad.delete_timer(self.TIMER_ID)
+
+
+class DoubleTapStage(Stage):
+    """Turn two quick taps of a key into a pair of DoubleTapEvents.
+
+    Only the keys in the app's double_tap_key_indices are tracked. Events for
+    a tracked key are held for up to TIMEOUT seconds, in case it is tapped
+    again.
+
+    """
+
+    TIMEOUT = 0.2
+    # The delay in seconds to clear the double tap buffer
+
+    TIMER_ID = "_DRAIN_DOUBLE_TAP_BUFFER"
+    # The ID of the timer to clear the double tap buffer
+
+    def __init__(self):
+        self._app_pad = None
+        self._buffer: Optional[DoubleTapBuffer] = None
+        self._next: Optional[Callable] = None
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        indices = app.double_tap_key_indices
+        self._app_pad = app.app_pad
+        self._buffer = DoubleTapBuffer(indices)
+        self._next = next_
+
+        def detect(event):
+            if event[0] != KEY_EVENT:
+                next_(event)
+                return
+            for result in self.buffer_event(event):
+                next_(result)
+
+        return detect
+
+    def buffer_event(self, event: KeyEvent) -> Iterable[KeyEvent]:
+        """Buffer a key event and return any events to pass on.
+
+        Args:
+            event (KeyEvent): The KeyEvent that was triggered.
+
+        Returns:
+            Iterable[Union[DoubleTapEvent, KeyEvent]]:
+                An iterable of events resulting from buffering the event.
+                This may be the events from the buffer or the DoubleTapEvents
+                of a completed DoubleTap.
+        """
+        buffer = self._buffer
+        try:
+            buffer.buffer_event(event)
+        except buffer.DrainBufferException as err:
+            self._app_pad.delete_timer(self.TIMER_ID)
+            result = list(err.buffered_events)
+            result.append(event)
+            return result
+        except buffer.DoubleTapDetected:
+            self._app_pad.delete_timer(self.TIMER_ID)
+            buffer.drain_buffer()
+            return (
+                DoubleTapEvent(DOUBLE_TAP_EVENT, event.number, True),
+                DoubleTapEvent(DOUBLE_TAP_EVENT, event.number, False),
+            )
+        else:
+            self._app_pad.add_timer(self.TIMER_ID, self.TIMEOUT, self.drain, quiet=True)
+            return ()
+
+    def drain(self):
+        """Pass on the events held in the buffer."""
+        if self._buffer is not None:
+            for event in self._buffer.drain_buffer():
+                self._next(event)
+
+    def unbind(self):
+        if self._app_pad is not None:
+            self._app_pad.delete_timer(self.TIMER_ID)
+        self._buffer = None
+
+
+class HoldStage(Stage):
+    """Turn a key held down past its hold time into a pair of HoldEvents.
+
+    Only the keys with a hold time in the app's hold_times are tracked. The
+    press of a tracked key is held back until the key is released, which
+    passes on the press and the release, or until its hold time passes,
+    which passes on a HoldEvent instead. Releasing a held key passes on a
+    second HoldEvent, with pressed False. Any other key event passes on a
+    pending press first, so the order of events is kept, and keys without a
+    hold time are never delayed.
+
+    """
+
+    TIMER_ID = "_DETECT_HOLD"
+    # The ID of the timer that detects a held key
+
+    def __init__(self):
+        self._app_pad = None
+        self._next: Optional[Callable] = None
+        # The press of a tracked key, until it is released or held
+        self._pending: Optional[KeyEvent] = None
+        # A bit for each key number which is being held
+        self._holding = 0
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        hold_times = app.hold_times
+        self._app_pad = app.app_pad
+        self._next = next_
+
+        def detect(event):
+            if event[0] != KEY_EVENT:
+                next_(event)
+                return
+
+            number = event.number
+            pending = self._pending
+            if pending is not None:
+                self._pending = None
+                self._app_pad.delete_timer(self.TIMER_ID)
+                next_(pending)
+                if pending.number == number:
+                    # Released before the hold time, so it was a tap
+                    next_(event)
+                    return
+
+            bit = 1 << number
+            if event.pressed:
+                hold_time = hold_times[number]
+                if hold_time is not None:
+                    self._pending = event
+                    self._app_pad.add_timer(
+                        self.TIMER_ID, hold_time, self.hold, quiet=True
+                    )
+                    return
+            elif self._holding & bit:
+                self._holding &= ~bit
+                next_(HoldEvent(HOLD_EVENT, number, False))
+                return
+            next_(event)
+
+        return detect
+
+    def hold(self):
+        """Pass on a HoldEvent for the pending press."""
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+        self._holding |= 1 << pending.number
+        self._next(HoldEvent(HOLD_EVENT, pending.number, True))
+
+    def unbind(self):
+        if self._app_pad is not None:
+            self._app_pad.delete_timer(self.TIMER_ID)
+        self._pending = None
+        self._holding = 0
+
+
+def chord_mask(keys: Iterable[int]) -> int:
+    """Return the bitmask for a chord of key numbers.
+
+    Args:
+        keys (Iterable[int]): The key numbers in the chord
+
+    Raises:
+        ValueError: If there are fewer than two different keys, or a key
+            number isn't between 0 and 11
+
+    Returns:
+        int: The bitmask, with bit n set for key number n
+    """
+    mask = 0
+    count = 0
+    for number in keys:
+        if not 0 <= number <= 11:
+            raise ValueError("Invalid key number in chord: %r" % (number,))
+        bit = 1 << number
+        if not mask & bit:
+            mask |= bit
+            count += 1
+    if count < 2:
+        raise ValueError("A chord needs at least two keys")
+    return mask
+
+
+class ChordTable:
+    """The chords of an app, compiled into a lookup table.
+
+    Every set of keys that is part of a chord maps to whether it is a whole
+    chord, and whether it is part of a larger one. Each key press in the
+    ChordStage is a single dict lookup.
+
+    """
+
+    COMPLETE = 1
+    # Set for a set of keys which is a chord
+
+    PARTIAL = 2
+    # Set for a set of keys which is part of a larger chord
+
+    def __init__(self, masks: Iterable[int]):
+        """Initialize the ChordTable.
+
+        Args:
+            masks (Iterable[int]): The bitmask of each chord
+        """
+        # The keys that are in any chord
+        self.keys = 0
+        self.states: Dict[int, int] = {}
+        for mask in masks:
+            self.keys |= mask
+            self.states[mask] = self.states.get(mask, 0) | self.COMPLETE
+            part = (mask - 1) & mask
+            while part:
+                self.states[part] = self.states.get(part, 0) | self.PARTIAL
+                part = (part - 1) & mask
+
+
+class ChordStage(Stage):
+    """Turn keys pressed together into a pair of ChordEvents.
+
+    Only the keys in the app's chord_table are tracked. The presses of
+    tracked keys are held back until they make a chord that isn't part of a
+    larger one, until timeout passes, or until a key is released or another
+    key is pressed. Then either a ChordEvent is passed on, if the keys make a
+    chord, or the presses are passed on one by one. The second ChordEvent, with
+    pressed False, is passed on once every key of the chord is released.
+
+    Keys which aren't in any chord are never delayed.
+
+    """
+
+    TIMER_ID = "_DETECT_CHORD"
+    # The ID of the timer that ends the wait for a chord
+
+    def __init__(self, timeout: float = 0.05):
+        """Initialize the ChordStage.
+
+        Args:
+            timeout (float, optional): How long in seconds to wait for the
+                rest of a chord after the first key. Defaults to 0.05.
+        """
+        self.timeout = timeout
+        self._app_pad = None
+        self._next: Optional[Callable] = None
+        self._states: Dict[int, int] = {}
+        # The presses held back, and the bitmask of their keys
+        self._buffer: List[KeyEvent] = []
+        self._pending = 0
+        # The tracked keys which are down
+        self._held = 0
+        # The chord last passed on, and those of its keys still down
+        self._chord = 0
+        self._chord_down = 0
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        table = app.chord_table
+        chord_keys = table.keys
+        states = table.states
+        self._app_pad = app.app_pad
+        self._next = next_
+        self._states = states
+
+        def detect(event):
+            if event[0] != KEY_EVENT:
+                next_(event)
+                return
+
+            bit = 1 << event.number
+            if not chord_keys & bit:
+                if self._pending:
+                    self.resolve()
+                next_(event)
+                return
+
+            if event.pressed:
+                self._held |= bit
+                mask = self._pending | bit
+                state = states.get(mask, 0)
+                if not state:
+                    # The key doesn't make a chord with the ones held back
+                    self.resolve()
+                    mask = bit
+                    state = states[bit]
+                if not self._pending:
+                    self._app_pad.add_timer(
+                        self.TIMER_ID, self.timeout, self.resolve, quiet=True
+                    )
+                self._pending = mask
+                self._buffer.append(event)
+                if state == ChordTable.COMPLETE:
+                    self.resolve()
+                return
+
+            if self._pending:
+                self.resolve()
+            self._held &= ~bit
+            if self._chord_down & bit:
+                self._chord_down &= ~bit
+                if not self._chord_down:
+                    self._release_chord()
+                return
+            next_(event)
+
+        return detect
+
+    def resolve(self):
+        """Pass on the presses held back, as a chord if they make one."""
+        if not self._pending:
+            return
+        self._app_pad.delete_timer(self.TIMER_ID)
+        pending = self._pending
+        buffer = self._buffer
+        self._pending = 0
+        self._buffer = []
+
+        if not self._states.get(pending, 0) & ChordTable.COMPLETE:
+            for event in buffer:
+                self._next(event)
+            return
+
+        if self._chord:
+            self._release_chord()
+        self._chord = pending
+        self._chord_down = pending & self._held
+        self._next(ChordEvent(CHORD_EVENT, pending, True))
+
+    def _release_chord(self):
+        chord = self._chord
+        self._chord = 0
+        self._chord_down = 0
+        if chord:
+            self._next(ChordEvent(CHORD_EVENT, chord, False))
+
+    def unbind(self):
+        if self._app_pad is not None:
+            self._app_pad.delete_timer(self.TIMER_ID)
+        self._buffer = []
+        self._pending = 0
+        self._held = 0
+        self._chord = 0
+        self._chord_down = 0
+
+
+def compile_sequence_trie(sequences: Dict[Tuple[int, ...], Any]) -> Dict[int, Any]:
+    """Compile leader sequences into a trie.
+
+    Each node of the trie is a dict mapping the next key number to either a
+    node, or the value of the sequence ending with that key.
+
+    Args:
+        sequences (Dict[Tuple[int, ...], Any]): The value of each sequence of
+            key numbers
+
+    Raises:
+        ValueError: If a sequence is empty, has a key number that isn't
+            between 0 and 11, or is the start of another sequence
+
+    Returns:
+        Dict[int, Any]: The root node of the trie
+    """
+    trie: Dict[int, Any] = {}
+    for keys, value in sequences.items():
+        if not keys:
+            raise ValueError("A sequence needs at least one key")
+        for number in keys:
+            if not 0 <= number <= 11:
+                raise ValueError("Invalid key number in sequence: %r" % (keys,))
+
+        node = trie
+        for number in keys[:-1]:
+            child = node.setdefault(number, {})
+            if not isinstance(child, dict):
+                raise ValueError("Sequence %r starts with another sequence" % (keys,))
+            node = child
+        if keys[-1] in node:
+            raise ValueError("Sequence %r is the start of another sequence" % (keys,))
+        node[keys[-1]] = value
+    return trie
+
+
+class LeaderStage(Stage):
+    """Match key presses after a leader key against the app's sequences.
+
+    The stage does nothing until start is called, usually by a
+    LeaderCommand. Each key press then moves one step down the app's
+    sequence_trie. Presses which continue a sequence are consumed, and the
+    app is asked to show the keys which can come next. The press which
+    completes a sequence is passed on as a SequenceEvent, and so is its
+    release. A key which doesn't continue any sequence, or no key press
+    within timeout, cancels the sequence.
+
+    """
+
+    TIMER_ID = "_CANCEL_LEADER"
+    # The ID of the timer that cancels a sequence
+
+    def __init__(self, timeout: float = 2.0):
+        """Initialize the LeaderStage.
+
+        Args:
+            timeout (float, optional): How long in seconds to wait for each
+                key of a sequence. Defaults to 2.0.
+        """
+        self.timeout = timeout
+        self._app = None
+        self._next: Optional[Callable] = None
+        self._trie: Dict[int, Any] = {}
+        # The trie node reached so far, or None when no sequence is started
+        self._node: Optional[Dict[int, Any]] = None
+        self._sequence: List[int] = []
+        # The keys whose release is consumed
+        self._consumed = 0
+        # The last key of the last sequence matched, until it is released
+        self._last_number: Optional[int] = None
+        self._last_value: Any = None
+
+    @property
+    def active(self) -> bool:
+        """Return True while a sequence is being entered."""
+        return self._node is not None
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        self._app = app
+        self._next = next_
+        self._trie = app.sequence_trie
+
+        def lead(event):
+            if event[0] != KEY_EVENT:
+                next_(event)
+                return
+
+            number = event.number
+            bit = 1 << number
+            if not event.pressed:
+                if self._consumed & bit:
+                    self._consumed &= ~bit
+                elif number == self._last_number:
+                    self._release_last()
+                else:
+                    next_(event)
+                return
+
+            node = self._node
+            if node is None:
+                next_(event)
+                return
+
+            self._consumed |= bit
+            child = node.get(number)
+            if child is None:
+                self.cancel()
+                return
+
+            self._sequence.append(number)
+            if isinstance(child, dict):
+                self._node = child
+                self._app.app_pad.add_timer(
+                    self.TIMER_ID, self.timeout, self.cancel, quiet=True
+                )
+                self._app.show_sequence_hints(child, self._sequence)
+                return
+
+            self._consumed &= ~bit
+            self.cancel()
+            self._release_last()
+            self._last_number = number
+            self._last_value = child
+            next_(SequenceEvent(SEQUENCE_EVENT, child, True))
+
+        return lead
+
+    def start(self):
+        """Start matching a sequence from the next key press."""
+        self._node = self._trie
+        self._sequence = []
+        self._app.app_pad.add_timer(
+            self.TIMER_ID, self.timeout, self.cancel, quiet=True
+        )
+        self._app.show_sequence_hints(self._trie, self._sequence)
+
+    def cancel(self):
+        """Stop matching a sequence, and ask the app to hide the hints."""
+        if self._node is None:
+            return
+        self._node = None
+        self._app.app_pad.delete_timer(self.TIMER_ID)
+        self._app.hide_sequence_hints()
+
+    def _release_last(self):
+        if self._last_number is None:
+            return
+        value = self._last_value
+        self._last_number = None
+        self._last_value = None
+        self._next(SequenceEvent(SEQUENCE_EVENT, value, False))
+
+    def unbind(self):
+        if self._app is not None:
+            self._app.app_pad.delete_timer(self.TIMER_ID)
+        self._node = None
+        self._consumed = 0
+        self._last_number = None
+        self._last_value = None
+
+
+# How a held key repeats. The first repeat comes after delay seconds, and
+# the next after interval seconds. Each interval after that is acceleration
+# times the one before, down to min_interval.
+RepeatRate = namedtuple(
+    "RepeatRate", ("delay", "interval", "acceleration", "min_interval")
+)
+
+
+class RepeatStage(Stage):
+    """Send RepeatEvents while a key which repeats is held down.
+
+    Only the keys with a RepeatRate in the app's repeat_rates repeat. The
+    repeats are timed by an AppPad timer, and each is scheduled from when
+    the previous one was due, so the rate doesn't depend on how often events
+    are checked. Like a keyboard, only the last key pressed repeats.
+
+    """
+
+    TIMER_ID = "_REPEAT_KEY"
+    # The ID of the timer that sends the next repeat
+
+    def __init__(self):
+        self._app_pad = None
+        self._next: Optional[Callable] = None
+        # The key repeating, its rate, the current interval and the time the
+        # next repeat is due
+        self._number: Optional[int] = None
+        self._rate: Optional[RepeatRate] = None
+        self._interval = 0.0
+        self._due = 0.0
+
+    def bind(self, app: "BaseApp", next_: Callable) -> Callable:
+        rates = app.repeat_rates
+        self._app_pad = app.app_pad
+        self._next = next_
+
+        def repeat(event):
+            if event[0] != KEY_EVENT:
+                next_(event)
+                return
+
+            number = event.number
+            if not event.pressed:
+                if number == self._number:
+                    self.stop()
+                next_(event)
+                return
+
+            if self._number is not None:
+                self.stop()
+            next_(event)
+            rate = rates[number]
+            if rate is not None:
+                self.start(number, rate)
+
+        return repeat
+
+    def start(self, number: int, rate: RepeatRate):
+        """Start repeating a key.
+
+        Args:
+            number (int): The key number
+            rate (RepeatRate): How the key repeats
+        """
+        self._number = number
+        self._rate = rate
+        self._interval = rate.interval
+        self._due = time.monotonic() + rate.delay
+        self._app_pad.add_timer(self.TIMER_ID, rate.delay, self.tick, quiet=True)
+
+    def stop(self):
+        """Stop repeating."""
+        self._number = None
+        self._app_pad.delete_timer(self.TIMER_ID)
+
+    def tick(self):
+        """Send a repeat, and schedule the next one."""
+        number = self._number
+        if number is None:
+            return
+
+        rate = self._rate
+        self._due += self._interval
+        self._interval = max(rate.min_interval, self._interval * rate.acceleration)
+        now = time.monotonic()
+        if self._due < now:
+            # Fell behind, so skip the missed repeats rather than bursting
+            self._due = now + self._interval
+        self._app_pad.add_timer(self.TIMER_ID, self._due - now, self.tick, quiet=True)
+        self._next(RepeatEvent(REPEAT_EVENT, number))
+
+    def unbind(self):
+        if self._app_pad is not None:
+            self._app_pad.delete_timer(self.TIMER_ID)
+        self._number = None
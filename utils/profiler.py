@@ -0,0 +1,214 @@
+"""
+Defines an opt-in profiler for finding out which parts of boot are slow.
+
+Set APP_PAD_BOOT_PROFILE = 1 in settings.toml to enable it. While enabled, it
+records the elapsed time and the change in gc.mem_free() for every module
+import, every app construction and the first render. When the first app has
+rendered, it prints a report sorted by time and saves it to
+boot_profile.txt. A one line summary of each boot is appended to
+boot_profile.log, so regressions can be tracked across boots.
+
+Sections may be nested, so the time of a section includes the time of the
+sections inside it.
+"""
+
+import gc
+import os
+import sys
+import time
+
+try:
+    from typing import List, Tuple
+except ImportError:
+    pass
+
+try:
+    import builtins
+except ImportError:
+    builtins = None
+
+ENABLE_VARIABLE = "APP_PAD_BOOT_PROFILE"
+REPORT_FILE = "/boot_profile.txt"
+LOG_FILE = "/boot_profile.log"
+
+
+def _mem_free() -> int:
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return 0
+
+
+class _NullSection:
+    """A section that records nothing, used while the profiler is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class _Section:
+    """A timed section of boot."""
+
+    def __init__(self, profiler: "BootProfiler", label: str):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.profiler._depth += 1
+        self.start_free = _mem_free()
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.monotonic_ns() - self.start
+        self.profiler._depth -= 1
+        self.profiler.record(
+            self.label, elapsed, self.start_free - _mem_free(), self.profiler._depth
+        )
+        return False
+
+
+class BootProfiler:
+    """Records the time and memory used by each part of boot."""
+
+    def __init__(self):
+        self.enabled = False
+        self.records: List[Tuple[str, int, int, int]] = []
+        self._depth = 0
+        self._start = 0
+        self._start_free = 0
+        self._original_import = None
+
+    def start(self, force: bool = False):
+        """Start profiling if enabled in settings.toml or if force is True.
+
+        Args:
+            force (bool, optional): Start even if not enabled in
+                settings.toml. Defaults to False.
+        """
+        if not (force or self._enabled_in_settings()):
+            return
+
+        self.enabled = True
+        self.records = []
+        self._start = time.monotonic_ns()
+        self._start_free = _mem_free()
+        self._install_import_hook()
+        print("Boot profiler started")
+
+    def section(self, label: str):
+        """Return a context manager that records the time and memory used.
+
+        Args:
+            label (str): The label for the section in the report
+        """
+        if not self.enabled:
+            return _NULL_SECTION
+        return _Section(self, label)
+
+    def record(self, label: str, elapsed_ns: int, allocated: int, depth: int = 0):
+        """Record a section of boot.
+
+        Args:
+            label (str): The label for the section
+            elapsed_ns (int): The elapsed time in nanoseconds
+            allocated (int): The decrease in free memory in bytes
+            depth (int, optional): How deeply the section is nested.
+                Defaults to 0.
+        """
+        if self.enabled:
+            self.records.append((label, elapsed_ns, allocated, depth))
+
+    def finish(self):
+        """Stop profiling, then print and save the report."""
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        self._remove_import_hook()
+
+        total = time.monotonic_ns() - self._start
+        allocated = self._start_free - _mem_free()
+        report = self.report(total, allocated)
+        print(report)
+
+        summary = "total {0:.1f} ms, {1} bytes, {2} sections\n".format(
+            total / 1000000, allocated, len(self.records)
+        )
+        self._write(REPORT_FILE, "w", report)
+        self._write(LOG_FILE, "a", summary)
+
+    def report(self, total_ns: int, allocated: int) -> str:
+        """Return the report, with the slowest sections first.
+
+        Args:
+            total_ns (int): The total boot time in nanoseconds
+            allocated (int): The total decrease in free memory in bytes
+
+        Returns:
+            str: The report
+        """
+        lines = [
+            "Boot profile: {0:.1f} ms, {1} bytes".format(total_ns / 1000000, allocated),
+            "{0:>10} {1:>8}  {2}".format("ms", "bytes", "section"),
+        ]
+        for label, elapsed, used, depth in sorted(
+            self.records, key=lambda record: -record[1]
+        ):
+            lines.append(
+                "{0:>10.1f} {1:>8}  {2}{3}".format(
+                    elapsed / 1000000, used, "  " * depth, label
+                )
+            )
+        return "\n".join(lines)
+
+    @staticmethod
+    def _enabled_in_settings() -> bool:
+        try:
+            value = os.getenv(ENABLE_VARIABLE)
+        except AttributeError:
+            return False
+        return value not in (None, 0, "", "0")
+
+    @staticmethod
+    def _write(path: str, mode: str, text: str):
+        try:
+            with open(path, mode) as file_:
+                file_.write(text)
+        except OSError as err:
+            # The filesystem is read-only unless boot.py remounts it
+            print("Unable to write %s: %s" % (path, err))
+
+    def _install_import_hook(self):
+        if builtins is None:
+            return
+
+        original_import = builtins.__import__
+
+        def profiled_import(name, *args):
+            if not self.enabled or not name or name in sys.modules:
+                return original_import(name, *args)
+            with self.section("import " + name):
+                return original_import(name, *args)
+
+        try:
+            builtins.__import__ = profiled_import
+        except (AttributeError, TypeError):
+            print("Boot profiler can't time individual imports")
+            return
+        self._original_import = original_import
+
+    def _remove_import_hook(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+
+# The profiler shared by the whole app
+boot_profiler = BootProfiler()
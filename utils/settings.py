@@ -1,35 +1,216 @@
+"""Defines the settings shared by apps.
+
+Settings are declared as class attributes on a BaseSettings subclass. Use a
+Setting to give a setting a type, choices or a validator. Any other public
+class attribute is a setting with no checks. A subclass may override the
+default of an inherited setting by assigning a plain value, which is checked
+against the inherited declaration.
+
+The declared settings of each class are compiled into a schema the first time
+the class is instantiated. settings[key] and settings.get look the name up in
+the schema and read the attribute directly, without raising and catching
+exceptions. Settings that aren't declared are kept in additional_settings.
+"""
+
 try:
-    from typing import Any, Dict
+    from typing import Any, Callable, Dict, List, Optional, Tuple
 except ImportError:
     pass
 
 from utils.constants import EMPTY_VALUE
 
 
+class Setting:
+    """The declaration of a setting, with its default value and checks."""
+
+    def __init__(
+        self,
+        default: Any = None,
+        type_: Optional[type] = None,
+        choices: Optional[Tuple] = None,
+        validator: Optional[Callable[[Any], bool]] = None,
+    ):
+        """Initialize the Setting.
+
+        Args:
+            default (Any, optional): The default value. Defaults to None.
+            type_ (Optional[type], optional): If given, values must be
+                instances of this type. Defaults to None.
+            choices (Optional[Tuple], optional): If given, values must be one
+                of these. Defaults to None.
+            validator (Optional[Callable[[Any], bool]], optional): If given,
+                values are only accepted if it returns True. Defaults to None.
+        """
+        self.default = default
+        self.type_ = type_
+        self.choices = choices
+        self.validator = validator
+
+    def validate(self, name: str, value: Any) -> Any:
+        """Check a value for the setting.
+
+        Args:
+            name (str): The name of the setting, for the error message
+            value (Any): The value to check
+
+        Raises:
+            ValueError: If the value isn't valid for the setting
+
+        Returns:
+            Any: The value
+        """
+        if (
+            (self.type_ is not None and not isinstance(value, self.type_))
+            or (self.choices is not None and value not in self.choices)
+            or (self.validator is not None and not self.validator(value))
+        ):
+            raise ValueError("Invalid value for %s: %r" % (name, value))
+        return value
+
+    def with_default(self, name: str, default: Any) -> "Setting":
+        """Return a copy of the setting with a different default.
+
+        Args:
+            name (str): The name of the setting, for the error message
+            default (Any): The new default
+
+        Raises:
+            ValueError: If the default isn't valid for the setting
+
+        Returns:
+            Setting: The copy
+        """
+        return Setting(
+            self.validate(name, default), self.type_, self.choices, self.validator
+        )
+
+
+# Schemas compiled so far, keyed by settings class
+_schemas: Dict[type, Dict[str, Setting]] = {}
+
+# Attribute names of BaseSettings itself, which are never settings
+_reserved: Optional[set] = None
+
+
+def settings_schema(cls: type) -> Dict[str, Setting]:
+    """Return the schema for a BaseSettings subclass, compiling it if needed.
+
+    Setting declarations on the class are replaced with their default value,
+    so reading a setting that was never set is a plain class attribute
+    lookup.
+
+    Args:
+        cls (type): A BaseSettings subclass
+
+    Returns:
+        Dict[str, Setting]: The setting declarations, by name
+    """
+    global _reserved
+
+    schema = _schemas.get(cls)
+    if schema is not None:
+        return schema
+
+    if _reserved is None:
+        _reserved = set(dir(BaseSettings))
+        _reserved.add("additional_settings")
+
+    schema = {}
+    for base in cls.__bases__:
+        if base is not object and issubclass(base, BaseSettings):
+            schema.update(settings_schema(base))
+
+    for name in dir(cls):
+        if name.startswith("_") or name in _reserved:
+            continue
+        value = getattr(cls, name)
+        if isinstance(value, Setting):
+            schema[name] = value
+            setattr(cls, name, value.default)
+        elif name in schema:
+            if value is not schema[name].default:
+                schema[name] = schema[name].with_default(name, value)
+        elif not callable(value) and not isinstance(value, property):
+            schema[name] = Setting(value)
+
+    _schemas[cls] = schema
+    return schema
+
+
 class BaseSettings:
+    """A set of settings shared by apps.
+
+    Subclasses must call BaseSettings.__init__ before using settings[key].
+
+    """
+
     additional_settings: Dict[str, Any]
 
+    # Incremented whenever a setting is changed with settings[key] = value,
+    # so cached renders can tell whether they are still valid
+    version: int = 0
+
+    # The settings saved across reboots by a SettingsStore
+    persistent_settings: Tuple[str, ...] = ()
+
+    # Callbacks for each setting name, created by the first subscribe
+    _subscribers: Optional[Dict[str, List[Callable[[str, Any], None]]]] = None
+
     def __init__(self, **kwargs):
+        self._schema = settings_schema(self.__class__)
         self.additional_settings = {}
         for key, value in kwargs.items():
             self[key] = value
 
     def __getitem__(self, key: str) -> Any:
-        try:
+        if key in self._schema:
             return getattr(self, key)
-        except AttributeError:
-            return self.additional_settings[key]
+        return self.additional_settings[key]
 
     def __setitem__(self, key, value) -> None:
-        try:
-            setattr(self, key, value)
-        except:
+        setting = self._schema.get(key)
+        if setting is not None:
+            setattr(self, key, setting.validate(key, value))
+        else:
             self.additional_settings[key] = value
+        self.version += 1
+
+        if self._subscribers:
+            for callback in tuple(self._subscribers.get(key, ())):
+                callback(key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._schema or key in self.additional_settings
+
+    def subscribe(self, setting: str, callback: Callable[[str, Any], None]):
+        """Call callback whenever setting is changed with settings[key] = value.
+
+        Args:
+            setting (str): The name of the setting
+            callback (Callable[[str, Any], None]): Called with the name and
+                the new value of the setting
+        """
+        if self._subscribers is None:
+            self._subscribers = {}
+        subscribers = self._subscribers.setdefault(setting, [])
+        if callback not in subscribers:
+            subscribers.append(callback)
+
+    def unsubscribe(self, setting: str, callback: Callable[[str, Any], None]):
+        """Stop calling callback when setting is changed.
+
+        Args:
+            setting (str): The name of the setting
+            callback (Callable[[str, Any], None]): A subscribed callback
+        """
+        subscribers = self._subscribers and self._subscribers.get(setting)
+        if subscribers and callback in subscribers:
+            subscribers.remove(callback)
 
     def get(self, setting: str, default=EMPTY_VALUE) -> Any:
-        try:
-            return self[setting]
-        except KeyError as err:
-            if default is EMPTY_VALUE:
-                raise err
-            return default
+        if setting in self._schema:
+            return getattr(self, setting)
+        value = self.additional_settings.get(setting, default)
+        if value is EMPTY_VALUE:
+            raise KeyError(setting)
+        return value